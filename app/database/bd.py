@@ -1,25 +1,181 @@
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
-from app.models.userschema import table_registry
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from schemas import table_registry
 import os
 
 load_dotenv()
 
-DATABASE_URL = os.getenv('DATABASE_URL_UNPOOL')
-print(DATABASE_URL)
 
-engine = create_engine(DATABASE_URL,echo=True,) 
-table_registry.metadata.create_all(engine)
+def env_flag(name, default=False):
+    """Lê uma variável de ambiente booleana ('1', 'true', 'yes', 'on')."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+DATABASE_URL = os.getenv('DATABASE_URL') or os.getenv('DATABASE_URL_UNPOOL')
+
+# Pool de conexões (por processo; cada worker do pool de carga tem o seu)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))  # Conexões mantidas abertas
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))  # Conexões extras em picos de uso
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))  # Segundos aguardando uma conexão livre
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # Recria conexões mais antigas que isso (segundos)
+DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', True)  # Testa a conexão antes de usar (quedas do servidor)
+
+DB_ECHO = env_flag('DB_ECHO')  # Loga todos os comandos SQL (somente para depuração)
+DB_CREATE_SCHEMA = env_flag('DB_CREATE_SCHEMA')  # Cria as tabelas que ainda não existem antes da carga
+
+
+def engine_options(**options):
+    """Parâmetros de create_engine lidos das variáveis de ambiente DB_*, sobrescritos por options."""
+    settings = {
+        'echo': DB_ECHO,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    settings.update(options)
+    return settings
+
+
+def create_db_engine(url=DATABASE_URL, **options):
+    """
+    Cria o engine com pool de conexões configurado pelas variáveis de ambiente DB_*.
+
+    :param url: URL do banco de dados.
+    :param options: Parâmetros adicionais de create_engine (sobrescrevem os padrões).
+    """
+    if not url:
+        raise RuntimeError("DATABASE_URL não configurada (defina no .env)")
+
+    return create_engine(url, **engine_options(**options))
+
+
+engine = create_db_engine()
+SessionFactory = sessionmaker(bind=engine)
 
 
 def getSession():
-    with Session(engine) as session:
-        return session
+    """
+    Abre uma sessão com uma conexão do pool. Quem chamou deve fechar a sessão (session.close());
+    prefira session_scope, que faz commit, rollback e close automaticamente.
+    """
+    return SessionFactory()
+
+
+@contextmanager
+def session_scope():
+    """
+    Unidade de trabalho: abre uma sessão, faz commit ao final do bloco, rollback se houver erro
+    e devolve a conexão ao pool.
+
+    Exemplo:
+        with session_scope() as session:
+            copy_frame_into_table(session, model, frame)
+    """
+    session = SessionFactory()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# Ajustes em bancos criados antes das mudanças no schema (create_all não altera tabelas existentes).
+# Todos podem ser executados mais de uma vez.
+SCHEMA_UPGRADES = [
+    'ALTER TABLE "Companies" ALTER COLUMN company_size DROP NOT NULL',
+    'ALTER TABLE "Companies" ALTER COLUMN responsible_federative_entity DROP NOT NULL',
+    *(
+        f'ALTER TABLE "Partners" ALTER COLUMN {column} DROP NOT NULL'
+        for column in (
+            'partner_identifier', 'partner_name_social_reason', 'date_entry_society', 'country',
+            'cpf_legal_representative', 'representative_name', 'legal_representative_qualification', 'age_group',
+        )
+    ),
+    # Chave de Partners: partner_cpf_cnpj -> (base_cnpj, partner_cpf_cnpj, partner_qualification)
+    """
+    DO $$
+    DECLARE
+        key_name text;
+    BEGIN
+        SELECT conname INTO key_name FROM pg_constraint
+        WHERE conrelid = '"Partners"'::regclass AND contype = 'p' AND array_length(conkey, 1) = 1;
+        IF key_name IS NOT NULL THEN
+            DELETE FROM "Partners" WHERE base_cnpj IS NULL;
+            UPDATE "Partners" SET partner_qualification = '00' WHERE partner_qualification IS NULL;
+            EXECUTE 'ALTER TABLE "Partners" DROP CONSTRAINT ' || quote_ident(key_name);
+            ALTER TABLE "Partners" ADD PRIMARY KEY (base_cnpj, partner_cpf_cnpj, partner_qualification);
+        END IF;
+    END $$
+    """,
+    # Busca por nome: colunas normalizadas (preenchidas pela carga seguinte) e índices do texto de busca
+    'ALTER TABLE "Companies" ADD COLUMN IF NOT EXISTS search_name VARCHAR(255)',
+    'ALTER TABLE "Establishments" ADD COLUMN IF NOT EXISTS search_name VARCHAR(255)',
+    """CREATE INDEX IF NOT EXISTS "ix_Companies_search_name" ON "Companies" USING gin (to_tsvector('simple', search_name))""",
+    """CREATE INDEX IF NOT EXISTS "ix_Establishments_search_name" ON "Establishments" USING gin (to_tsvector('simple', search_name))""",
+    'CREATE INDEX IF NOT EXISTS "ix_Establishments_base_cnpj" ON "Establishments" (base_cnpj)',
+    # Chave dos estabelecimentos no formato de 14 caracteres: a carga antiga gravava CNPJ básico + '000' + ordem + DV.
+    # Os registros antigos que já têm a chave nova (gravada por uma carga posterior) são removidos.
+    """
+    DELETE FROM "Establishments" legacy USING "Establishments" current
+    WHERE length(legacy.cnpj) = 17 AND substr(legacy.cnpj, 9, 3) = '000' AND current.cnpj = left(legacy.cnpj, 8) || right(legacy.cnpj, 6)
+    """,
+    """
+    UPDATE "Establishments" SET cnpj = left(cnpj, 8) || right(cnpj, 6)
+    WHERE length(cnpj) = 17 AND substr(cnpj, 9, 3) = '000'
+    """,
+    """
+    DELETE FROM "EstablishmentSecondaryCnaes" legacy USING "EstablishmentSecondaryCnaes" current
+    WHERE length(legacy.cnpj) = 17 AND substr(legacy.cnpj, 9, 3) = '000' AND current.cnpj = left(legacy.cnpj, 8) || right(legacy.cnpj, 6)
+    AND current.cnae = legacy.cnae
+    """,
+    """
+    UPDATE "EstablishmentSecondaryCnaes" SET cnpj = left(cnpj, 8) || right(cnpj, 6)
+    WHERE length(cnpj) = 17 AND substr(cnpj, 9, 3) = '000'
+    """,
+]
+
+
+def create_schema(bind=None):
+    """Cria as tabelas que ainda não existem no banco e aplica SCHEMA_UPGRADES (opcional, ver DB_CREATE_SCHEMA)."""
+    bind = bind or engine
+    table_registry.metadata.create_all(bind)
+    with bind.begin() as connection:
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+
+
+def dispose_inherited_connections():
+    """
+    Descarta as conexões herdadas do processo pai sem fechá-las. Deve ser chamada no início de cada
+    processo worker, para que cada processo abra as suas próprias conexões.
+    """
+    engine.dispose(close=False)
+
+
+_async_engine = None
+
+
+def get_async_engine(**options):
+    """
+    Engine assíncrono (asyncpg), criado somente na primeira chamada.
 
-# Session = sessionmaker(bind=engine)
-# session = Session()
+    :param options: Parâmetros adicionais de create_async_engine (sobrescrevem os padrões).
+    """
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
 
-# Base = declarative_base()
-# Base.metadata.create_all(bind=engine)
\ No newline at end of file
+        url = make_url(DATABASE_URL).set(drivername='postgresql+asyncpg')
+        _async_engine = create_async_engine(url, **engine_options(**options))
+    return _async_engine
@@ -1,27 +1,47 @@
-from sqlalchemy import String, Integer, DateTime, Numeric, func, ForeignKey
+from sqlalchemy import String, Integer, BigInteger, Boolean, DateTime, Numeric, func, ForeignKey, Index, literal_column, text
 from sqlalchemy.orm import registry, mapped_column, Mapped, relationship
 from datetime import datetime
 
 table_registry = registry()
 
+SEARCH_CONFIG = "'simple'"  # Configuração do texto de busca: sem dicionário, os nomes já vêm normalizados (search_name)
+
+
+def search_vector(column):
+    """Texto de busca (tsvector) da coluna normalizada, com a mesma expressão do índice (ver search_index)."""
+    return func.to_tsvector(literal_column(SEARCH_CONFIG), column)
+
+
+def search_index(table_name, column='search_name'):
+    """Índice GIN do texto de busca da coluna (somente no PostgreSQL)."""
+    return Index(
+        f'ix_{table_name}_{column}', text(f'to_tsvector({SEARCH_CONFIG}, {column})'), postgresql_using='gin'
+    ).ddl_if(dialect='postgresql')
+
+
 @table_registry.mapped_as_dataclass
 class Company: 
     __tablename__ = "Companies"
+    __table_args__ = (search_index('Companies'),)
 
     base_cnpj: Mapped[str] = mapped_column(primary_key=True)
     social_reason_business_name: Mapped[str] = mapped_column(String(255), nullable=False)
     legal_nature: Mapped[str] = mapped_column(String(255))
     social_capital_company: Mapped[Numeric] = mapped_column(Numeric(15, 2), nullable=False)
-    company_size: Mapped[str] = mapped_column(String(5))
-    responsible_federative_entity: Mapped[str] = mapped_column(String(255))
+    company_size: Mapped[str] = mapped_column(String(5), nullable=True)
+    responsible_federative_entity: Mapped[str] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, init=False, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
     responsible_qualification: Mapped[str] = mapped_column(String(20), default="00")
+    # Razão social sem acentos e em maiúsculas, preenchida na carga (ver normalizer.normalize_search_text)
+    search_name: Mapped[str] = mapped_column(String(255), nullable=True, default=None)
 
 
 @table_registry.mapped_as_dataclass
 class Establishment:
     __tablename__ = 'Establishments'
+    # base_cnpj: estabelecimentos das empresas encontradas pela razão social
+    __table_args__ = (Index('ix_Establishments_base_cnpj', 'base_cnpj'), search_index('Establishments'))
 
     base_cnpj: Mapped[str] = mapped_column(String(255), nullable=True)
     cnpj_order: Mapped[str] = mapped_column(String(4), nullable=False)
@@ -55,6 +75,21 @@ class Establishment:
     created_at: Mapped[datetime] = mapped_column(DateTime, init=False, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
     cnae_secondary: Mapped[str] = mapped_column(nullable=True, default=None)
+    # Nome fantasia sem acentos e em maiúsculas, preenchido na carga (ver normalizer.normalize_search_text)
+    search_name: Mapped[str] = mapped_column(String(255), nullable=True, default=None)
+
+
+@table_registry.mapped_as_dataclass
+class EstablishmentSecondaryCnae:
+    # CNAEs secundários de cada estabelecimento (um registro por CNAE da lista 'CNAE FISCAL SECUNDARIA')
+    __tablename__ = 'EstablishmentSecondaryCnaes'
+    # Consulta mais comum: estabelecimentos com o CNAE secundário X na UF Y
+    __table_args__ = (Index('ix_EstablishmentSecondaryCnaes_cnae_uf', 'cnae', 'uf'),)
+
+    cnpj: Mapped[str] = mapped_column(primary_key=True)
+    cnae: Mapped[str] = mapped_column(String(20), primary_key=True)
+    uf: Mapped[str] = mapped_column(String(255), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, init=False, server_default=func.now())
 
 
 @table_registry.mapped_as_dataclass
@@ -76,17 +111,18 @@ class Simples:
 class Partner:
     __tablename__ = 'Partners'
 
-    base_cnpj: Mapped[str] = mapped_column(String(20), nullable=True)
-    partner_identifier: Mapped[str] = mapped_column(String(4))
-    partner_name_social_reason: Mapped[str] = mapped_column(String(255))
+    # Chave natural: o mesmo CPF (mascarado) aparece em várias empresas e com qualificações diferentes
+    base_cnpj: Mapped[str] = mapped_column(String(20), primary_key=True)
+    partner_identifier: Mapped[str] = mapped_column(String(4), nullable=True)
+    partner_name_social_reason: Mapped[str] = mapped_column(String(255), nullable=True)
     partner_cpf_cnpj: Mapped[str] = mapped_column(String(14), primary_key=True)
-    partner_qualification: Mapped[str] = mapped_column(String(20))
-    date_entry_society: Mapped[datetime] = mapped_column(DateTime)
-    country: Mapped[str] = mapped_column(String(20))
-    cpf_legal_representative: Mapped[str] = mapped_column(String(11))
-    representative_name: Mapped[str] = mapped_column(String(255))
-    legal_representative_qualification: Mapped[str] = mapped_column(String(20))
-    age_group: Mapped[str] = mapped_column(String(1))
+    partner_qualification: Mapped[str] = mapped_column(String(20), primary_key=True)
+    date_entry_society: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+    country: Mapped[str] = mapped_column(String(20), nullable=True)
+    cpf_legal_representative: Mapped[str] = mapped_column(String(11), nullable=True)
+    representative_name: Mapped[str] = mapped_column(String(255), nullable=True)
+    legal_representative_qualification: Mapped[str] = mapped_column(String(20), nullable=True)
+    age_group: Mapped[str] = mapped_column(String(1), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, init=False, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
     
@@ -157,3 +193,31 @@ class Client:
     created_at: Mapped[datetime] = mapped_column(DateTime, init=False, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
+
+
+@table_registry.mapped_as_dataclass
+class IngestionCheckpoint:
+    # Progresso da carga de cada arquivo (partição) por mês, gravado na mesma transação dos dados
+    __tablename__ = 'IngestionCheckpoints'
+
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)
+    file_name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    rows_committed: Mapped[int] = mapped_column(BigInteger, default=0)
+    batches_committed: Mapped[int] = mapped_column(Integer, default=0)
+    completed: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, init=False, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, init=False, server_default=func.now(), onupdate=func.now())
+
+
+@table_registry.mapped_as_dataclass
+class IngestionReject:
+    # Registros recusados na carga (valores inválidos para a tabela), gravados na mesma transação do lote
+    __tablename__ = 'IngestionRejects'
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True, init=False)
+    table_name: Mapped[str] = mapped_column(String(64))
+    error: Mapped[str] = mapped_column(String(1000))
+    record: Mapped[str] = mapped_column(String)
+    month: Mapped[str] = mapped_column(String(7), nullable=True, default=None)
+    file_name: Mapped[str] = mapped_column(String(64), nullable=True, default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime, init=False, server_default=func.now())
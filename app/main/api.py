@@ -0,0 +1,351 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+import pandas as pd
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import any_, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from auth import AUTH_ENABLED, AUTH_SECRET_KEY, authenticate, charge, client_address, client_token, parse_basic, rate_limited
+from bd import session_scope
+from cache import MISSING, TTLCache
+from checkpoints import data_version_statement
+from documents import clean_cnpj, valid_cnpj
+from lookups import LOOKUP_COLUMNS, lookups
+from metrics import configure_logging, log_event, metrics
+from schemas import Cnae, Company, Establishment, EstablishmentSecondaryCnae, Partner, Simples
+from search import SEARCH_LIMIT, SEARCH_MAX_LIMIT, search_establishments
+
+# API de consulta de CNPJ (uvicorn api:app)
+API_HOST = os.getenv('API_HOST', '0.0.0.0')
+API_PORT = int(os.getenv('API_PORT', '8000'))
+API_CACHE_SIZE = int(os.getenv('API_CACHE_SIZE', '100000'))  # CNPJs mantidos em memória (por processo)
+API_CACHE_TTL = int(os.getenv('API_CACHE_TTL', '3600'))  # Validade de cada CNPJ em memória (segundos)
+API_VERSION_INTERVAL = int(os.getenv('API_VERSION_INTERVAL', '30'))  # Intervalo entre verificações de nova carga (segundos)
+API_CLIENT_CACHE_SECONDS = int(os.getenv('API_CLIENT_CACHE_SECONDS', '300'))  # Cache-Control enviado aos clientes
+API_BATCH_MAX = int(os.getenv('API_BATCH_MAX', '100000'))  # CNPJs por consulta em lote
+API_BATCH_CHUNK = int(os.getenv('API_BATCH_CHUNK', '5000'))  # CNPJs consultados no banco de cada vez
+
+HIDDEN_COLUMNS = ['created_at', 'search_name']  # Colunas que não aparecem nas respostas
+INVALID_CNPJ = 'CNPJ inválido (14 caracteres, com dígitos verificadores corretos)'
+
+if AUTH_ENABLED and not AUTH_SECRET_KEY:
+    raise RuntimeError("AUTH_SECRET_KEY não configurada (defina no .env ou desative a autenticação com AUTH_ENABLED=false)")
+
+app = FastAPI(title="C3C API Para Consultar CNPJ's")
+configure_logging()
+
+
+class DataVersion:
+    """
+    Versão dos dados do banco (último mês carregado e horário da última partição concluída), lida
+    no máximo a cada API_VERSION_INTERVAL segundos. Quando muda, as respostas em cache deixam de valer
+    e as tabelas de domínio em memória são recarregadas.
+    """
+
+    def __init__(self, interval=API_VERSION_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.value = None
+        self.checked_at = 0.0
+
+    def current(self):
+        if self.value is not None and time.monotonic() - self.checked_at < self.interval:
+            return self.value
+        with self.lock:
+            if self.value is None or time.monotonic() - self.checked_at >= self.interval:
+                with session_scope() as session:
+                    month, updated_at = session.execute(data_version_statement()).one()
+                value = f'{month}@{updated_at.isoformat()}' if month else 'empty'
+                if value != self.value:
+                    lookups.refresh(value)
+                    log_event('data_version_changed', version=value)
+                self.value = value
+                self.checked_at = time.monotonic()
+        return self.value
+
+
+data_version = DataVersion()
+cnpj_cache = TTLCache(API_CACHE_SIZE, API_CACHE_TTL, name='api_cache')
+
+
+def establishment_keys(cnpj):
+    """
+    Chaves possíveis do estabelecimento em Establishments.cnpj: o CNPJ de 14 caracteres e o formato
+    antigo da carga (CNPJ básico + '000' + ordem + DV), dos bancos que ainda não passaram por
+    create_schema. Ambas são buscadas pela chave primária.
+    """
+    return [cnpj, cnpj[:8] + '000' + cnpj[8:]]
+
+
+def any_of(column, values):
+    """Condição column = ANY(:lista): a lista inteira vai em um único parâmetro (array do PostgreSQL)."""
+    return column == any_(literal(list(values), ARRAY(column.type)))
+
+
+def describe(table_name, row):
+    """
+    Registro (RowMapping) como dicionário, sem HIDDEN_COLUMNS e com a descrição de cada código
+    de tabela de domínio ('<coluna>_description').
+    """
+    data = {column: value for column, value in row.items() if column not in HIDDEN_COLUMNS}
+    for column, model in LOOKUP_COLUMNS.get(table_name, {}).items():
+        data[f'{column}_description'] = lookups.description(model, data.get(column))
+    return data
+
+
+def fetch_cnpjs(cnpjs):
+    """
+    Consulta no banco vários CNPJs de uma vez: estabelecimentos, empresas, Simples, sócios e CNAEs
+    secundários são lidos com uma consulta cada (= ANY(:lista)), independentemente da quantidade de CNPJs.
+
+    :param cnpjs: CNPJs válidos (ver documents.valid_cnpj).
+    :return: Dicionário CNPJ -> resposta (None para os CNPJs que não existem).
+    """
+    start = time.perf_counter()
+    results = dict.fromkeys(cnpjs)
+    keys = {key: cnpj for cnpj in results for key in establishment_keys(cnpj)}
+    with session_scope() as session:
+        establishments = session.execute(
+            select(Establishment.__table__).where(any_of(Establishment.cnpj, keys))
+        ).mappings().all()
+        if establishments:
+            base_cnpjs = {row['base_cnpj'] for row in establishments}
+            companies = {
+                row['base_cnpj']: row for row in session.execute(
+                    select(Company.__table__).where(any_of(Company.base_cnpj, base_cnpjs))
+                ).mappings()
+            }
+            simples = {
+                row['base_cnpj']: row for row in session.execute(
+                    select(Simples.__table__).where(any_of(Simples.base_cnpj, base_cnpjs))
+                ).mappings()
+            }
+            partners = defaultdict(list)
+            for row in session.execute(
+                select(Partner.__table__).where(any_of(Partner.base_cnpj, base_cnpjs))
+            ).mappings():
+                partners[row['base_cnpj']].append(describe(Partner.__tablename__, row))
+            secondary_cnaes = defaultdict(list)
+            for cnpj, code in session.execute(
+                select(EstablishmentSecondaryCnae.cnpj, EstablishmentSecondaryCnae.cnae)
+                .where(any_of(EstablishmentSecondaryCnae.cnpj, [row['cnpj'] for row in establishments]))
+            ):
+                secondary_cnaes[cnpj].append({'code': code, 'description': lookups.description(Cnae, code)})
+
+            for establishment in establishments:
+                base_cnpj = establishment['base_cnpj']
+                company = companies.get(base_cnpj)
+                company_simples = simples.get(base_cnpj)
+                cnpj = keys[establishment['cnpj']]
+                results[cnpj] = {
+                    'cnpj': cnpj,
+                    'establishment': describe(Establishment.__tablename__, establishment),
+                    'company': describe(Company.__tablename__, company) if company is not None else None,
+                    'simples': describe(Simples.__tablename__, company_simples) if company_simples is not None else None,
+                    'partners': partners[base_cnpj],
+                    'secondary_cnaes': secondary_cnaes[establishment['cnpj']],
+                }
+    metrics.observe('api_database_seconds', time.perf_counter() - start)
+    return results
+
+
+def lookup_cnpjs(cnpjs, version, store=True):
+    """
+    Leitura com cache: os CNPJs são buscados no cache em memória e os ausentes (ou de outra versão),
+    todos juntos no banco; o resultado (inclusive "não encontrado") fica no cache até o TTL ou a próxima carga.
+
+    :param cnpjs: CNPJs válidos (ver documents.valid_cnpj).
+    :param version: Versão atual dos dados (ver DataVersion).
+    :param store: Grava no cache os CNPJs lidos do banco. As consultas em lote não gravam, para que
+        uma lista de 100 mil CNPJs consultados uma única vez não tire do cache os CNPJs mais procurados.
+    :return: Dicionário CNPJ -> resposta (None para os CNPJs que não existem).
+    """
+    results = {}
+    missing = []
+    for cnpj in dict.fromkeys(cnpjs):
+        result = cnpj_cache.get(cnpj, version)
+        if result is MISSING:
+            missing.append(cnpj)
+        else:
+            results[cnpj] = result
+    if missing:
+        fetched = fetch_cnpjs(missing)
+        if store:
+            for cnpj, result in fetched.items():
+                cnpj_cache.set(cnpj, result, version)
+        results.update(fetched)
+    return results
+
+
+def parse_cnpj_list(body, content_type):
+    """
+    Lista de CNPJs do corpo da consulta em lote: JSON (lista ou {"cnpjs": [...]}) ou um arquivo de texto/CSV
+    com os CNPJs separados por linhas, vírgulas ou ponto e vírgula (valores sem dígitos, como o cabeçalho, são ignorados).
+
+    :raises HTTPException: 400 se o JSON não for uma lista de CNPJs.
+    """
+    if 'json' in content_type:
+        try:
+            values = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail='JSON inválido')
+        if isinstance(values, dict):
+            values = values.get('cnpjs')
+        if not isinstance(values, list):
+            raise HTTPException(status_code=400, detail='Envie uma lista de CNPJs ou {"cnpjs": [...]}')
+        return [str(value) for value in values]
+    text = body.decode('utf-8-sig', errors='replace')
+    return [value for value in re.split(r'[\s,;"]+', text) if re.search(r'\d', value)]
+
+
+def json_default(value):
+    """Tipos do banco sem equivalente em JSON, no mesmo formato das respostas do FastAPI."""
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'{type(value).__name__} não é serializável em JSON')
+
+
+def stream_batch(values, version):
+    """
+    Respostas da consulta em lote em NDJSON (uma linha JSON por CNPJ, na ordem recebida), geradas
+    a cada API_BATCH_CHUNK CNPJs: o cliente recebe as primeiras linhas enquanto o restante é consultado.
+    """
+    for start in range(0, len(values), API_BATCH_CHUNK):
+        chunk = values[start:start + API_BATCH_CHUNK]
+        cnpjs = pd.Series([clean_cnpj(value) for value in chunk], dtype=object)
+        # CNPJs com DVs inválidos não existem na base: são respondidos sem consultar o banco
+        valid = valid_cnpj(cnpjs)
+        results = lookup_cnpjs(cnpjs[valid].tolist(), version, store=False)
+        lines = []
+        for value, cnpj, is_valid in zip(chunk, cnpjs, valid):
+            if not is_valid:
+                line = {'cnpj': value, 'error': INVALID_CNPJ}
+            elif results[cnpj] is None:
+                line = {'cnpj': cnpj, 'error': 'CNPJ não encontrado'}
+            else:
+                line = results[cnpj]
+            lines.append(json.dumps(line, ensure_ascii=False, default=json_default))
+        yield '\n'.join(lines) + '\n'
+
+
+@app.middleware('http')
+async def measure_latency(request: Request, call_next):
+    """Mede o tempo de cada resposta (histograma api_request_seconds e cabeçalho Server-Timing)."""
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    metrics.observe('api_request_seconds', elapsed)
+    response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.2f}'
+    log_event('api_request', logging.DEBUG, path=request.url.path, status=response.status_code,
+              ms=round(elapsed * 1000, 2))
+    return response
+
+
+@app.post('/token')
+async def post_token(request: Request):
+    """
+    Token de acesso (válido por AUTH_TOKEN_TTL segundos) para as credenciais do cliente, enviadas em
+    'Authorization: Basic' ou no corpo em JSON ({"client_id": ..., "client_secret": ...}).
+
+    Exemplo:
+        curl -X POST -u meu_cliente:segredo http://localhost:8000/token
+        curl -H 'Authorization: Bearer <access_token>' http://localhost:8000/cnpj/11222333000181
+    """
+    if not AUTH_ENABLED:
+        raise HTTPException(status_code=404, detail='Autenticação desativada (AUTH_ENABLED=false)')
+    scheme, _, value = request.headers.get('authorization', '').partition(' ')
+    credentials = parse_basic(value) if scheme.lower() == 'basic' else None
+    if credentials is None:
+        try:
+            body = json.loads(await request.body() or b'{}')
+        except ValueError:
+            raise HTTPException(status_code=400, detail='JSON inválido')
+        if not isinstance(body, dict) or not body.get('client_id') or not body.get('client_secret'):
+            raise HTTPException(status_code=401, detail='Envie client_id e client_secret', headers={'WWW-Authenticate': 'Basic'})
+        credentials = (str(body['client_id']), str(body['client_secret']))
+    return await run_in_threadpool(client_token, *credentials, client_address(request))
+
+
+@app.get('/cnpj/{cnpj:path}')
+def get_cnpj(cnpj: str, request: Request, response: Response, client_id: str = Depends(rate_limited)):
+    """
+    Dados de um CNPJ, com ou sem pontuação (a barra de '11.222.333/0001-81' também é aceita).
+    Responde 304 quando o cliente já tem a versão atual (If-None-Match).
+    """
+    cnpj = clean_cnpj(cnpj)
+    if not valid_cnpj(pd.Series([cnpj], dtype=object)).iloc[0]:
+        raise HTTPException(status_code=422, detail=INVALID_CNPJ)
+
+    version = data_version.current()
+    headers = {'ETag': f'"{version}"', 'Cache-Control': f'max-age={API_CLIENT_CACHE_SECONDS}'}
+    if request.headers.get('if-none-match') == headers['ETag']:
+        return Response(status_code=304, headers=headers)
+
+    result = lookup_cnpjs([cnpj], version)[cnpj]
+    if result is None:
+        raise HTTPException(status_code=404, detail='CNPJ não encontrado')
+    response.headers.update(headers)
+    return result
+
+
+@app.post('/cnpj/batch')
+async def post_cnpj_batch(request: Request, client_id: str = Depends(authenticate)):
+    """
+    Consulta em lote: recebe até API_BATCH_MAX CNPJs (JSON ou arquivo de texto/CSV no corpo) e devolve
+    uma linha NDJSON por CNPJ, à medida que os lotes de API_BATCH_CHUNK CNPJs são consultados.
+
+    Exemplo:
+        curl --data-binary @cnpjs.csv -H 'Content-Type: text/csv' http://localhost:8000/cnpj/batch
+    """
+    values = parse_cnpj_list(await request.body(), request.headers.get('content-type', ''))
+    if len(values) > API_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f'Envie no máximo {API_BATCH_MAX} CNPJs por consulta')
+    # Cada bloco de API_BATCH_CHUNK CNPJs conta como uma requisição no limite do cliente
+    charge(client_id, max(1, math.ceil(len(values) / API_BATCH_CHUNK)))
+    metrics.increment('api_batch_cnpjs', len(values))
+    version = await run_in_threadpool(data_version.current)
+    return StreamingResponse(
+        stream_batch(values, version), media_type='application/x-ndjson', headers={'ETag': f'"{version}"'}
+    )
+
+
+@app.get('/search')
+def get_search(name: str, uf: str = None, city: str = None, cnae: str = None,
+               limit: int = Query(SEARCH_LIMIT, ge=1, le=SEARCH_MAX_LIMIT), client_id: str = Depends(rate_limited)):
+    """
+    Busca de estabelecimentos pela razão social ou pelo nome fantasia (sem diferenciar acentos e maiúsculas),
+    com filtros opcionais de UF, município (código ou nome) e CNAE principal ou secundário.
+
+    Exemplo:
+        curl 'http://localhost:8000/search?name=padaria%20sao%20jose&uf=SP&cnae=1091102'
+    """
+    data_version.current()  # Recarrega as tabelas de domínio (descrições e nomes de município) após uma nova carga
+    try:
+        with session_scope() as session:
+            results = search_establishments(session, name, uf=uf, city=city, cnae=cnae, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {'results': results}
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+def get_metrics():
+    """Métricas no formato do Prometheus (latência, acertos do cache, ...)."""
+    return metrics.render_prometheus()
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
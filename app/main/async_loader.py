@@ -0,0 +1,446 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import asyncpg
+import httpx
+import pandas as pd
+from sqlalchemy import insert, text
+from sqlalchemy.exc import DBAPIError
+from bd import get_async_engine
+from checkpoints import MAX_LOAD_ATTEMPTS, checkpoint_statement, month_checkpoints_statement
+from discovery import partitions_for
+from downloader import BUFFER_SIZE, REQUEST_TIMEOUT
+from layouts import LAYOUTS, get_layout_name
+from loader import COPY_NULL, build_delete_children_sql, build_merge_sql, build_staging_sql, frame_to_csv, quote_identifier
+from lookups import LOOKUP_COLUMNS, check_codes, domain_version, lookups
+from metrics import log_event, metrics
+from normalizer import to_child_frames, to_table_frame
+from pipeline import BATCH_SIZE, zip_pipeline
+from rejects import reject_rows, split_invalid_rows
+from scheduler import DOWNLOAD_WORKERS, LOAD_WORKERS, PARSE_WORKERS, PREFETCH_PARTITIONS, TABLE_DEPENDENCIES, topological_order
+from schemas import IngestionReject
+from snapshot import open_snapshot
+
+BATCH_QUEUE_SIZE = 2  # Lotes já preparados aguardando gravação, por partição
+
+# Classes de SQLSTATE dos erros causados pelos valores de um registro (22: dados, 23: restrições). O SQLAlchemy
+# não converte todos os erros do asyncpg em IntegrityError/DataError, e os do COPY vêm direto do asyncpg.
+RECORD_ERROR_CLASSES = ('22', '23')
+
+
+def load_download_validator(part_path, url):
+    """
+    Validador (ETag ou Last-Modified) do arquivo remoto salvo com o download parcial em '<parcial>.json'.
+    Um download parcial sem validador (ou de outra URL) é apagado, pois não dá para saber se é do mesmo arquivo.
+    """
+    state_path = f'{part_path}.json'
+    try:
+        with open(state_path) as fd:
+            state = json.load(fd)
+    except (OSError, ValueError):
+        state = {}
+    if state.get('url') == url and state.get('validator') and os.path.exists(part_path):
+        return state['validator']
+    for path in (part_path, state_path):
+        if os.path.exists(path):
+            os.remove(path)
+    return None
+
+
+def save_download_validator(part_path, url, validator):
+    """Grava o validador do arquivo que está sendo baixado em '<parcial>.json' (ver load_download_validator)."""
+    state_path = f'{part_path}.json'
+    if validator is None:
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return
+    with open(f'{state_path}.tmp', 'w') as fd:
+        json.dump({'url': url, 'validator': validator}, fd)
+    os.replace(f'{state_path}.tmp', state_path)
+
+
+async def download_file_async(client, url, dest, expected_size=None, max_retries=10, backoff_factor=2):
+    """
+    Baixa um arquivo com o cliente HTTP assíncrono, retomando de '<destino>.download' se já existir.
+
+    Como em downloader.download_file, a retomada envia o ETag (ou o Last-Modified) salvo no início do
+    download em If-Range: se o arquivo foi republicado, o servidor responde 200 com o arquivo inteiro e
+    o download recomeça do zero, em vez de acrescentar os bytes novos ao arquivo antigo.
+
+    :param client: httpx.AsyncClient.
+    :param url: URL do arquivo.
+    :param dest: Caminho final do arquivo.
+    :param expected_size: Tamanho informado no manifesto (opcional, validado ao final).
+    :raises FileNotFoundError: Se o servidor responder 404.
+    """
+    part_path = f'{dest}.download'
+    start = time.perf_counter()
+    validator = load_download_validator(part_path, url)
+    resumed_bytes = os.path.getsize(part_path) if validator else 0
+    for attempt in range(max_retries):
+        downloaded = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={downloaded}-', 'If-Range': validator} if downloaded and validator else {}
+        try:
+            async with client.stream('GET', url, headers=headers) as response:
+                if response.status_code == 404:
+                    raise FileNotFoundError(url)
+                if response.status_code == 416 and downloaded == expected_size:
+                    break
+                response.raise_for_status()
+                current = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                if response.status_code == 206 and current and current != validator:
+                    # O servidor ignorou o If-Range, mas o arquivo mudou: o parcial não serve mais
+                    print(f"Arquivo {url} mudou no servidor, recomeçando o download do zero.")
+                    resumed_bytes = 0
+                    validator = None
+                    os.remove(part_path)
+                    save_download_validator(part_path, url, None)
+                    continue
+                if response.status_code != 206:
+                    # Arquivo inteiro (início do download, servidor sem Range ou arquivo republicado)
+                    if downloaded:
+                        print(f"Arquivo {url} mudou no servidor ou não aceita Range, recomeçando o download do zero.")
+                    resumed_bytes = 0
+                    validator = current
+                    save_download_validator(part_path, url, validator)
+                mode = 'ab' if response.status_code == 206 else 'wb'
+                with open(part_path, mode) as fd:
+                    async for chunk in response.aiter_bytes(BUFFER_SIZE):
+                        fd.write(chunk)
+            break
+        except httpx.HTTPError as e:
+            wait_time = backoff_factor ** attempt
+            metrics.increment('download_retries')
+            print(f"Erro no download de {url}: {e}. Tentando novamente em {wait_time} segundos...")
+            await asyncio.sleep(wait_time)
+    else:
+        raise RuntimeError(f"Falha ao baixar {url} após {max_retries} tentativas")
+
+    save_download_validator(part_path, url, None)
+    downloaded_size = os.path.getsize(part_path)
+    if expected_size is not None and downloaded_size != expected_size:
+        os.remove(part_path)
+        raise RuntimeError(f"Download incompleto de {url}: {downloaded_size} de {expected_size} bytes")
+    os.replace(part_path, dest)
+    metrics.add('download', time.perf_counter() - start, nbytes=downloaded_size - resumed_bytes)
+    print(f"Download concluído: {dest} ({downloaded_size / 1024 ** 2:.1f} MB)")
+    return dest
+
+
+def serialize_batch(table_frame, child_frames):
+    """
+    Serializa o lote (e os registros derivados das suas linhas) para o COPY.
+
+    :param table_frame: DataFrame com as colunas da tabela.
+    :param child_frames: DataFrames das tabelas derivadas (ver to_child_frames), indexados como o lote.
+    :return: (CSV em bytes, tabelas derivadas [(classe mapeada, colunas, registros, CSV em bytes)])
+    """
+    payload = frame_to_csv(table_frame).getvalue().encode('utf-8')
+    children = []
+    for child, child_frame in child_frames.items():
+        child_frame = child_frame[child_frame.index.isin(table_frame.index)]
+        children.append((child, list(child_frame.columns), len(child_frame), frame_to_csv(child_frame).getvalue().encode('utf-8')))
+    return payload, children
+
+
+def prepare_next_batch(batches, layout_name, date, snapshot=None):
+    """
+    Executada no pool de threads: lê e normaliza o próximo lote e já o serializa para o COPY.
+    Com 'snapshot' (SnapshotWriter), o lote também é gravado em Parquet. Os registros que o banco
+    recusaria (ver rejects.invalid_rows) são separados para IngestionRejects.
+
+    :return: (registros lidos, registros a gravar, tabelas derivadas, CSV em bytes, tabelas derivadas
+        serializadas (ver serialize_batch), registros recusados, motivos) ou None ao fim do arquivo.
+        Os DataFrames acompanham o CSV para que o lote possa ser dividido se o banco recusar algum registro.
+    """
+    batch = next(batches, None)
+    if batch is None:
+        return None
+    model = LAYOUTS[layout_name]['model']
+    with metrics.timer('normalize', table=model.__tablename__):
+        table_frame = to_table_frame(layout_name, batch, date)
+        table_frame, rejected, reasons = split_invalid_rows(model, table_frame)
+        check_codes(model.__tablename__, table_frame)
+    if snapshot is not None:
+        snapshot.write(table_frame)
+    child_frames = to_child_frames(layout_name, table_frame)
+    payload, children = serialize_batch(table_frame, child_frames)
+    return len(batch), table_frame, child_frames, payload, children, rejected, reasons
+
+
+async def copy_payload_into_table(connection, model, columns, payload, rows, children=()):
+    """
+    Versão assíncrona de copy_frame_into_table: COPY para a tabela de staging e INSERT ... ON CONFLICT
+    na tabela final, na transação da conexão.
+    Os registros derivados das chaves do lote (ex.: CNAEs secundários) são substituídos pelos de 'children'.
+
+    :param connection: AsyncConnection do SQLAlchemy (asyncpg) com a transação aberta.
+    :param model: Classe mapeada da tabela de destino.
+    :param columns: Colunas do CSV.
+    :param payload: CSV em bytes, gerado por frame_to_csv.
+    :param rows: Quantidade de registros do CSV (para as métricas).
+    :param children: Tabelas derivadas do lote [(classe mapeada, colunas, registros, CSV em bytes)], opcional.
+    """
+    table = model.__table__
+    staging_name = f'stg_{table.name}'
+    start = time.perf_counter()
+    await connection.execute(text(f'DROP TABLE IF EXISTS {quote_identifier(staging_name)}'))
+    await connection.execute(text(build_staging_sql(table, staging_name)))
+
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_to_table(
+        staging_name, source=io.BytesIO(payload), columns=columns, format='csv', null=COPY_NULL
+    )
+    await connection.execute(text(build_merge_sql(table, staging_name, columns)))
+    for child, child_columns, child_rows, child_payload in children:
+        await connection.execute(text(build_delete_children_sql(child.__table__, table, staging_name)))
+        await copy_payload_into_table(connection, child, child_columns, child_payload, child_rows)
+    metrics.add('load', time.perf_counter() - start, rows=rows, nbytes=len(payload), table=table.name)
+
+
+def is_record_error(error):
+    """Indica se o erro do asyncpg (direto ou repassado pelo SQLAlchemy) foi causado pelos valores de um registro."""
+    sqlstate = getattr(getattr(error, 'orig', None) or error, 'sqlstate', None) or ''
+    return sqlstate[:2] in RECORD_ERROR_CLASSES
+
+
+async def load_with_bisect_async(connection, frame, load, payload=None):
+    """
+    Versão assíncrona de rejects.load_with_bisect: grava o lote com load(frame, payload) em um SAVEPOINT e,
+    se o banco recusar algum registro, divide o lote ao meio até isolar os registros recusados.
+
+    :param connection: AsyncConnection do SQLAlchemy (asyncpg) com a transação do lote aberta.
+    :param frame: DataFrame com as colunas da tabela.
+    :param load: Função assíncrona que grava um DataFrame; recebe o CSV já serializado quando houver.
+    :param payload: Lote já serializado para a primeira tentativa (opcional).
+    :return: (quantidade gravada, registros recusados, erro de cada recusado)
+    """
+    try:
+        async with connection.begin_nested():
+            return await load(frame, payload), frame.iloc[:0], []
+    except (DBAPIError, asyncpg.PostgresError) as e:
+        if not is_record_error(e):
+            raise
+        if len(frame) == 1:
+            return 0, frame, [str(getattr(e, 'orig', None) or e).strip()]
+        middle = len(frame) // 2
+        left_count, left_rejected, left_errors = await load_with_bisect_async(connection, frame.iloc[:middle], load)
+        right_count, right_rejected, right_errors = await load_with_bisect_async(connection, frame.iloc[middle:], load)
+        return left_count + right_count, pd.concat([left_rejected, right_rejected]), left_errors + right_errors
+
+
+class AsyncMonthLoader:
+    """
+    Carga de um mês em um único processo com asyncio: downloads (httpx), leitura/normalização
+    (pool de threads) e vários COPY simultâneos (pool de conexões asyncpg) acontecem ao mesmo tempo.
+
+    A pressão entre as etapas é controlada por limites:
+    - no máximo 'prefetch' ZIPs em disco (baixando, aguardando ou carregando);
+    - no máximo 'load_workers' partições gravando ao mesmo tempo, cada uma em ordem, lote a lote;
+    - uma fila de BATCH_QUEUE_SIZE lotes por partição entre a leitura e a gravação.
+    """
+
+    def __init__(self, manifest, month_label, folder, download_workers=DOWNLOAD_WORKERS,
+                 prefetch=PREFETCH_PARTITIONS, parse_workers=PARSE_WORKERS, load_workers=LOAD_WORKERS,
+                 batch_size=BATCH_SIZE):
+        """
+        :param manifest: Manifesto do mês (fetch_manifest).
+        :param month_label: Mês em carga (ex.: '2025-03'), usado nos checkpoints.
+        :param folder: Pasta onde os ZIPs são baixados.
+        :param download_workers: Downloads simultâneos.
+        :param prefetch: Máximo de ZIPs em disco ao mesmo tempo.
+        :param parse_workers: Threads de leitura/normalização.
+        :param load_workers: Partições gravando no banco ao mesmo tempo (conexões em uso).
+        :param batch_size: Quantidade de registros por lote.
+        """
+        self.manifest = manifest
+        self.month_label = month_label
+        self.folder = folder
+        self.batch_size = batch_size
+        self.download_slots = asyncio.Semaphore(download_workers)
+        self.disk_slots = asyncio.Semaphore(prefetch)
+        self.load_slots = asyncio.Semaphore(load_workers)
+        self.executor = ThreadPoolExecutor(max_workers=parse_workers)
+        self.engine = get_async_engine(pool_size=load_workers, max_overflow=1)
+        self.completed = set()
+        self.progress = {}
+        self.errors = {}
+
+    async def load_checkpoints(self):
+        """Lê o progresso gravado das partições do mês (partições concluídas e registros já gravados)."""
+        async with self.engine.connect() as connection:
+            result = await connection.execute(month_checkpoints_statement(self.month_label))
+            for row in result:
+                if row.completed:
+                    self.completed.add(row.file_name)
+                self.progress[row.file_name] = (row.rows_committed, row.batches_committed)
+
+    async def download(self, client, partition):
+        zip_file_path = os.path.join(self.folder, f'{partition}.zip')
+        if os.path.exists(zip_file_path):
+            print(f"O arquivo {partition}.zip já foi baixado. Pulando download.")
+            return zip_file_path
+        entry = self.manifest[partition]
+        async with self.download_slots:
+            print(f"Baixando arquivo {partition}.zip de {entry['url']}")
+            return await download_file_async(client, entry['url'], zip_file_path, expected_size=entry['size'])
+
+    async def read_batches(self, zip_file_path, layout_name, skip_rows, queue, snapshot=None):
+        """Produtor: lê os lotes no pool de threads e os coloca na fila (aguarda quando a fila está cheia)."""
+        loop = asyncio.get_running_loop()
+        date = datetime.now()
+        batches = iter(zip_pipeline(zip_file_path, layout_name, self.batch_size, skip_rows=skip_rows))
+        try:
+            while True:
+                item = await loop.run_in_executor(self.executor, prepare_next_batch, batches, layout_name, date, snapshot)
+                await queue.put(item)
+                if item is None:
+                    break
+        except Exception as e:
+            # Repassa o erro de leitura para o consumidor, que está aguardando a fila
+            await queue.put(e)
+        finally:
+            try:
+                batches.close()
+            except ValueError:
+                pass  # Uma thread ainda está lendo o lote; o gerador é descartado quando ela terminar
+
+    async def load_partition(self, file_name, partition, zip_file_path):
+        """Consumidor: grava os lotes da partição em ordem, cada um em uma transação com o seu checkpoint."""
+        layout_name = get_layout_name(file_name)
+        model = LAYOUTS[layout_name]['model']
+        rows_committed, batches_committed = self.progress.get(partition, (0, 0))
+        if rows_committed:
+            print(f"Retomando {partition} a partir do registro {rows_committed}.")
+
+        loop = asyncio.get_running_loop()
+        if model.__tablename__ in LOOKUP_COLUMNS:
+            # As tabelas de domínio já foram carregadas (dependências); lidas de novo só se a versão mudar
+            await loop.run_in_executor(self.executor, lambda: lookups.refresh(domain_version(self.month_label)))
+        snapshot = open_snapshot(self.month_label, model, partition, batches_committed)
+        queue = asyncio.Queue(maxsize=BATCH_QUEUE_SIZE)
+        producer = asyncio.create_task(self.read_batches(zip_file_path, layout_name, rows_committed, queue, snapshot))
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                read_count, table_frame, child_frames, payload, children, rejected, reasons = item
+                columns = list(table_frame.columns)
+
+                async def load(frame, serialized=None):
+                    # As metades do lote dividido são serializadas no pool de threads
+                    frame_payload, frame_children = serialized or await loop.run_in_executor(
+                        self.executor, serialize_batch, frame, child_frames
+                    )
+                    await copy_payload_into_table(connection, model, columns, frame_payload, len(frame), frame_children)
+                    return len(frame)
+
+                async with self.engine.begin() as connection:
+                    # Um registro recusado pelo banco não descarta o lote: ele é isolado e vai para IngestionRejects
+                    row_count, refused, errors = await load_with_bisect_async(
+                        connection, table_frame, load, (payload, children)
+                    )
+                    await connection.execute(
+                        checkpoint_statement(self.month_label, partition, rows_committed + read_count, batches_committed + 1)
+                    )
+                    rejected, reasons = pd.concat([rejected, refused]), reasons + errors
+                    if not rejected.empty:
+                        await connection.execute(
+                            insert(IngestionReject),
+                            reject_rows(model.__tablename__, rejected, reasons, self.month_label, partition)
+                        )
+                        metrics.increment('rejected_rows', len(rejected))
+                    commit_start = time.perf_counter()
+                metrics.observe('commit_seconds', time.perf_counter() - commit_start)
+                rows_committed += read_count
+                batches_committed += 1
+                self.progress[partition] = (rows_committed, batches_committed)
+                log_event('batch_loaded', logging.DEBUG, partition=partition, rows_read=read_count, rows_written=row_count)
+            await producer
+        finally:
+            producer.cancel()
+
+        async with self.engine.begin() as connection:
+            await connection.execute(
+                checkpoint_statement(self.month_label, partition, rows_committed, batches_committed, completed=True)
+            )
+
+    async def process_partition(self, client, file_name, partition, dependencies_done):
+        async with self.disk_slots:
+            try:
+                zip_file_path = await self.download(client, partition)
+            except FileNotFoundError:
+                print(f"Partição {partition} não encontrada no servidor, ignorando.")
+                return
+            except Exception as e:
+                print(f"Erro na etapa de download da partição {partition}: {e}")
+                self.errors[file_name].append(f'{partition}: {e}')
+                return
+
+            await dependencies_done
+            for attempt in range(1, MAX_LOAD_ATTEMPTS + 1):
+                try:
+                    async with self.load_slots:
+                        await self.load_partition(file_name, partition, zip_file_path)
+                    break
+                except Exception as e:
+                    wait_time = 5 * attempt
+                    metrics.increment('load_retries')
+                    print(f"Falha ao gravar {partition} (tentativa {attempt}/{MAX_LOAD_ATTEMPTS}): {e}")
+                    if attempt == MAX_LOAD_ATTEMPTS:
+                        self.errors[file_name].append(f'{partition}: {e}')
+                        return
+                    await asyncio.sleep(wait_time)
+
+            os.remove(zip_file_path)
+            print(f"Partição {partition} carregada.")
+
+    async def run(self, file_names):
+        """
+        Carrega os arquivos respeitando TABLE_DEPENDENCIES; os downloads das tabelas seguintes
+        começam enquanto as anteriores ainda estão sendo gravadas.
+
+        :return: Dicionário file_name -> lista de erros (vazia quando a tabela foi carregada por completo).
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        await self.load_checkpoints()
+        order = topological_order(file_names)
+        finished = {file_name: asyncio.get_running_loop().create_future() for file_name in order}
+        self.errors = {file_name: [] for file_name in order}
+
+        async def wait_dependencies(file_name):
+            await asyncio.gather(*(finished[dep] for dep in TABLE_DEPENDENCIES.get(file_name, []) if dep in finished))
+
+        async def load_table(client, file_name):
+            partitions = [
+                partition for partition in partitions_for(self.manifest, file_name)
+                if partition not in self.completed
+            ]
+            print(f"Iniciando {file_name} ({len(partitions)} partições)")
+            dependencies_done = asyncio.ensure_future(wait_dependencies(file_name))
+            await asyncio.gather(*(
+                self.process_partition(client, file_name, partition, asyncio.shield(dependencies_done))
+                for partition in partitions
+            ))
+            status = 'com erros' if self.errors[file_name] else 'com sucesso'
+            print(f"Tabela {file_name} finalizada {status}.")
+            finished[file_name].set_result(None)
+
+        timeout = httpx.Timeout(REQUEST_TIMEOUT)
+        try:
+            async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+                # As tarefas são criadas em ordem topológica: como os semáforos atendem por ordem de chegada,
+                # as dependências sempre conseguem espaço em disco antes das tabelas que dependem delas
+                await asyncio.gather(*(load_table(client, file_name) for file_name in order))
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            await self.engine.dispose()
+        return self.errors
@@ -0,0 +1,244 @@
+import argparse
+import base64
+import binascii
+import hashlib
+import logging
+import math
+import os
+import secrets
+import sys
+import time
+import bcrypt
+import jwt
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from bd import env_flag, session_scope
+from cache import MISSING, TTLCache
+from metrics import log_event, metrics
+from ratelimit import RateLimiter
+from schemas import Client
+
+# Autenticação das aplicações clientes (tabela Clients) e limite de requisições por cliente
+AUTH_ENABLED = env_flag('AUTH_ENABLED', True)  # Exige credenciais ou token nas rotas de consulta
+AUTH_SECRET_KEY = os.getenv('AUTH_SECRET_KEY')  # Chave de assinatura dos tokens (obrigatória com AUTH_ENABLED)
+AUTH_TOKEN_TTL = int(os.getenv('AUTH_TOKEN_TTL', '900'))  # Validade de cada token (segundos)
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))  # Credenciais verificadas mantidas em memória
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', '300'))  # Validade de uma credencial verificada (segundos)
+AUTH_BCRYPT_ROUNDS = int(os.getenv('AUTH_BCRYPT_ROUNDS', '12'))  # Custo do bcrypt dos segredos novos
+RATE_LIMIT_PER_SECOND = float(os.getenv('RATE_LIMIT_PER_SECOND', '20'))  # Requisições por segundo de cada cliente
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '100'))  # Requisições seguidas de cada cliente
+AUTH_VERIFY_PER_SECOND = float(os.getenv('AUTH_VERIFY_PER_SECOND', '1'))  # Verificações com bcrypt por segundo de cada endereço IP
+AUTH_VERIFY_BURST = int(os.getenv('AUTH_VERIFY_BURST', '10'))  # Verificações seguidas de cada endereço IP
+AUTH_VERIFY_MAX_PER_SECOND = float(os.getenv('AUTH_VERIFY_MAX_PER_SECOND', '10'))  # Verificações com bcrypt por segundo no processo
+
+TOKEN_ALGORITHM = 'HS256'
+# Comparado quando o client_id não existe, para que a resposta demore o mesmo que um segredo errado
+UNKNOWN_CLIENT_HASH = bcrypt.hashpw(b'', bcrypt.gensalt(AUTH_BCRYPT_ROUNDS))
+
+credentials_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL, name='auth_cache')
+rate_limiter = RateLimiter(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST)
+# As verificações fora do cache (bcrypt) contam antes de o cliente ser conhecido: por endereço e no processo todo
+verification_limiter = RateLimiter(AUTH_VERIFY_PER_SECOND, AUTH_VERIFY_BURST)
+process_verification_limiter = RateLimiter(AUTH_VERIFY_MAX_PER_SECOND, max(1, math.ceil(AUTH_VERIFY_MAX_PER_SECOND)))
+
+
+def hash_secret(secret):
+    """Hash bcrypt do segredo, no formato gravado em Clients.client_secret."""
+    return bcrypt.hashpw(secret.encode('utf-8'), bcrypt.gensalt(AUTH_BCRYPT_ROUNDS)).decode('ascii')
+
+
+def verify_client(client_id, secret, address=None):
+    """
+    Confere o segredo do cliente com o hash bcrypt gravado. O bcrypt é lento de propósito (centenas de
+    milissegundos), então uma credencial correta fica em cache por AUTH_CACHE_TTL segundos; o cache
+    guarda só o SHA-256 do segredo, nunca o segredo. Credenciais erradas não ficam em cache, e cada
+    verificação fora do cache conta, antes do bcrypt, nos limites de verificação do endereço de origem
+    e do processo (ver charge_verification), e não no do client_id, que ainda não foi comprovado.
+
+    :param address: Endereço IP de origem da requisição.
+    :return: True se o cliente existe e o segredo confere.
+    :raises HTTPException: 429 se o endereço ou o processo excedeu o limite de verificações.
+    """
+    key = (client_id, hashlib.sha256(secret.encode('utf-8')).hexdigest())
+    if credentials_cache.get(key, None) is not MISSING:
+        return True
+    charge_verification(address)
+    with session_scope() as session:
+        stored = session.scalar(select(Client.client_secret).where(Client.client_id == client_id))
+    try:
+        valid = bcrypt.checkpw(secret.encode('utf-8'), stored.encode('ascii') if stored else UNKNOWN_CLIENT_HASH)
+    except ValueError:  # Segredo gravado fora do formato bcrypt
+        valid = False
+    valid = valid and stored is not None
+    if valid:
+        credentials_cache.set(key, True, None)
+    return valid
+
+
+def issue_token(client_id):
+    """
+    Token assinado (JWT HS256) do cliente, válido por AUTH_TOKEN_TTL segundos. As requisições com
+    o token são aceitas só pela assinatura, sem ler o banco nem executar o bcrypt.
+
+    :return: Dicionário no formato de resposta do OAuth2 (access_token, token_type, expires_in).
+    """
+    now = int(time.time())
+    token = jwt.encode(
+        {'sub': client_id, 'iat': now, 'exp': now + AUTH_TOKEN_TTL}, AUTH_SECRET_KEY, algorithm=TOKEN_ALGORITHM
+    )
+    return {'access_token': token, 'token_type': 'bearer', 'expires_in': AUTH_TOKEN_TTL}
+
+
+def decode_token(token):
+    """
+    client_id de um token emitido por issue_token.
+
+    :raises jwt.InvalidTokenError: Se a assinatura não conferir ou o token tiver expirado.
+    """
+    claims = jwt.decode(token, AUTH_SECRET_KEY, algorithms=[TOKEN_ALGORITHM], options={'require': ['exp', 'sub']})
+    return claims['sub']
+
+
+def parse_basic(value):
+    """(client_id, segredo) do valor de um cabeçalho 'Authorization: Basic ...', ou None se for inválido."""
+    try:
+        decoded = base64.b64decode(value.strip(), validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    client_id, separator, secret = decoded.partition(':')
+    return (client_id, secret) if separator else None
+
+
+def unauthorized(detail):
+    metrics.increment('auth_failures')
+    raise HTTPException(status_code=401, detail=detail, headers={'WWW-Authenticate': 'Bearer'})
+
+
+def acquire(limiter, key, cost=1, **fields):
+    """
+    Gasta fichas de um limite.
+
+    :raises HTTPException: 429 (com Retry-After) se o limite foi excedido.
+    """
+    wait = limiter.acquire(key, cost)
+    if wait:
+        metrics.increment('rate_limited')
+        log_event('rate_limited', logging.DEBUG, cost=cost, retry_after=round(wait, 3), **fields)
+        raise HTTPException(
+            status_code=429, detail='Limite de requisições excedido', headers={'Retry-After': str(math.ceil(wait))}
+        )
+
+
+def charge(client_id, cost=1):
+    """
+    Gasta fichas do limite de requisições do cliente (já autenticado).
+
+    :raises HTTPException: 429 (com Retry-After) se o cliente excedeu o limite.
+    """
+    if client_id is None or cost <= 0:
+        return
+    acquire(rate_limiter, client_id, cost, client_id=client_id)
+
+
+def charge_verification(address):
+    """
+    Gasta uma ficha dos limites de verificação de credenciais com bcrypt: o do endereço de origem e o
+    do processo. Assim, credenciais erradas ou client_ids inventados não gastam o limite de um cliente
+    real, e o tempo de CPU gasto com o bcrypt fica limitado mesmo com muitos endereços.
+
+    :param address: Endereço IP de origem da requisição.
+    :raises HTTPException: 429 (com Retry-After) se o endereço ou o processo excedeu o limite.
+    """
+    acquire(verification_limiter, address, address=address)
+    acquire(process_verification_limiter, None, address=address)
+
+
+def client_token(client_id, secret, address=None):
+    """
+    Emite um token para as credenciais do cliente (rota /token).
+
+    :param address: Endereço IP de origem da requisição.
+    :raises HTTPException: 401 se as credenciais não conferirem; 429 se o endereço excedeu o limite
+        de verificações ou o cliente excedeu o limite de requisições.
+    """
+    if not verify_client(client_id, secret, address):
+        unauthorized('Credenciais inválidas')
+    charge(client_id)
+    log_event('token_issued', logging.DEBUG, client_id=client_id)
+    return issue_token(client_id)
+
+
+def client_address(request):
+    """Endereço IP de origem da requisição (None se o servidor não o informar)."""
+    return request.client.host if request.client else None
+
+
+def authenticate(request: Request):
+    """
+    Dependência das rotas de consulta: identifica o cliente pelo token ('Authorization: Bearer <token>',
+    ver /token) ou pelas próprias credenciais ('Authorization: Basic', verificadas uma vez e mantidas
+    em cache). A requisição é contada no limite do cliente, uma vez, por rate_limited ou pela própria rota.
+
+    :return: client_id, ou None com AUTH_ENABLED=false.
+    :raises HTTPException: 401 sem credenciais válidas; 429 se o endereço excedeu o limite de verificações.
+    """
+    if not AUTH_ENABLED:
+        return None
+    scheme, _, value = request.headers.get('authorization', '').partition(' ')
+    scheme = scheme.lower()
+    if scheme == 'bearer':
+        try:
+            return decode_token(value.strip())
+        except jwt.InvalidTokenError:
+            unauthorized('Token inválido ou expirado')
+    if scheme == 'basic':
+        credentials = parse_basic(value)
+        if credentials is None or not verify_client(*credentials, client_address(request)):
+            unauthorized('Credenciais inválidas')
+        return credentials[0]
+    unauthorized('Envie um token (Authorization: Bearer) ou as credenciais do cliente (Authorization: Basic)')
+
+
+def rate_limited(client_id: str = Depends(authenticate)):
+    """
+    Dependência das rotas de consulta de custo fixo: autentica o cliente e gasta uma ficha do limite dele.
+
+    :raises HTTPException: 401 sem credenciais válidas; 429 se o cliente excedeu o limite.
+    """
+    charge(client_id)
+    return client_id
+
+
+def create_client(session, client_id):
+    """
+    Cadastra um cliente com um segredo novo, ou troca o segredo de um cliente existente. Só o hash
+    bcrypt é gravado; os processos da API ainda aceitam o segredo antigo por até AUTH_CACHE_TTL segundos.
+
+    :param session: Sessão do banco de dados.
+    :param client_id: Identificador do cliente (até 32 caracteres).
+    :return: Segredo gerado (não pode ser recuperado depois).
+    """
+    secret = secrets.token_urlsafe(32)
+    statement = insert(Client).values(client_id=client_id, client_secret=hash_secret(secret))
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[Client.client_id],
+        set_={'client_secret': statement.excluded.client_secret, 'updated_at': func.now()}
+    ))
+    return secret
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Cadastra um cliente da API ou troca o segredo dele.')
+    parser.add_argument('client_id', help='Identificador do cliente (até 32 caracteres)')
+    args = parser.parse_args(argv)
+    with session_scope() as session:
+        secret = create_client(session, args.client_id)
+    print(f"client_id: {args.client_id}")
+    print(f"client_secret: {secret}")
+    print("Guarde o segredo agora: só o hash dele fica no banco.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,454 @@
+"""
+Benchmark do pipeline com arquivos sintéticos no layout da Receita.
+
+Gera ZIPs com registros sintéticos (ISO-8859-1, separados por ';') para cada layout, mede cada etapa
+isoladamente (descompressão, leitura, normalização e gravação) e a carga completa, e grava o
+resultado em JSON para comparar execuções.
+
+Exemplos:
+    python benchmark.py --rows 200000 --output baseline.json
+    python benchmark.py --rows 200000 --baseline baseline.json
+    python benchmark.py --layouts Empresas Simples --database-url postgresql+psycopg2://... --truncate
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from schemas import table_registry
+from documents import cnpj_check_digits
+from layouts import LAYOUTS
+from loader import copy_frame_into_table, frame_to_csv, quote_identifier
+from metrics import current_rss, metrics
+from normalizer import normalize_frame, to_table_frame
+from pipeline import BATCH_SIZE, PARSE_BACKENDS, layout_dtypes, read_batches, resolve_backend, zip_pipeline
+
+DEFAULT_ROWS = 100000  # Registros por arquivo grande
+LOOKUP_ROWS = 5000  # Registros por tabela de domínio
+DEFAULT_SEED = 42
+REGRESSION_TOLERANCE = 0.10  # Queda de registros/s aceita antes de apontar regressão
+MEMORY_SAMPLE_INTERVAL = 0.01  # Segundos entre as amostras de memória
+
+# Nome do arquivo de dados dentro do ZIP, como publicado pela Receita
+MEMBER_NAMES = {
+    'Empresas': 'K3241.K03200Y0.D50308.EMPRECSV',
+    'Estabelecimentos': 'K3241.K03200Y0.D50308.ESTABELE',
+    'Socios': 'K3241.K03200Y0.D50308.SOCIOCSV',
+    'Simples': 'F.K03200$W.SIMPLES.CSV.D50308',
+    'Cnaes': 'F.K03200$Z.D50308.CNAECSV',
+    'Naturezas': 'F.K03200$Z.D50308.NATJUCSV',
+    'Qualificacoes': 'F.K03200$Z.D50308.QUALSCSV',
+    'Municipios': 'F.K03200$Z.D50308.MUNICCSV',
+    'Paises': 'F.K03200$Z.D50308.PAISCSV',
+    'Motivos': 'F.K03200$Z.D50308.MOTICSV',
+}
+
+WORDS = [
+    'COMERCIO', 'SERVIÇOS', 'INDÚSTRIA', 'CONSTRUÇÃO', 'JOÃO', 'JOSÉ', 'SÃO', 'PAULO', 'ASSOCIAÇÃO',
+    'TRANSPORTES', 'ALIMENTAÇÃO', 'DISTRIBUIDORA', 'MÉDICOS', 'PEÇAS', 'LTDA', 'EIRELI', 'ME', 'SA',
+]
+UFS = ['SP', 'RJ', 'MG', 'RS', 'PR', 'BA', 'SC', 'GO', 'PE', 'CE', 'EX']
+
+
+class PeakMemory:
+    """Amostra a memória residente em uma thread enquanto o bloco executa e guarda o pico."""
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def sequence(rows, width, start=1):
+    """Códigos sequenciais com zeros à esquerda (chaves únicas e reproduzíveis)."""
+    return pd.Series(np.arange(start, start + rows)).astype(str).str.zfill(width)
+
+
+def choice(rng, values, rows):
+    return pd.Series(rng.choice(values, rows))
+
+
+def digits(rng, rows, width):
+    return pd.Series(rng.integers(0, 10 ** width, rows)).astype(str).str.zfill(width)
+
+
+def names(rng, rows, words=3):
+    result = choice(rng, WORDS, rows)
+    for _ in range(words - 1):
+        result = result + ' ' + choice(rng, WORDS, rows)
+    return result
+
+
+def dates(rng, rows, empty_ratio=0.1):
+    """Datas YYYYMMDD, com uma parte '00000000' ou vazia, como no arquivo da Receita."""
+    days = pd.Series(rng.integers(0, 365 * 40, rows))
+    values = (pd.Timestamp('1985-01-01') + pd.to_timedelta(days, unit='D')).dt.strftime('%Y%m%d')
+    empty = rng.random(rows) < empty_ratio
+    return values.where(~empty, choice(rng, ['00000000', ''], rows))
+
+
+def synthetic_column(header, rows, rng):
+    """Valores sintéticos para uma coluna do layout, de acordo com o cabeçalho."""
+    if header == 'CNPJ BASICO':
+        return sequence(rows, 8)
+    if header == 'CODIGO':
+        return sequence(rows, 7)
+    if header == 'CNPJ ORDEM':
+        return choice(rng, ['0001', '0002', '0003'], rows)
+    if header == 'CNPJ DV':
+        return digits(rng, rows, 2)
+    if header == 'CNPJ/CPF DO SOCIO':
+        return '***' + sequence(rows, 6) + '**'
+    if header == 'REPRESENTANTE LEGAL':
+        return choice(rng, ['***000000**', '***123456**'], rows)
+    if header.startswith('DATA'):
+        # Data de entrada do sócio é obrigatória na tabela
+        return dates(rng, rows, empty_ratio=0 if header == 'DATA DE ENTRADA SOCIEDADE' else 0.1)
+    if header == 'CAPITAL SOCIAL DA EMPRESA':
+        return pd.Series(rng.integers(0, 10 ** 7, rows)).astype(str) + ',' + digits(rng, rows, 2)
+    if header == 'PAIS':
+        return choice(rng, ['105', '023', '249'], rows)
+    if header == 'UF':
+        return choice(rng, UFS, rows)
+    if header == 'CEP':
+        return digits(rng, rows, 8)
+    if header.startswith('DDD'):
+        return digits(rng, rows, 2)
+    if header.startswith('TELEFONE') or header == 'FAX':
+        return digits(rng, rows, 8)
+    if header == 'NUMERO':
+        return choice(rng, ['S/N', '10', '1234', '55'], rows)
+    if header == 'CORREIO ELETRONICO':
+        return 'contato' + sequence(rows, 6) + '@exemplo.com.br'
+    if header.startswith('OPCAO PELO'):
+        return choice(rng, ['S', 'N'], rows)
+    if header == 'FAIXA ETARIA':
+        return choice(rng, list('0123456789'), rows)
+    if header in ('IDENTIFICADOR MATRIZ/FILIAL', 'IDENTIFICADOR DE SOCIO', 'PORTE DA EMPRESA'):
+        return choice(rng, ['1', '2', '3'], rows)
+    if header.startswith('SITUACAO') or header.startswith('MOTIVO'):
+        return choice(rng, ['01', '02', '04', '08'], rows)
+    if header.startswith(('NATUREZA', 'QUALIFICACAO', 'CNAE', 'MUNICIPIO')):
+        return digits(rng, rows, 4)
+    return names(rng, rows)
+
+
+def synthetic_frame(layout_name, rows, seed=DEFAULT_SEED):
+    """DataFrame sintético com as colunas do layout, reproduzível pela semente."""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        header: synthetic_column(header, rows, rng) for header in LAYOUTS[layout_name]['header']
+    })
+    if 'CNPJ DV' in frame.columns:
+        # DVs corretos, para que os estabelecimentos não sejam recusados na carga
+        frame['CNPJ DV'] = cnpj_check_digits(frame['CNPJ BASICO'] + frame['CNPJ ORDEM'])
+    return frame
+
+
+def write_fixture(layout_name, rows, folder, seed=DEFAULT_SEED):
+    """
+    Grava o ZIP sintético do layout (reaproveitado se já existir com os mesmos parâmetros).
+
+    :return: Caminho do ZIP.
+    """
+    os.makedirs(folder, exist_ok=True)
+    zip_path = os.path.join(folder, f'{layout_name}_{rows}_{seed}.zip')
+    if os.path.exists(zip_path):
+        return zip_path
+
+    frame = synthetic_frame(layout_name, rows, seed)
+    content = frame.to_csv(sep=';', header=False, index=False, quoting=1, lineterminator='\n')
+    tmp_path = f'{zip_path}.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(MEMBER_NAMES[layout_name], content.encode('ISO-8859-1'))
+    os.replace(tmp_path, zip_path)
+    return zip_path
+
+
+class SQLiteTarget:
+    """
+    Banco SQLite usado no lugar do PostgreSQL quando não há um servidor disponível.
+    A gravação usa INSERT OR REPLACE em lote; os números não são comparáveis com o COPY do PostgreSQL,
+    mas servem para comparar execuções entre si.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        engine = create_engine(f'sqlite:///{path}')
+        table_registry.metadata.create_all(engine)
+        engine.dispose()
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+    def truncate(self, model):
+        self.connection.execute(f'DELETE FROM {quote_identifier(model.__tablename__)}')
+        self.connection.commit()
+
+    def load(self, model, frame):
+        if frame.empty:
+            return 0
+        frame = frame.copy()
+        for column in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(frame[column]):
+                frame[column] = frame[column].dt.strftime('%Y-%m-%d %H:%M:%S')
+        frame = frame.astype(object).where(frame.notna(), None)
+        columns = ', '.join(quote_identifier(column) for column in frame.columns)
+        placeholders = ', '.join('?' for _ in frame.columns)
+        self.connection.executemany(
+            f'INSERT OR REPLACE INTO {quote_identifier(model.__tablename__)} ({columns}) VALUES ({placeholders})',
+            frame.itertuples(index=False, name=None)
+        )
+        self.connection.commit()
+        return len(frame)
+
+    def close(self):
+        self.connection.close()
+
+
+class PostgresTarget:
+    """Banco PostgreSQL, gravado pelo mesmo caminho da carga real (COPY + INSERT ... ON CONFLICT)."""
+
+    name = 'postgresql'
+
+    def __init__(self, url):
+        self.engine = create_engine(url)
+        table_registry.metadata.create_all(self.engine)
+
+    def truncate(self, model):
+        with Session(self.engine) as session:
+            session.execute(text(f'TRUNCATE {quote_identifier(model.__tablename__)}'))
+            session.commit()
+
+    def load(self, model, frame):
+        with Session(self.engine) as session:
+            rows = copy_frame_into_table(session, model, frame)
+            session.commit()
+        return rows
+
+    def close(self):
+        self.engine.dispose()
+
+
+def measure(name, function, rows=0, nbytes=0):
+    """
+    Executa 'function' medindo tempo e pico de memória.
+
+    :return: (resultado da função, dicionário com as medidas).
+    """
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+    if callable(rows):
+        rows = rows(result)
+    if callable(nbytes):
+        nbytes = nbytes(result)
+    return result, {
+        'stage': name,
+        'rows': rows,
+        'bytes': nbytes,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds) if seconds > 0 else 0,
+        'mb_per_second': round(nbytes / 1024 ** 2 / seconds, 2) if seconds > 0 else 0,
+        'peak_rss_mb': round(memory.peak / 1024 ** 2, 1),
+    }
+
+
+def benchmark_layout(layout_name, zip_path, target, batch_size=BATCH_SIZE, truncate=True, backend='pandas'):
+    """
+    Mede as etapas de um layout isoladamente e a carga completa.
+
+    :param backend: Leitor dos CSVs ('pandas' ou 'pyarrow').
+
+    :return: Lista de medidas (uma por etapa).
+    """
+    model = LAYOUTS[layout_name]['model']
+    date = datetime(2025, 3, 1)
+    results = []
+
+    def extract():
+        with zipfile.ZipFile(zip_path) as zip_file:
+            with zip_file.open(MEMBER_NAMES[layout_name]) as member:
+                return member.read()
+
+    raw, result = measure('extract', extract, rows=lambda data: data.count(b'\n'), nbytes=lambda data: len(data))
+    results.append(result)
+
+    def parse():
+        return list(read_batches(io.BytesIO(raw), batch_size, dtype=layout_dtypes(layout_name), backend=backend))
+
+    batches, result = measure('parse', parse, rows=lambda frames: sum(map(len, frames)), nbytes=len(raw))
+    results.append(result)
+    rows = result['rows']
+    del raw
+
+    header = LAYOUTS[layout_name]['header']
+
+    def normalize():
+        frames = []
+        for batch in batches:
+            batch.columns = header
+            frames.append(to_table_frame(layout_name, normalize_frame(layout_name, batch), date))
+        return frames
+
+    table_frames, result = measure('normalize', normalize, rows=rows)
+    results.append(result)
+    del batches
+
+    csv_bytes = sum(len(frame_to_csv(frame).getvalue()) for frame in table_frames)
+    if truncate:
+        target.truncate(model)
+    _, result = measure('load', lambda: [target.load(model, frame) for frame in table_frames], rows=rows, nbytes=csv_bytes)
+    results.append(result)
+    del table_frames
+
+    def end_to_end():
+        for batch in zip_pipeline(zip_path, layout_name, batch_size, backend=backend):
+            target.load(model, to_table_frame(layout_name, batch, date))
+
+    if truncate:
+        target.truncate(model)
+    metrics.reset()
+    _, result = measure('end_to_end', end_to_end, rows=rows, nbytes=os.path.getsize(zip_path))
+    # Divisão do tempo da carga completa entre as etapas (medida pelo próprio pipeline)
+    result['breakdown'] = {
+        entry['stage']: round(entry['seconds'], 4) for entry in metrics.snapshot()['stages'] if entry['stage'] != 'load'
+    }
+    results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compara registros/s de cada etapa com o baseline.
+
+    :return: Lista de regressões (textos); vazia quando nenhuma etapa ficou mais lenta que a tolerância.
+    """
+    if baseline.get('parameters') != results['parameters']:
+        print(f"Aviso: parâmetros diferentes do baseline ({baseline.get('parameters')}); a comparação é aproximada.")
+    previous = {
+        (layout['layout'], stage['stage']): stage for layout in baseline['layouts'] for stage in layout['stages']
+    }
+    regressions = []
+    print(f"{'layout':<18}{'etapa':<12}{'baseline':>14}{'atual':>14}{'variação':>10}")
+    for layout in results['layouts']:
+        for stage in layout['stages']:
+            before = previous.get((layout['layout'], stage['stage']))
+            if not before or not before['rows_per_second']:
+                continue
+            ratio = stage['rows_per_second'] / before['rows_per_second']
+            print(f"{layout['layout']:<18}{stage['stage']:<12}{before['rows_per_second']:>14}"
+                  f"{stage['rows_per_second']:>14}{ratio - 1:>+10.1%}")
+            if ratio < 1 - tolerance:
+                regressions.append(f"{layout['layout']}/{stage['stage']}: {ratio - 1:+.1%}")
+    return regressions
+
+
+def run(layouts, rows, lookup_rows, seed, fixtures_dir, target, batch_size=BATCH_SIZE, truncate=True, backend=None):
+    """Gera os arquivos sintéticos e executa o benchmark de cada layout."""
+    backend = resolve_backend(backend)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'parameters': {
+            'rows': rows, 'lookup_rows': lookup_rows, 'seed': seed, 'batch_size': batch_size, 'target': target.name,
+            'backend': backend,
+        },
+        'layouts': [],
+    }
+    for layout_name in layouts:
+        layout_rows = rows if layout_name in ('Empresas', 'Estabelecimentos', 'Socios', 'Simples') else lookup_rows
+        zip_path = write_fixture(layout_name, layout_rows, fixtures_dir, seed)
+        print(f"{layout_name}: {layout_rows} registros ({os.path.getsize(zip_path) / 1024 ** 2:.1f} MB compactado)")
+        stages = benchmark_layout(layout_name, zip_path, target, batch_size, truncate, backend)
+        for stage in stages:
+            print(f"  {stage['stage']:<12}{stage['rows_per_second']:>10} registros/s"
+                  f"{stage['mb_per_second']:>10} MB/s{stage['peak_rss_mb']:>10} MB pico")
+        report['layouts'].append({'layout': layout_name, 'rows': layout_rows, 'stages': stages})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark do pipeline com arquivos sintéticos no layout da Receita.')
+    parser.add_argument('--layouts', nargs='+', default=list(LAYOUTS), choices=list(LAYOUTS))
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help='Registros por arquivo grande')
+    parser.add_argument('--lookup-rows', type=int, default=LOOKUP_ROWS, help='Registros por tabela de domínio')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--backend', choices=PARSE_BACKENDS, help='Leitor dos CSVs (padrão: PARSE_BACKEND)')
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'cnpj_benchmark'))
+    parser.add_argument('--database-url', help='PostgreSQL de testes; sem ele é usado um SQLite temporário')
+    parser.add_argument('--truncate', action='store_true',
+                        help='Esvazia as tabelas do PostgreSQL antes de cada carga (use somente em banco de testes)')
+    parser.add_argument('--output', help='Grava o resultado em JSON (ex.: baseline.json)')
+    parser.add_argument('--baseline', help='Compara o resultado com um JSON gravado anteriormente')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+    os.makedirs(args.fixtures_dir, exist_ok=True)
+
+    if args.database_url:
+        target = PostgresTarget(args.database_url)
+        truncate = args.truncate
+        if not truncate:
+            print("Aviso: sem --truncate as cargas fazem upsert sobre os dados existentes e os números variam entre execuções.")
+    else:
+        target = SQLiteTarget(os.path.join(args.fixtures_dir, 'benchmark.sqlite3'))
+        truncate = True
+
+    try:
+        report = run(args.layouts, args.rows, args.lookup_rows, args.seed, args.fixtures_dir, target,
+                     args.batch_size, truncate, args.backend)
+    finally:
+        target.close()
+
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+        print(f"Resultado gravado em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            regressions = compare(report, json.load(fd), args.tolerance)
+        if regressions:
+            print("Regressões acima da tolerância:", ', '.join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bd import engine, env_flag
+from checkpoints import checkpoint_statement, file_checkpoints_delete_statement
+from loader import quote_identifier
+from metrics import log_event
+
+# Carga completa (fullRefreshBd): a tabela nova é carregada sem índices e recebe os índices ao final
+BULK_LOAD_UNLOGGED = env_flag('BULK_LOAD_UNLOGGED', True)  # Tabela nova sem WAL durante a carga
+BULK_INDEX_WORKERS = int(os.getenv('BULK_INDEX_WORKERS', '4'))  # Índices criados ao mesmo tempo (uma conexão cada)
+BULK_PARALLEL_WORKERS = int(os.getenv('BULK_PARALLEL_WORKERS', '2'))  # Workers do PostgreSQL por índice
+BULK_MAINTENANCE_WORK_MEM = os.getenv('BULK_MAINTENANCE_WORK_MEM', '1GB')  # Memória de cada criação de índice
+BULK_SWAP_LOCK_TIMEOUT = os.getenv('BULK_SWAP_LOCK_TIMEOUT', '60s')  # Espera máxima pelas consultas na troca
+
+REFRESH_SUFFIX = '__refresh'
+MAX_IDENTIFIER_LENGTH = 63  # Nomes maiores são truncados pelo PostgreSQL
+
+# Índices da tabela atual, com a restrição (chave primária, unique) que cada um sustenta
+INDEXES_SQL = """
+SELECT index_class.relname, pg_get_indexdef(index_class.oid), con.conname, con.contype
+FROM pg_index idx
+JOIN pg_class index_class ON index_class.oid = idx.indexrelid
+LEFT JOIN pg_constraint con ON con.conindid = idx.indexrelid AND con.conrelid = idx.indrelid
+WHERE idx.indrelid = to_regclass(%(table)s)
+"""
+
+# Restrições que não dependem de índice (CHECK e chaves estrangeiras para outras tabelas)
+CONSTRAINTS_SQL = """
+SELECT conname, pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE conrelid = to_regclass(%(table)s) AND contype IN ('c', 'f')
+"""
+
+# Chaves estrangeiras de outras tabelas que apontam para a tabela
+REFERENCING_SQL = """
+SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = to_regclass(%(table)s)
+"""
+
+
+def refresh_name(name):
+    """Nome do objeto correspondente na tabela nova (ex.: 'Companies_pkey' -> 'Companies_pkey__refresh')."""
+    return name[:MAX_IDENTIFIER_LENGTH - len(REFRESH_SUFFIX)] + REFRESH_SUFFIX
+
+
+def build_index(statement):
+    """Executa um CREATE INDEX em uma conexão própria, com memória e workers paralelos da carga completa."""
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"SET LOCAL maintenance_work_mem = '{BULK_MAINTENANCE_WORK_MEM}'")
+        connection.exec_driver_sql(f'SET LOCAL max_parallel_maintenance_workers = {BULK_PARALLEL_WORKERS}')
+        connection.exec_driver_sql(statement)
+
+
+class TableRefresh:
+    """
+    Carga completa de uma tabela sem manter índices a cada registro:
+
+    1. prepare(): cria a tabela nova (UNLOGGED, sem índices nem restrições) com as colunas da atual;
+    2. a carga grava nela com COPY puro (append_frame_into_table);
+    3. finish(): remove chaves repetidas, volta a registrar WAL, cria os índices em paralelo, recria as
+       restrições e atualiza as estatísticas (ANALYZE);
+    4. swap_tables(): em uma única transação, substitui a tabela atual e as derivadas pelas novas e restaura
+       os nomes dos índices e restrições. Até o commit, as consultas continuam vendo as tabelas atuais,
+       nunca uma carga pela metade nem uma tabela principal nova com derivadas antigas.
+    """
+
+    def __init__(self, model):
+        """
+        :param model: Classe mapeada da tabela (Company, Establishment, ...).
+        """
+        self.model = model
+        self.table = model.__tablename__
+        self.refresh_table = refresh_name(self.table)
+        self.indexes = []
+        self.constraints = []
+
+    def step(self, name, function, *args):
+        """Executa uma etapa e registra o tempo gasto."""
+        start = time.perf_counter()
+        result = function(*args)
+        log_event('refresh_step', table=self.table, step=name, seconds=round(time.perf_counter() - start, 3))
+        return result
+
+    def prepare(self):
+        """
+        Cria a tabela nova, vazia, que recebe a carga.
+
+        :raises RuntimeError: Se outras tabelas tiverem chaves estrangeiras apontando para a tabela
+            (elas continuariam apontando para a tabela antiga).
+        """
+        with engine.begin() as connection:
+            referencing = connection.exec_driver_sql(REFERENCING_SQL, {'table': quote_identifier(self.table)}).all()
+            if referencing:
+                names = ', '.join(f'{table}.{name}' for table, name in referencing)
+                raise RuntimeError(f"{self.table} é referenciada por chaves estrangeiras ({names}); use a carga normal")
+
+            self.indexes = connection.exec_driver_sql(INDEXES_SQL, {'table': quote_identifier(self.table)}).all()
+            self.constraints = connection.exec_driver_sql(CONSTRAINTS_SQL, {'table': quote_identifier(self.table)}).all()
+
+            unlogged = 'UNLOGGED ' if BULK_LOAD_UNLOGGED else ''
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS {quote_identifier(self.refresh_table)}')
+            connection.exec_driver_sql(
+                f'CREATE {unlogged}TABLE {quote_identifier(self.refresh_table)} '
+                f'(LIKE {quote_identifier(self.table)} INCLUDING DEFAULTS)'
+            )
+        print(f"Tabela {self.refresh_table} criada para a carga completa de {self.table}.")
+
+    def remove_duplicate_keys(self):
+        """
+        Mantém um registro por chave primária (o último gravado), como o INSERT ... ON CONFLICT da carga
+        normal. Repetições aparecem quando uma partição é carregada de novo após uma falha.
+        """
+        key_list = ', '.join(quote_identifier(column.name) for column in self.model.__table__.primary_key.columns)
+        with engine.begin() as connection:
+            result = connection.exec_driver_sql(
+                f'DELETE FROM {quote_identifier(self.refresh_table)} WHERE ctid IN ('
+                f'SELECT ctid FROM (SELECT ctid, row_number() OVER (PARTITION BY {key_list} ORDER BY ctid DESC) AS position '
+                f'FROM {quote_identifier(self.refresh_table)}) ranked WHERE position > 1)'
+            )
+        if result.rowcount:
+            print(f"{result.rowcount} registros repetidos removidos de {self.refresh_table}.")
+
+    def set_logged(self):
+        """Volta a registrar a tabela no WAL (antes dos índices, para que eles não sejam reescritos)."""
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'ALTER TABLE {quote_identifier(self.refresh_table)} SET LOGGED')
+
+    def build_indexes(self):
+        """Cria os índices da tabela atual na tabela nova, BULK_INDEX_WORKERS ao mesmo tempo."""
+        statements = []
+        for index_name, definition, _, _ in self.indexes:
+            # pg_get_indexdef: CREATE [UNIQUE] INDEX nome ON schema.tabela USING metodo (colunas) ...
+            unique = 'UNIQUE ' if definition.startswith('CREATE UNIQUE') else ''
+            using = definition[definition.index(' USING '):]
+            statements.append(
+                f'CREATE {unique}INDEX {quote_identifier(refresh_name(index_name))} '
+                f'ON {quote_identifier(self.refresh_table)}{using}'
+            )
+        with ThreadPoolExecutor(max_workers=BULK_INDEX_WORKERS) as executor:
+            list(executor.map(build_index, statements))
+
+    def add_constraints(self):
+        """Recria chave primária e unique sobre os índices já criados, e as demais restrições da tabela."""
+        with engine.begin() as connection:
+            for index_name, _, constraint_name, constraint_type in self.indexes:
+                kind = {'p': 'PRIMARY KEY', 'u': 'UNIQUE'}.get(constraint_type)
+                if kind is None:
+                    continue
+                # O índice passa a ter o nome da restrição
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {quote_identifier(self.refresh_table)} '
+                    f'ADD CONSTRAINT {quote_identifier(refresh_name(constraint_name))} '
+                    f'{kind} USING INDEX {quote_identifier(refresh_name(index_name))}'
+                )
+            for constraint_name, definition in self.constraints:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {quote_identifier(self.refresh_table)} '
+                    f'ADD CONSTRAINT {quote_identifier(refresh_name(constraint_name))} {definition}'
+                )
+
+    def analyze(self):
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'ANALYZE {quote_identifier(self.refresh_table)}')
+
+    def finish(self):
+        """Prepara a tabela nova para substituir a atual (chaves únicas, WAL, índices, restrições e estatísticas)."""
+        self.step('deduplicate', self.remove_duplicate_keys)
+        if BULK_LOAD_UNLOGGED:
+            self.step('set_logged', self.set_logged)
+        self.step('indexes', self.build_indexes)
+        self.step('constraints', self.add_constraints)
+        self.step('analyze', self.analyze)
+
+    def rename(self, connection):
+        """
+        Substitui a tabela atual pela nova e restaura os nomes dos índices e restrições, na transação de
+        'connection' (ver swap_tables, que bloqueia as tabelas antes).
+        """
+        table = quote_identifier(self.table)
+        connection.exec_driver_sql(f'DROP TABLE {table}')
+        connection.exec_driver_sql(f'ALTER TABLE {quote_identifier(self.refresh_table)} RENAME TO {table}')
+        for index_name, _, constraint_name, constraint_type in self.indexes:
+            if constraint_type in ('p', 'u'):
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table} RENAME CONSTRAINT '
+                    f'{quote_identifier(refresh_name(constraint_name))} TO {quote_identifier(constraint_name)}'
+                )
+            else:
+                connection.exec_driver_sql(
+                    f'ALTER INDEX {quote_identifier(refresh_name(index_name))} RENAME TO {quote_identifier(index_name)}'
+                )
+        for constraint_name, _ in self.constraints:
+            connection.exec_driver_sql(
+                f'ALTER TABLE {table} RENAME CONSTRAINT '
+                f'{quote_identifier(refresh_name(constraint_name))} TO {quote_identifier(constraint_name)}'
+            )
+
+    def discard(self):
+        """Apaga a tabela nova (carga completa abandonada); a tabela atual não é alterada."""
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS {quote_identifier(self.refresh_table)}')
+
+
+def swap_tables(refreshes, month=None, file_name=None, partitions=()):
+    """
+    Substitui as tabelas atuais pelas novas (a tabela principal e as derivadas dela) em uma única transação.
+    Com 'month', os checkpoints do arquivo no mês são trocados, na mesma transação, pelas partições
+    carregadas, marcadas como concluídas (progresso de cargas anteriores do mês não vale para as tabelas novas).
+
+    :param refreshes: TableRefresh de cada tabela, já finalizadas (ver TableRefresh.finish).
+    :param month: Mês carregado (ex.: '2025-03'), opcional.
+    :param file_name: Nome do arquivo (ex.: 'Empresas'), cujos checkpoints do mês são apagados.
+    :param partitions: Partições carregadas (ex.: ['Empresas0', ..., 'Empresas9']).
+    """
+    start = time.perf_counter()
+    tables = ', '.join(quote_identifier(refresh.table) for refresh in refreshes)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"SET LOCAL lock_timeout = '{BULK_SWAP_LOCK_TIMEOUT}'")
+        # Aguarda as consultas em andamento; as seguintes esperam o commit e já leem as tabelas novas
+        connection.exec_driver_sql(f'LOCK TABLE {tables} IN ACCESS EXCLUSIVE MODE')
+        for refresh in refreshes:
+            refresh.rename(connection)
+        if month is not None:
+            if file_name is not None:
+                connection.execute(file_checkpoints_delete_statement(month, file_name))
+            for partition in partitions:
+                connection.execute(checkpoint_statement(month, partition, 0, 0, completed=True))
+    for refresh in refreshes:
+        log_event('refresh_step', table=refresh.table, step='swap', seconds=round(time.perf_counter() - start, 3))
+        print(f"Tabela {refresh.table} substituída pela carga completa.")
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+from metrics import metrics
+
+MISSING = object()  # Resultado de get quando a chave não está no cache (None é um valor válido: "não encontrado")
+
+
+class TTLCache:
+    """
+    Cache LRU em memória com prazo de validade (TTL) e versão dos dados. Uma entrada gravada em
+    outra versão (ex.: antes de uma nova carga mensal) é tratada como ausente, sem precisar
+    percorrer o cache para apagá-la; ela é descartada quando lida ou quando sai pelo LRU.
+    Seguro para uso por várias threads.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, name='cache'):
+        """
+        :param max_entries: Quantidade máxima de entradas; as menos usadas saem primeiro.
+        :param ttl_seconds: Validade de cada entrada, em segundos.
+        :param name: Prefixo das métricas de acertos e erros (ex.: 'api_cache' -> api_cache_hits).
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # chave -> (versão, expira em, valor)
+
+    def get(self, key, version):
+        """
+        Valor da chave gravado na versão informada e ainda dentro da validade.
+
+        :return: Valor ou MISSING.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, value = entry
+                if entry_version == version and expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    metrics.increment(f'{self.name}_hits')
+                    return value
+                del self.entries[key]
+        metrics.increment(f'{self.name}_misses')
+        return MISSING
+
+    def set(self, key, value, version):
+        """Grava o valor da chave na versão informada, descartando a entrada menos usada se o cache estiver cheio."""
+        with self.lock:
+            self.entries[key] = (version, time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
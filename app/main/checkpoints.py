@@ -0,0 +1,106 @@
+import re
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from schemas import IngestionCheckpoint
+
+MAX_LOAD_ATTEMPTS = 5  # Tentativas de carga de cada arquivo, retomando do último lote gravado
+
+
+def get_checkpoint(session, month, file_name):
+    """
+    Progresso gravado da carga de um arquivo no mês.
+
+    :param session: Sessão do banco de dados.
+    :param month: Mês em carga (ex.: '2025-03').
+    :param file_name: Nome da partição (ex.: 'Estabelecimentos7').
+    :return: IngestionCheckpoint ou None se o arquivo ainda não começou a ser carregado.
+    """
+    return session.get(IngestionCheckpoint, (month, file_name))
+
+
+def month_checkpoints_statement(month):
+    """SELECT do progresso de todas as partições do mês (partição, registros, lotes, concluída)."""
+    return select(
+        IngestionCheckpoint.file_name,
+        IngestionCheckpoint.rows_committed,
+        IngestionCheckpoint.batches_committed,
+        IngestionCheckpoint.completed,
+    ).where(IngestionCheckpoint.month == month)
+
+
+def completed_files_statement(month):
+    """SELECT dos nomes das partições já carregadas por completo no mês."""
+    return select(IngestionCheckpoint.file_name).where(
+        IngestionCheckpoint.month == month, IngestionCheckpoint.completed.is_(True)
+    )
+
+
+def completed_files(session, month):
+    """Nomes das partições já carregadas por completo no mês."""
+    return set(session.scalars(completed_files_statement(month)))
+
+
+def partitions_of(file_names):
+    """Condição das partições dos arquivos ('Empresas' -> 'Empresas', 'Empresas0', ..., 'Empresas9')."""
+    names = '|'.join(re.escape(file_name) for file_name in file_names)
+    return IngestionCheckpoint.file_name.regexp_match(f'^({names})[0-9]*$')
+
+
+def file_checkpoints_delete_statement(month, file_name):
+    """DELETE do progresso de todas as partições de um arquivo no mês."""
+    return delete(IngestionCheckpoint).where(IngestionCheckpoint.month == month, partitions_of([file_name]))
+
+
+def files_version_statement(month, file_names):
+    """
+    SELECT da quantidade de partições dos arquivos concluídas no mês e do horário da última delas.
+    Muda sempre que uma dessas partições termina de ser carregada (ver lookups.domain_version).
+    """
+    return select(func.count(), func.max(IngestionCheckpoint.updated_at)).where(
+        IngestionCheckpoint.month == month, IngestionCheckpoint.completed.is_(True), partitions_of(file_names)
+    )
+
+
+def checkpoint_statement(month, file_name, rows_committed, batches_committed, completed=False):
+    """INSERT ... ON CONFLICT DO UPDATE que grava o progresso de um arquivo (ver save_checkpoint)."""
+    statement = insert(IngestionCheckpoint).values(
+        month=month,
+        file_name=file_name,
+        rows_committed=rows_committed,
+        batches_committed=batches_committed,
+        completed=completed,
+    )
+    return statement.on_conflict_do_update(
+        index_elements=[IngestionCheckpoint.month, IngestionCheckpoint.file_name],
+        set_={
+            'rows_committed': statement.excluded.rows_committed,
+            'batches_committed': statement.excluded.batches_committed,
+            'completed': statement.excluded.completed,
+            'updated_at': func.now(),
+        }
+    )
+
+
+def save_checkpoint(session, month, file_name, rows_committed, batches_committed, completed=False):
+    """
+    Grava o progresso de um arquivo. Deve ser chamada antes do commit do lote, para que o progresso
+    e os dados sejam gravados na mesma transação (o commit fica a cargo de quem chamou).
+
+    :param session: Sessão do banco de dados.
+    :param month: Mês em carga (ex.: '2025-03').
+    :param file_name: Nome da partição (ex.: 'Estabelecimentos7').
+    :param rows_committed: Quantidade de registros do arquivo já gravados (offset para retomar a leitura).
+    :param batches_committed: Quantidade de lotes já gravados.
+    :param completed: Indica que o arquivo foi carregado por completo.
+    """
+    session.execute(checkpoint_statement(month, file_name, rows_committed, batches_committed, completed))
+
+
+def data_version_statement():
+    """
+    SELECT do último mês com partições carregadas e do horário da última partição concluída.
+    Muda sempre que uma nova carga termina (usado para invalidar caches de consulta).
+    """
+    return select(func.max(IngestionCheckpoint.month), func.max(IngestionCheckpoint.updated_at)).where(
+        IngestionCheckpoint.completed.is_(True)
+    )
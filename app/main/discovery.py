@@ -0,0 +1,123 @@
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from downloader import REQUEST_TIMEOUT, fetch_remote_info
+
+BASE_URL = 'https://arquivos.receitafederal.gov.br/dados/cnpj/dados_abertos_cnpj'
+HEAD_WORKERS = 8  # Consultas HEAD simultâneas ao montar o manifesto
+# Horas em que o manifesto salvo é reutilizado antes de consultar o servidor de novo (0 = sempre consulta)
+MANIFEST_MAX_AGE_HOURS = float(os.getenv('MANIFEST_MAX_AGE_HOURS', '24'))
+
+# Arquivos esperados quando a listagem do diretório não estiver disponível
+SINGLE_FILES = ['Cnaes', 'Naturezas', 'Qualificacoes', 'Municipios', 'Paises', 'Motivos', 'Simples']
+PARTITIONED_FILES = ['Empresas', 'Estabelecimentos', 'Socios']
+MAX_PARTITIONS = 10
+
+ZIP_LINK_PATTERN = re.compile(r'href="(?P<file_name>[^"/?]+\.zip)"', re.IGNORECASE)
+
+
+def month_url(year, month):
+    """URL do diretório do mês (ex.: .../dados_abertos_cnpj/2025-03/), com o mês sempre com dois dígitos."""
+    return f'{BASE_URL}/{int(year)}-{int(month):02d}/'
+
+
+def partition_number(name):
+    """Número da partição no fim do nome ('Empresas7' -> 7); arquivos sem número ficam em -1."""
+    match = re.search(r'(\d+)$', name)
+    return int(match.group(1)) if match else -1
+
+
+def list_remote_files(year, month):
+    """
+    Lê a listagem do diretório do mês uma única vez e devolve os nomes dos ZIPs (sem a extensão).
+
+    :return: Lista de nomes (ex.: ['Cnaes', 'Empresas0', ...]) ou None se a listagem não estiver disponível.
+    """
+    try:
+        response = requests.get(month_url(year, month), timeout=REQUEST_TIMEOUT)
+        if response.status_code == 404:
+            raise FileNotFoundError(month_url(year, month))
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Não foi possível ler a listagem de {month_url(year, month)}: {e}")
+        return None
+
+    names = {match.group('file_name')[:-len('.zip')] for match in ZIP_LINK_PATTERN.finditer(response.text)}
+    return sorted(names)
+
+
+def _head_entry(year, month, name):
+    url = f'{month_url(year, month)}{name}.zip'
+    try:
+        info = fetch_remote_info(url)
+    except FileNotFoundError:
+        return None
+    return {
+        'name': name,
+        'url': url,
+        'size': info['size'],
+        'etag': info['etag'],
+        'last_modified': info['last_modified'],
+    }
+
+
+def expected_remote_files():
+    """Nomes esperados pelo layout da Receita, consultados por HEAD quando não há listagem do diretório."""
+    candidates = list(SINGLE_FILES)
+    for file_name in PARTITIONED_FILES:
+        candidates.extend(f'{file_name}{counter}' for counter in range(MAX_PARTITIONS))
+    return candidates
+
+
+def fetch_manifest(year, month, cache_dir=None, refresh=False):
+    """
+    Monta o manifesto do mês: nome, URL, tamanho, ETag e data de modificação de cada ZIP publicado.
+
+    A listagem do diretório é lida uma única vez e cada ZIP é consultado por HEAD em paralelo.
+    O resultado fica salvo em 'manifest_{ano}-{mês}.json' dentro de cache_dir e é reutilizado
+    nas próximas execuções por até MANIFEST_MAX_AGE_HOURS horas, a menos que refresh=True.
+
+    :param year: Ano dos arquivos.
+    :param month: Mês dos arquivos.
+    :param cache_dir: Pasta onde o manifesto é salvo (opcional).
+    :param refresh: Ignora o manifesto salvo e consulta o servidor novamente.
+    :return: Dicionário nome -> informações do arquivo.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f'manifest_{int(year)}-{int(month):02d}.json')
+        max_age = MANIFEST_MAX_AGE_HOURS * 3600
+        if not refresh and os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < max_age:
+            with open(cache_path) as fd:
+                return json.load(fd)
+
+    names = list_remote_files(year, month)
+    if names is None:
+        names = expected_remote_files()
+
+    with ThreadPoolExecutor(max_workers=HEAD_WORKERS) as executor:
+        entries = executor.map(lambda name: _head_entry(year, month, name), names)
+        manifest = {entry['name']: entry for entry in entries if entry is not None}
+
+    print(f"Manifesto de {int(month):02d}/{year}: {len(manifest)} arquivos, "
+          f"{sum(entry['size'] or 0 for entry in manifest.values()) / 1024 ** 3:.1f} GB")
+
+    if cache_path is not None and manifest:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'w') as fd:
+            json.dump(manifest, fd, indent=2)
+    return manifest
+
+
+def partitions_for(manifest, file_name):
+    """
+    Partições de um arquivo presentes no manifesto, em ordem (ex.: 'Empresas' -> ['Empresas0', ..., 'Empresas9']).
+
+    :param manifest: Manifesto retornado por fetch_manifest.
+    :param file_name: Nome do arquivo (ex.: 'Empresas', 'Cnaes').
+    """
+    pattern = re.compile(rf'^{re.escape(file_name)}\d*$')
+    return sorted((name for name in manifest if pattern.match(name)), key=partition_number)
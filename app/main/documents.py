@@ -0,0 +1,141 @@
+import re
+import numpy as np
+import pandas as pd
+
+# CNPJs tratados por coluna inteira: a coluna vira um array de textos de tamanho fixo do NumPy, completado
+# e unido com as funções de np.char, e lido como uma matriz (registros x caracteres), na qual o formato e os
+# dígitos verificadores (módulo 11) são conferidos com operações vetorizadas, sem laços por registro.
+# Os CPFs dos arquivos da Receita são mascarados ('***123456**'), então não há DVs de CPF a conferir.
+
+# CNPJ: 12 caracteres (8 do CNPJ básico + 4 da ordem) e 2 dígitos verificadores. Desde julho de 2026 a
+# Receita emite CNPJs alfanuméricos (letras maiúsculas nos 12 primeiros caracteres); os DVs continuam numéricos.
+CNPJ_LENGTH = 14
+
+# Pesos do módulo 11: o primeiro DV usa os pesos a partir do segundo; o segundo DV usa todos
+CNPJ_WEIGHTS = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+
+# Os dois DVs como texto, pelo número de 0 a 99 (evita formatar registro a registro)
+CHECK_DIGITS_TEXT = np.array([f'{number:02d}' for number in range(100)], dtype=object)
+
+
+def text_of(values):
+    """Valores da coluna como array de textos de tamanho fixo do NumPy (dtype 'U'); nulos viram texto vazio."""
+    return values.fillna('').to_numpy().astype(str)
+
+
+def padded_text(values, width):
+    """
+    Textos da coluna com zeros à esquerda até 'width' caracteres (np.char.zfill da coluna inteira).
+
+    :return: (array de textos, máscara dos valores não vazios)
+    """
+    text = text_of(values)
+    return np.char.zfill(text, width), np.char.str_len(text) > 0
+
+
+def zero_pad(values, width):
+    """Texto com zeros à esquerda até 'width' caracteres ('1' -> '0001'); vazios e nulos viram nulo."""
+    text, present = padded_text(values, width)
+    return pd.Series(text.astype(object), index=values.index).where(present)
+
+
+def char_matrix(text, width):
+    """
+    Matriz (registros x width) com o código Unicode de cada caractere, lida sem cópia do array de textos
+    de tamanho fixo (cada caractere de um array 'U' ocupa 4 bytes).
+
+    :param text: Array de textos (ver text_of), todos com 'width' caracteres.
+    """
+    return text.astype(f'U{width}').view(np.uint32).reshape(-1, width)
+
+
+def mod11(totals):
+    """Dígito do módulo 11: resto menor que 2 vira 0, senão 11 - resto."""
+    remainders = totals % 11
+    return np.where(remainders < 2, 0, 11 - remainders)
+
+
+def check_digits_of(chars, weights):
+    """
+    Os dois dígitos verificadores de cada linha da matriz, como um número de 0 a 99, calculados para
+    todas as linhas com produtos de matrizes. O valor de cada caractere é o código ASCII menos 48
+    ('0'-'9' -> 0-9, 'A'-'Z' -> 17-42), como na regra do CNPJ alfanumérico.
+
+    :param chars: Matriz de caracteres com a parte sem DVs (len(weights) - 1 colunas).
+    :param weights: Pesos do segundo DV (CNPJ_WEIGHTS).
+    """
+    # Em ponto flutuante o produto usa o BLAS; as somas são inteiros pequenos, sem perda de precisão
+    numbers = chars.astype(np.float64) - 48
+    first = mod11((numbers @ weights[1:]).astype(np.int64))
+    second = mod11((numbers @ weights[:-1]).astype(np.int64) + first * weights[-1])
+    return first * 10 + second
+
+
+def check_cnpjs(values):
+    """
+    Confere o formato (12 dígitos ou letras maiúsculas e 2 dígitos) e os dígitos verificadores de uma
+    coluna de CNPJs.
+
+    :param values: Series com os CNPJs sem pontuação.
+    :return: (máscara dos valores no formato, máscara dos valores com os DVs corretos), arrays do NumPy.
+    """
+    text = text_of(values)
+    well_formed = np.char.str_len(text) == CNPJ_LENGTH
+    valid = well_formed.copy()
+    if well_formed.any():
+        chars = char_matrix(text[well_formed], CNPJ_LENGTH)
+        # Sem sinal, a subtração dá a volta abaixo de zero: uma comparação confere o intervalo inteiro
+        digits = (chars - np.uint32(ord('0'))) < 10
+        allowed = digits | ((chars - np.uint32(ord('A'))) < 26)
+        formatted = allowed[:, :-2].all(axis=1) & digits[:, -2:].all(axis=1)
+        expected = check_digits_of(chars[:, :-2], CNPJ_WEIGHTS)
+        informed = (chars[:, -2].astype(np.int64) - 48) * 10 + chars[:, -1] - 48
+        well_formed[well_formed] = formatted
+        valid[valid] = formatted & (expected == informed)
+    return well_formed, valid
+
+
+def cnpj_check_digits(roots):
+    """DVs dos CNPJs ('00' a '99') a partir dos 12 primeiros caracteres (CNPJ básico + ordem)."""
+    if roots.empty:
+        return pd.Series([], index=roots.index, dtype=object)
+    digits = check_digits_of(char_matrix(text_of(roots), CNPJ_LENGTH - 2), CNPJ_WEIGHTS)
+    return pd.Series(CHECK_DIGITS_TEXT[digits], index=roots.index, dtype=object)
+
+
+def valid_cnpj(values):
+    """Máscara dos CNPJs válidos (14 caracteres sem pontuação e DVs corretos)."""
+    return pd.Series(check_cnpjs(values)[1], index=values.index)
+
+
+def compose_cnpj(base, order, check):
+    """
+    CNPJ de 14 caracteres a partir das colunas do arquivo de estabelecimentos, com cada parte completada
+    com zeros à esquerda (8 + 4 + 2). Registros com alguma parte vazia ficam nulos.
+
+    :param base: Coluna CNPJ BASICO.
+    :param order: Coluna CNPJ ORDEM.
+    :param check: Coluna CNPJ DV.
+    """
+    (bases, has_base), (orders, has_order), (checks, has_check) = (
+        padded_text(base, 8), padded_text(order, 4), padded_text(check, 2)
+    )
+    cnpjs = np.char.add(np.char.add(bases, orders), checks)
+    return pd.Series(cnpjs.astype(object), index=base.index).where(has_base & has_order & has_check)
+
+
+def cnpj_errors(values):
+    """
+    Motivo de recusa de cada CNPJ (nulo nos válidos e nos vazios, que são recusados como chave vazia).
+    Usada em rejects.invalid_rows antes do COPY.
+    """
+    well_formed, valid = check_cnpjs(values)
+    reasons = np.full(len(values), None, dtype=object)
+    reasons[values.notna().to_numpy() & ~well_formed] = 'cnpj fora do formato (14 caracteres)'
+    reasons[well_formed & ~valid] = 'cnpj com dígitos verificadores inválidos'
+    return pd.Series(reasons, index=values.index)
+
+
+def clean_cnpj(value):
+    """CNPJ informado com ou sem pontuação ('11.222.333/0001-81') no formato de 14 caracteres da tabela."""
+    return re.sub(r'[^0-9A-Z]', '', value.upper())
@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from metrics import metrics
+
+DOWNLOAD_PARTS = int(os.getenv('DOWNLOAD_PARTS', '4'))  # Quantidade de partes baixadas em paralelo
+BUFFER_SIZE = 1024 * 1024  # Tamanho de cada escrita em disco (1 MB)
+STATE_SAVE_INTERVAL = 32 * BUFFER_SIZE  # Grava o progresso a cada 32 MB baixados por parte
+REQUEST_TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    """Erro no download que não deve ser tentado novamente com os mesmos dados (ex.: arquivo mudou no servidor)."""
+
+
+def fetch_remote_info(url, session=None):
+    """
+    Consulta (HEAD) tamanho, ETag, data de modificação e suporte a Range do arquivo remoto.
+
+    :param url: URL do arquivo.
+    :param session: Sessão do requests (opcional).
+    :raises FileNotFoundError: Se o servidor responder 404.
+    """
+    http = session or requests
+    response = http.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 404:
+        raise FileNotFoundError(url)
+    response.raise_for_status()
+
+    size = response.headers.get('Content-Length')
+    return {
+        'size': int(size) if size is not None else None,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'accept_ranges': response.headers.get('Accept-Ranges', '').lower() == 'bytes',
+    }
+
+
+def split_ranges(size, parts):
+    """Divide o arquivo em 'parts' intervalos de bytes [start, end] (end inclusivo)."""
+    parts = max(1, min(parts, size))
+    part_size = -(-size // parts)  # divisão com arredondamento para cima
+    return [
+        {'start': start, 'end': min(start + part_size, size) - 1, 'offset': start}
+        for start in range(0, size, part_size)
+    ]
+
+
+class DownloadState:
+    """
+    Progresso de um download em partes, persistido em '<destino>.part.json' ao lado do '<destino>.part'.
+    Cada intervalo guarda o próximo byte a ser baixado ('offset'), o que permite retomar o download.
+    """
+
+    def __init__(self, dest, url, size, etag, ranges):
+        self.path = f'{dest}.part.json'
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.ranges = ranges
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, dest, url, size, etag):
+        """Carrega o progresso salvo, descartando-o se o arquivo remoto mudou."""
+        path = f'{dest}.part.json'
+        if not os.path.exists(path) or not os.path.exists(f'{dest}.part'):
+            return None
+        try:
+            with open(path) as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        if data.get('url') != url or data.get('size') != size or data.get('etag') != etag:
+            print(f"Arquivo remoto mudou desde o último download de {dest}, recomeçando do zero.")
+            return None
+        return cls(dest, url, size, etag, data['ranges'])
+
+    @property
+    def downloaded(self):
+        return sum(rng['offset'] - rng['start'] for rng in self.ranges)
+
+    def save(self):
+        with self.lock:
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w') as fd:
+                json.dump({'url': self.url, 'size': self.size, 'etag': self.etag, 'ranges': self.ranges}, fd)
+            os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _download_range(url, part_path, state, rng, max_retries, backoff_factor):
+    """Baixa um intervalo de bytes com Range, retomando a partir do último offset gravado."""
+    attempt = 0
+    while rng['offset'] <= rng['end']:
+        try:
+            headers = {'Range': f"bytes={rng['offset']}-{rng['end']}"}
+            if state.etag:
+                # Se o arquivo mudar no servidor, o If-Range faz ele responder 200 com o arquivo inteiro
+                headers['If-Range'] = state.etag
+            with requests.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise DownloadError(f"O servidor não respeitou o Range de {url} (status {response.status_code})")
+
+                unsaved = 0
+                with open(part_path, 'r+b', buffering=BUFFER_SIZE) as fd:
+                    fd.seek(rng['offset'])
+                    for chunk in response.iter_content(chunk_size=BUFFER_SIZE):
+                        fd.write(chunk)
+                        rng['offset'] += len(chunk)
+                        unsaved += len(chunk)
+                        if unsaved >= STATE_SAVE_INTERVAL:
+                            fd.flush()
+                            state.save()
+                            unsaved = 0
+                state.save()
+
+        except requests.exceptions.RequestException as e:
+            attempt += 1
+            state.save()
+            if attempt >= max_retries:
+                print(f"Número máximo de tentativas atingido no intervalo {rng['start']}-{rng['end']} de {url}.")
+                raise
+            wait_time = backoff_factor * attempt
+            metrics.increment('download_retries')
+            print(f"Erro ao baixar intervalo {rng['offset']}-{rng['end']}: {e}. Tentando novamente em {wait_time} segundos...")
+            time.sleep(wait_time)
+
+
+def _download_stream(url, dest, max_retries, backoff_factor):
+    """Download em uma única conexão, para servidores sem suporte a Range (sem retomada)."""
+    part_path = f'{dest}.part'
+    attempt = 0
+    while True:
+        try:
+            with requests.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                if response.status_code == 404:
+                    raise FileNotFoundError(url)
+                response.raise_for_status()
+                with open(part_path, 'wb', buffering=BUFFER_SIZE) as fd:
+                    for chunk in response.iter_content(chunk_size=BUFFER_SIZE):
+                        fd.write(chunk)
+            return
+        except requests.exceptions.RequestException as e:
+            attempt += 1
+            if attempt >= max_retries:
+                print("Número máximo de tentativas atingido. Falha no download.")
+                raise
+            wait_time = backoff_factor * attempt
+            metrics.increment('download_retries')
+            print(f"Erro ao baixar o arquivo: {e}. Tentando novamente em {wait_time} segundos...")
+            time.sleep(wait_time)
+
+
+def download_file(url, dest, parts=DOWNLOAD_PARTS, max_retries=10, backoff_factor=2, expected_size=None, expected_etag=None):
+    """
+    Baixa um arquivo em partes paralelas (HTTP Range) com escrita em blocos grandes.
+
+    O download é feito em '<destino>.part' e o progresso de cada parte fica em '<destino>.part.json',
+    então uma nova chamada retoma de onde parou. Ao final o tamanho e o ETag são conferidos
+    e o arquivo é renomeado para o destino.
+
+    :param url: URL do arquivo.
+    :param dest: Caminho final do arquivo.
+    :param parts: Quantidade de partes baixadas em paralelo.
+    :param max_retries: Tentativas por parte antes de desistir.
+    :param backoff_factor: Fator de espera entre as tentativas (em segundos).
+    :param expected_size: Tamanho esperado (ex.: vindo do manifesto), conferido com o servidor.
+    :param expected_etag: ETag esperado (ex.: vindo do manifesto), conferido com o servidor.
+    :raises FileNotFoundError: Se o arquivo não existir no servidor (404).
+    :raises DownloadError: Se o arquivo baixado não conferir com o servidor.
+    """
+    part_path = f'{dest}.part'
+    info = fetch_remote_info(url)
+    size, etag = info['size'], info['etag']
+
+    if expected_size is not None and size is not None and expected_size != size:
+        raise DownloadError(f"Tamanho de {url} no servidor ({size}) difere do esperado ({expected_size})")
+    if expected_etag and etag and expected_etag != etag:
+        raise DownloadError(f"ETag de {url} no servidor ({etag}) difere do esperado ({expected_etag})")
+
+    start = time.perf_counter()
+    resumed_bytes = 0  # Já baixados em uma execução anterior (não entram na taxa de download)
+    if not info['accept_ranges'] or not size:
+        print(f"Servidor sem suporte a Range para {url}, baixando em uma única conexão.")
+        _download_stream(url, dest, max_retries, backoff_factor)
+    else:
+        state = DownloadState.load(dest, url, size, etag)
+        if state is None:
+            state = DownloadState(dest, url, size, etag, split_ranges(size, parts))
+            with open(part_path, 'wb') as fd:
+                fd.truncate(size)
+            state.save()
+        elif state.downloaded:
+            resumed_bytes = state.downloaded
+            print(f"Retomando download de {url} a partir de {state.downloaded} de {size} bytes.")
+
+        pending = [rng for rng in state.ranges if rng['offset'] <= rng['end']]
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+                futures = [
+                    executor.submit(_download_range, url, part_path, state, rng, max_retries, backoff_factor)
+                    for rng in pending
+                ]
+                for future in futures:
+                    future.result()
+        except DownloadError:
+            # O servidor ignorou o Range ou o arquivo mudou (If-Range): o que já foi baixado não serve mais
+            state.remove()
+            os.remove(part_path)
+            raise
+
+        # Confere se o arquivo não mudou no servidor durante o download
+        final_etag = fetch_remote_info(url)['etag']
+        if etag and final_etag != etag:
+            state.remove()
+            os.remove(part_path)
+            raise DownloadError(f"O arquivo {url} mudou no servidor durante o download (ETag {etag} -> {final_etag})")
+        state.remove()
+
+    downloaded_size = os.path.getsize(part_path)
+    if size is not None and downloaded_size != size:
+        os.remove(part_path)
+        raise DownloadError(f"Tamanho do arquivo baixado ({downloaded_size}) difere do servidor ({size})")
+
+    os.replace(part_path, dest)
+    elapsed = time.perf_counter() - start
+    metrics.add('download', elapsed, nbytes=downloaded_size - resumed_bytes)
+    print(f"Download concluído com sucesso: {dest} ({downloaded_size / 1024 / 1024:.1f} MB em {elapsed:.1f}s)")
+    return dest
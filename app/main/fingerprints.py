@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import pandas as pd
+
+KEY_SEPARATOR = '\x1f'  # Separador das chaves compostas (ex.: sócios)
+IGNORED_COLUMNS = ['created_at', 'updated_at']  # Não fazem parte do conteúdo do registro
+
+
+class FingerprintIndex:
+    """
+    Índice local (SQLite) com a impressão digital (hash das colunas normalizadas) de cada registro
+    já gravado no banco, por chave primária. Usado na carga incremental para enviar ao banco
+    apenas registros novos ou alterados e, ao fim do mês, remover os que deixaram de ser publicados.
+
+    Um lote é gravado no índice antes do commit no banco (record) e fica pendente até o commit ser
+    confirmado (confirm): se o processo cair entre os dois, as chaves pendentes contam como alteradas
+    na próxima carga e o lote é enviado de novo.
+    """
+
+    def __init__(self, path, month, key_columns):
+        """
+        :param path: Caminho do arquivo SQLite do índice (um por tabela).
+        :param month: Mês em carga (ex.: '2025-03'), usado para descobrir os registros removidos.
+        :param key_columns: Colunas da chave primária da tabela.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.month = month
+        self.key_columns = list(key_columns)
+        self.connection = sqlite3.connect(path, timeout=120)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints '
+            '(key TEXT PRIMARY KEY, fingerprint INTEGER NOT NULL, month TEXT NOT NULL) WITHOUT ROWID'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS fingerprints_month ON fingerprints (month)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pending (key TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.connection.execute('CREATE TEMP TABLE batch (key TEXT PRIMARY KEY, fingerprint INTEGER NOT NULL)')
+        self.connection.execute('CREATE TEMP TABLE recorded (key TEXT PRIMARY KEY)')
+        self.connection.commit()
+
+    def keys_of(self, frame):
+        """Chave de cada registro como texto (colunas da chave composta unidas por KEY_SEPARATOR)."""
+        keys = frame[self.key_columns[0]].astype(str)
+        for column in self.key_columns[1:]:
+            keys = keys + KEY_SEPARATOR + frame[column].astype(str)
+        return keys
+
+    def fingerprints_of(self, frame):
+        """Hash de 64 bits das colunas normalizadas de cada registro (calculado de forma vetorizada)."""
+        columns = [column for column in frame.columns if column not in IGNORED_COLUMNS]
+        hashes = pd.util.hash_pandas_object(frame[columns], index=False)
+        return hashes.to_numpy().view('int64')
+
+    def diff(self, frame):
+        """
+        Compara o lote com o índice e devolve a máscara dos registros novos ou alterados.
+        Chaves gravadas por um lote cujo commit no banco não foi confirmado contam sempre como alteradas.
+        O lote comparado fica guardado até record() ser chamado (na transação do lote, antes do commit no banco).
+
+        :param frame: DataFrame com as colunas da tabela de destino.
+        """
+        keys = self.keys_of(frame)
+        self.connection.execute('DELETE FROM batch')
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO batch VALUES (?, ?)',
+            zip(keys.tolist(), self.fingerprints_of(frame).tolist())
+        )
+        changed = {
+            row[0] for row in self.connection.execute(
+                'SELECT b.key FROM batch b LEFT JOIN fingerprints f ON f.key = b.key '
+                'WHERE f.fingerprint IS NULL OR f.fingerprint != b.fingerprint '
+                'OR EXISTS (SELECT 1 FROM pending p WHERE p.key = b.key)'
+            )
+        }
+        return keys.isin(changed).to_numpy()
+
+    def record(self):
+        """
+        Grava no índice o último lote comparado, marcando todas as suas chaves como vistas no mês.
+        As chaves ficam pendentes até confirm() ser chamado depois do commit do lote no banco.
+        """
+        self.connection.execute(
+            'INSERT INTO fingerprints (key, fingerprint, month) SELECT key, fingerprint, ? FROM batch WHERE true '
+            'ON CONFLICT (key) DO UPDATE SET fingerprint = excluded.fingerprint, month = excluded.month',
+            (self.month,)
+        )
+        self.connection.execute('INSERT OR IGNORE INTO pending SELECT key FROM batch')
+        self.connection.execute('DELETE FROM recorded')
+        self.connection.execute('INSERT INTO recorded SELECT key FROM batch')
+        self.connection.execute('DELETE FROM batch')
+        self.connection.commit()
+
+    def confirm(self):
+        """Confirma o último lote gravado por record(), depois que o commit dele no banco foi feito."""
+        self.connection.execute('DELETE FROM pending WHERE key IN (SELECT key FROM recorded)')
+        self.connection.execute('DELETE FROM recorded')
+        self.connection.commit()
+
+    def exclude(self, frame):
+        """Retira do lote pendente os registros recusados pelo banco, para que sejam enviados de novo na próxima carga."""
+        self.connection.executemany(
+            'DELETE FROM batch WHERE key = ?', ((key,) for key in self.keys_of(frame).tolist())
+        )
+
+    def stale_batches(self, batch_size=100000):
+        """
+        Registros que não apareceram no mês atual (removidos pela Receita), em lotes de DataFrames
+        com as colunas da chave primária. Só deve ser usado depois que todas as partições do mês foram carregadas.
+        """
+        last_key = ''
+        while True:
+            rows = self.connection.execute(
+                'SELECT key FROM fingerprints WHERE month != ? AND key > ? ORDER BY key LIMIT ?',
+                (self.month, last_key, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            last_key = rows[-1][0]
+            keys = pd.Series([row[0] for row in rows], dtype=object)
+            yield keys.str.split(KEY_SEPARATOR, expand=True, regex=False).set_axis(self.key_columns, axis=1)
+
+    def forget(self, frame):
+        """Remove do índice as chaves do DataFrame (registros apagados do banco)."""
+        self.connection.executemany(
+            'DELETE FROM fingerprints WHERE key = ?', ((key,) for key in self.keys_of(frame).tolist())
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
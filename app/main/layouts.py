@@ -0,0 +1,145 @@
+from schemas import Company, Establishment, EstablishmentSecondaryCnae, Simples, Partner, LegalNature, City, Country, Cnae, PartnerQualification, SituationMotive
+
+# Cabeçalhos e mapeamento de colunas de cada arquivo da Receita (CONFORME O LAYOUT DA RECEITA).
+# 'columns' relaciona a coluna da tabela no banco com o cabeçalho do CSV de origem.
+LOOKUP_HEADER = ['CODIGO', 'DESCRICAO']
+LOOKUP_COLUMNS = {
+    'code': 'CODIGO',
+    'description': 'DESCRICAO',
+}
+
+LAYOUTS = {
+    'Empresas': {
+        'model': Company,
+        'header': [
+            'CNPJ BASICO', 'RAZAO SOCIAL/NOME EMPRESARIAL', 'NATUREZA JURIDICA',
+            'QUALIFICACAO DO RESPONSAVEL', 'CAPITAL SOCIAL DA EMPRESA', 'PORTE DA EMPRESA',
+            'ENTE FEDERATIVO RESPONSÁVEL'
+        ],
+        'columns': {
+            'base_cnpj': 'CNPJ BASICO',
+            'social_reason_business_name': 'RAZAO SOCIAL/NOME EMPRESARIAL',
+            'legal_nature': 'NATUREZA JURIDICA',
+            'responsible_qualification': 'QUALIFICACAO DO RESPONSAVEL',
+            'social_capital_company': 'CAPITAL SOCIAL DA EMPRESA',
+            'company_size': 'PORTE DA EMPRESA',
+            'responsible_federative_entity': 'ENTE FEDERATIVO RESPONSÁVEL',
+        },
+        # Colunas normalizadas para a busca por nome (coluna de busca -> coluna de origem, ver normalizer.normalize_search_text)
+        'search': {'search_name': 'social_reason_business_name'},
+    },
+    'Estabelecimentos': {
+        'model': Establishment,
+        'header': [
+            'CNPJ BASICO', 'CNPJ ORDEM', 'CNPJ DV', 'IDENTIFICADOR MATRIZ/FILIAL', 'NOME FANTASIA', 'SITUACAO CADASTRAL',
+            'DATA SITUACAO CADASTRAL', 'MOTIVO SITUACAO CADASTRAL', 'NOME DA CIDADE NO EXTERIOR', 'PAIS', 'DATA DE INICIO DE ATIVIDADE',
+            'CNAE FISCAL PRINCIPAL', 'CNAE FISCAL SECUNDARIA', 'TIPO DE LOGRADOURO', 'LOGRADOURO', 'NUMERO', 'COMPLEMENTO', 'BAIRRO',
+            'CEP', 'UF', 'MUNICIPIO', 'DDD 1', 'TELEFONE 1', 'DDD 2', 'TELEFONE 2', 'DDD DO FAX', 'FAX', 'CORREIO ELETRONICO',
+            'SITUACAO ESPECIAL', 'DATA DA SITUACAO ESPECIAL'
+        ],
+        'columns': {
+            'base_cnpj': 'CNPJ BASICO',
+            'cnpj_dv': 'CNPJ DV',
+            'cnpj_order': 'CNPJ ORDEM',
+            'fantasy_name': 'NOME FANTASIA',
+            'identifier_branch_matriz': 'IDENTIFICADOR MATRIZ/FILIAL',
+            'cadastral_situation': 'SITUACAO CADASTRAL',
+            'cadastral_situation_reason': 'MOTIVO SITUACAO CADASTRAL',
+            'city_name_exterior': 'NOME DA CIDADE NO EXTERIOR',
+            'country': 'PAIS',
+            'activity_start_date': 'DATA DE INICIO DE ATIVIDADE',
+            'special_situation_date': 'DATA DA SITUACAO ESPECIAL',
+            'cnae_main': 'CNAE FISCAL PRINCIPAL',
+            'cnae_secondary': 'CNAE FISCAL SECUNDARIA',
+            'street_type': 'TIPO DE LOGRADOURO',
+            'street': 'LOGRADOURO',
+            'number': 'NUMERO',
+            'complement': 'COMPLEMENTO',
+            'neighborhood': 'BAIRRO',
+            'cep': 'CEP',
+            'city': 'MUNICIPIO',
+            'ddd_1': 'DDD 1',
+            'phone_1': 'TELEFONE 1',
+            'ddd_2': 'DDD 2',
+            'phone_2': 'TELEFONE 2',
+            'fax_ddd': 'DDD DO FAX',
+            'fax': 'FAX',
+            'electronic_mail': 'CORREIO ELETRONICO',
+            'special_situation': 'SITUACAO ESPECIAL',
+            'uf': 'UF',
+        },
+        # Tabelas derivadas do mesmo arquivo, gravadas na mesma transação de cada lote (ver normalizer.to_child_frames)
+        'children': [EstablishmentSecondaryCnae],
+        'search': {'search_name': 'fantasy_name'},
+    },
+    'Socios': {
+        'model': Partner,
+        'header': [
+            'CNPJ BASICO', 'IDENTIFICADOR DE SOCIO', 'NOME DO SOCIO/RAZAO SOCIAL', 'CNPJ/CPF DO SOCIO', 'QUALIFICACAO DO SOCIO',
+            'DATA DE ENTRADA SOCIEDADE', 'PAIS', 'REPRESENTANTE LEGAL', 'NOME DO REPRESENTANTE', 'QUALIFICACAO DO REPRESENTANTE LEGAL',
+            'FAIXA ETARIA'
+        ],
+        'columns': {
+            'base_cnpj': 'CNPJ BASICO',
+            'partner_identifier': 'IDENTIFICADOR DE SOCIO',
+            'partner_name_social_reason': 'NOME DO SOCIO/RAZAO SOCIAL',
+            'partner_cpf_cnpj': 'CNPJ/CPF DO SOCIO',
+            'partner_qualification': 'QUALIFICACAO DO SOCIO',
+            'date_entry_society': 'DATA DE ENTRADA SOCIEDADE',
+            'country': 'PAIS',
+            'cpf_legal_representative': 'REPRESENTANTE LEGAL',
+            'representative_name': 'NOME DO REPRESENTANTE',
+            'legal_representative_qualification': 'QUALIFICACAO DO REPRESENTANTE LEGAL',
+            'age_group': 'FAIXA ETARIA',
+        },
+    },
+    'Simples': {
+        'model': Simples,
+        'header': [
+            'CNPJ BASICO', 'OPCAO PELO SIMPLES', 'DATA DE OPCAO PELO SIMPLES', 'DATA DE EXCLUSAO DO SIMPLES',
+            'OPCAO PELO MEI', 'DATA DE OPCAO PELO MEI', 'DATA DE EXCLUSAO DO MEI'
+        ],
+        'columns': {
+            'base_cnpj': 'CNPJ BASICO',
+            'simples_option': 'OPCAO PELO SIMPLES',
+            'simples_option_date': 'DATA DE OPCAO PELO SIMPLES',
+            'simples_option_exclusion_date': 'DATA DE EXCLUSAO DO SIMPLES',
+            'mei_option': 'OPCAO PELO MEI',
+            'mei_option_date': 'DATA DE OPCAO PELO MEI',
+            'mei_exclusion_date': 'DATA DE EXCLUSAO DO MEI',
+        },
+    },
+    'Cnaes': {'model': Cnae, 'header': LOOKUP_HEADER, 'columns': LOOKUP_COLUMNS},
+    'Naturezas': {'model': LegalNature, 'header': LOOKUP_HEADER, 'columns': LOOKUP_COLUMNS},
+    'Qualificacoes': {'model': PartnerQualification, 'header': LOOKUP_HEADER, 'columns': LOOKUP_COLUMNS},
+    'Municipios': {'model': City, 'header': LOOKUP_HEADER, 'columns': LOOKUP_COLUMNS},
+    'Paises': {'model': Country, 'header': LOOKUP_HEADER, 'columns': LOOKUP_COLUMNS},
+    'Motivos': {'model': SituationMotive, 'header': LOOKUP_HEADER, 'columns': LOOKUP_COLUMNS},
+}
+
+# Nomes alternativos usados para os arquivos de estabelecimentos
+LAYOUT_ALIASES = {
+    'Estabelecimento': 'Estabelecimentos',
+    'ESTABELE': 'Estabelecimentos',
+}
+
+
+def get_layout_name(file_name):
+    """
+    Descobre qual layout da Receita corresponde ao nome do arquivo.
+
+    :param file_name: Nome do arquivo (ex.: 'Empresas', 'Estabelecimentos3', 'Simples').
+    :return: Chave do layout em LAYOUTS ou None se o arquivo não for reconhecido.
+    """
+    if file_name in LAYOUTS:
+        return file_name
+    if file_name in LAYOUT_ALIASES:
+        return LAYOUT_ALIASES[file_name]
+
+    for alias, layout_name in LAYOUT_ALIASES.items():
+        if alias.lower() in file_name.lower():
+            return layout_name
+    for layout_name in LAYOUTS:
+        if layout_name.lower() in file_name.lower():
+            return layout_name
+    return None
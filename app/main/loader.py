@@ -0,0 +1,207 @@
+import io
+import time
+from metrics import metrics
+
+# Marcador de nulo usado no COPY, para que strings vazias continuem sendo strings vazias no banco
+COPY_NULL = '\\N'
+
+# Coluna do staging numerada na ordem do COPY (posição do registro no lote)
+SEQUENCE_COLUMN = 'load_seq'
+
+
+def quote_identifier(name):
+    """Coloca o identificador entre aspas (as tabelas usam nomes com letras maiúsculas)."""
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def build_merge_sql(table, staging_name, columns):
+    """
+    Monta o INSERT ... ON CONFLICT DO UPDATE que move a tabela de staging para a tabela final.
+
+    :param table: Tabela SQLAlchemy de destino.
+    :param staging_name: Nome da tabela temporária de staging.
+    :param columns: Colunas carregadas no staging.
+    """
+    key_columns = [column.name for column in table.primary_key.columns]
+    column_list = ', '.join(quote_identifier(column) for column in columns)
+    key_list = ', '.join(quote_identifier(column) for column in key_columns)
+    update_columns = [column for column in columns if column not in key_columns and column != 'created_at']
+
+    if update_columns:
+        conflict_action = 'DO UPDATE SET ' + ', '.join(
+            f'{quote_identifier(column)} = EXCLUDED.{quote_identifier(column)}' for column in update_columns
+        )
+    else:
+        conflict_action = 'DO NOTHING'
+
+    # DISTINCT ON evita o erro "ON CONFLICT DO UPDATE command cannot affect row a second time"
+    # quando o mesmo registro aparece duas vezes no lote; a ordenação pela posição no lote mantém
+    # a última ocorrência, como fazia o upsert registro a registro
+    return (
+        f'INSERT INTO {quote_identifier(table.name)} ({column_list}) '
+        f'SELECT DISTINCT ON ({key_list}) {column_list} FROM {quote_identifier(staging_name)} '
+        f'ORDER BY {key_list}, {quote_identifier(SEQUENCE_COLUMN)} DESC '
+        f'ON CONFLICT ({key_list}) {conflict_action}'
+    )
+
+
+def build_delete_children_sql(child_table, parent_table, staging_name):
+    """
+    Monta o DELETE dos registros derivados (ex.: CNAEs secundários) das chaves carregadas no staging
+    da tabela principal, para que a lista de cada registro seja substituída pela do lote.
+
+    :param child_table: Tabela SQLAlchemy derivada, com as colunas da chave primária da tabela principal.
+    :param parent_table: Tabela SQLAlchemy principal.
+    :param staging_name: Nome da tabela de staging da tabela principal (ainda na mesma transação).
+    """
+    condition = ' AND '.join(
+        f't.{quote_identifier(column.name)} = s.{quote_identifier(column.name)}'
+        for column in parent_table.primary_key.columns
+    )
+    return f'DELETE FROM {quote_identifier(child_table.name)} t USING {quote_identifier(staging_name)} s WHERE {condition}'
+
+
+def frame_to_csv(frame):
+    """Serializa o DataFrame no CSV lido pelo COPY (sem cabeçalho, nulos como COPY_NULL)."""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, na_rep=COPY_NULL)
+    buffer.seek(0)
+    return buffer
+
+
+def build_staging_sql(table, staging_name):
+    """
+    CREATE TEMP TABLE da tabela de staging, com a mesma estrutura da tabela final, apagada no commit.
+    A coluna SEQUENCE_COLUMN (bigserial) não é enviada no COPY e recebe a posição de cada registro no lote.
+    """
+    return (
+        f'CREATE TEMP TABLE {quote_identifier(staging_name)} '
+        f'(LIKE {quote_identifier(table.name)} INCLUDING DEFAULTS, {quote_identifier(SEQUENCE_COLUMN)} bigserial) '
+        f'ON COMMIT DROP'
+    )
+
+
+def copy_frame_into_table(session, model, frame):
+    """
+    Carrega um DataFrame já normalizado em uma tabela do banco via COPY ... FROM STDIN.
+
+    Os dados são copiados para uma tabela temporária (staging) e depois mesclados na tabela final
+    com um único INSERT ... ON CONFLICT DO UPDATE. O commit fica a cargo de quem chamou.
+
+    :param session: Sessão do banco de dados (PostgreSQL).
+    :param model: Classe mapeada da tabela de destino (Company, Establishment, ...).
+    :param frame: DataFrame cujas colunas têm os mesmos nomes das colunas da tabela.
+    :return: Quantidade de registros enviados.
+    """
+    if frame.empty:
+        return 0
+
+    table = model.__table__
+    staging_name = f'stg_{table.name}'
+    columns = list(frame.columns)
+    column_list = ', '.join(quote_identifier(column) for column in columns)
+
+    buffer = frame_to_csv(frame)
+
+    start = time.perf_counter()
+    dbapi_connection = session.connection().connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {quote_identifier(staging_name)}')
+        cursor.execute(build_staging_sql(table, staging_name))
+        cursor.copy_expert(
+            f"COPY {quote_identifier(staging_name)} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer
+        )
+        cursor.execute(build_merge_sql(table, staging_name, columns))
+
+    metrics.add('load', time.perf_counter() - start, rows=len(frame), nbytes=buffer.tell(), table=table.name)
+    return len(frame)
+
+
+def replace_child_rows(session, child_model, parent_model, frame):
+    """
+    Substitui os registros derivados dos registros que acabaram de ser gravados com copy_frame_into_table
+    na tabela principal (mesma transação): apaga os atuais e grava os do lote. O commit fica a cargo de quem chamou.
+
+    :param session: Sessão do banco de dados (PostgreSQL).
+    :param child_model: Classe mapeada da tabela derivada (ex.: EstablishmentSecondaryCnae).
+    :param parent_model: Classe mapeada da tabela principal (ex.: Establishment).
+    :param frame: DataFrame da tabela derivada com os registros do lote (pode ser vazio).
+    :return: Quantidade de registros enviados.
+    """
+    parent_table = parent_model.__table__
+    dbapi_connection = session.connection().connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.execute(build_delete_children_sql(child_model.__table__, parent_table, f'stg_{parent_table.name}'))
+    return copy_frame_into_table(session, child_model, frame)
+
+
+def append_frame_into_table(session, table_name, frame):
+    """
+    Acrescenta um DataFrame já normalizado a uma tabela via COPY, sem staging nem merge.
+    Usada na carga completa (ver bulkload.py), em que a tabela é nova e ainda não tem índices.
+    O commit fica a cargo de quem chamou.
+
+    :param session: Sessão do banco de dados (PostgreSQL).
+    :param table_name: Nome da tabela de destino.
+    :param frame: DataFrame cujas colunas têm os mesmos nomes das colunas da tabela.
+    :return: Quantidade de registros enviados.
+    """
+    if frame.empty:
+        return 0
+
+    column_list = ', '.join(quote_identifier(column) for column in frame.columns)
+    buffer = frame_to_csv(frame)
+
+    start = time.perf_counter()
+    dbapi_connection = session.connection().connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {quote_identifier(table_name)} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer
+        )
+
+    metrics.add('load', time.perf_counter() - start, rows=len(frame), nbytes=buffer.tell(), table=table_name)
+    return len(frame)
+
+
+def delete_frame_from_table(session, model, frame, key_columns=None):
+    """
+    Apaga da tabela os registros cujas chaves primárias estão no DataFrame (via COPY + DELETE ... USING).
+    O commit fica a cargo de quem chamou.
+
+    :param session: Sessão do banco de dados (PostgreSQL).
+    :param model: Classe mapeada da tabela.
+    :param frame: DataFrame com as colunas da chave primária.
+    :param key_columns: Colunas comparadas no lugar da chave primária (ex.: ['cnpj'] para apagar
+        todos os CNAEs secundários de um estabelecimento), opcional.
+    :return: Quantidade de registros apagados.
+    """
+    if frame.empty:
+        return 0
+
+    table = model.__table__
+    staging_name = f'del_{table.name}'
+    key_columns = key_columns or [column.name for column in table.primary_key.columns]
+    column_list = ', '.join(quote_identifier(column) for column in key_columns)
+    condition = ' AND '.join(
+        f't.{quote_identifier(column)} = s.{quote_identifier(column)}' for column in key_columns
+    )
+
+    buffer = frame_to_csv(frame[key_columns])
+
+    dbapi_connection = session.connection().connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {quote_identifier(staging_name)}')
+        cursor.execute(
+            f'CREATE TEMP TABLE {quote_identifier(staging_name)} ON COMMIT DROP AS '
+            f'SELECT {column_list} FROM {quote_identifier(table.name)} WITH NO DATA'
+        )
+        cursor.copy_expert(
+            f"COPY {quote_identifier(staging_name)} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer
+        )
+        cursor.execute(
+            f'DELETE FROM {quote_identifier(table.name)} t USING {quote_identifier(staging_name)} s WHERE {condition}'
+        )
+        return cursor.rowcount
@@ -0,0 +1,161 @@
+import logging
+import threading
+import pandas as pd
+from sqlalchemy import select
+from bd import session_scope
+from checkpoints import files_version_statement
+from layouts import LAYOUTS
+from metrics import log_event, metrics
+from normalizer import normalize_country
+from schemas import City, Cnae, Country, LegalNature, PartnerQualification, SituationMotive
+
+# Tabelas de domínio (código -> descrição) mantidas em memória
+LOOKUP_MODELS = [LegalNature, PartnerQualification, Country, City, Cnae, SituationMotive]
+
+# Arquivos da Receita com as tabelas de domínio (ex.: 'Cnaes'), cujos checkpoints definem a versão do cache
+LOOKUP_FILES = [file_name for file_name, layout in LAYOUTS.items() if layout['model'] in LOOKUP_MODELS]
+
+# Colunas de cada tabela que guardam códigos de uma tabela de domínio
+LOOKUP_COLUMNS = {
+    'Companies': {
+        'legal_nature': LegalNature,
+        'responsible_qualification': PartnerQualification,
+    },
+    'Establishments': {
+        'cadastral_situation_reason': SituationMotive,
+        'country': Country,
+        'cnae_main': Cnae,
+        'city': City,
+    },
+    'Partners': {
+        'partner_qualification': PartnerQualification,
+        'legal_representative_qualification': PartnerQualification,
+        'country': Country,
+    },
+}
+
+# Os códigos de país dos estabelecimentos são gravados sem zeros à esquerda (ver normalize_country)
+CODE_NORMALIZERS = {
+    'Countries': normalize_country,
+}
+
+
+class LookupCache:
+    """
+    Cópia em memória das tabelas de domínio, carregada uma vez por processo e recarregada só quando
+    a versão muda (na carga, a do mês e das partições de domínio concluídas, ver domain_version). Cada tabela é uma Series indexada pelo código, de modo que validar
+    ou descrever uma coluna inteira é um único map/isin (sem uma consulta por registro).
+
+    Exemplo:
+        lookups.refresh(domain_version('2025-03'))
+        descriptions = lookups.describe('Establishments', frame)  # colunas cnae_main_description, ...
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.tables = {}  # nome da tabela -> Series (código -> descrição)
+        self.descriptions = {}  # nome da tabela -> dict (código -> descrição), para consultas de um código
+
+    def refresh(self, version):
+        """
+        Carrega as tabelas de domínio, se ainda não foram carregadas nesta versão.
+
+        :param version: Versão dos dados (ex.: domain_version('2025-03')); outra versão faz as tabelas serem lidas de novo.
+        """
+        with self.lock:
+            if version == self.version:
+                return
+            tables = {}
+            with session_scope() as session:
+                for model in LOOKUP_MODELS:
+                    rows = session.execute(select(model.code, model.description)).all()
+                    codes = pd.Series([row[0] for row in rows], dtype=object)
+                    normalizer = CODE_NORMALIZERS.get(model.__tablename__)
+                    if normalizer is not None:
+                        codes = normalizer(codes)
+                    table = pd.Series([row[1] for row in rows], index=pd.Index(codes), dtype=object)
+                    # Códigos que ficam iguais depois de normalizados (ex.: '013' e '13'): vale o primeiro
+                    tables[model.__tablename__] = table[~table.index.duplicated()]
+            self.tables = tables
+            self.descriptions = {name: table.to_dict() for name, table in tables.items()}
+            self.version = version
+        print(f"Tabelas de domínio carregadas ({version}): " +
+              ', '.join(f'{name} ({len(table)})' for name, table in tables.items()))
+
+    def invalidate(self):
+        """Descarta as tabelas; a próxima chamada de refresh lê o banco de novo (ex.: após recarregar os domínios)."""
+        with self.lock:
+            self.version = None
+            self.tables = {}
+            self.descriptions = {}
+
+    def table(self, model):
+        """Series código -> descrição da tabela de domínio (vazia se ainda não carregada)."""
+        table = self.tables.get(model.__tablename__)
+        return table if table is not None else pd.Series(dtype=object)
+
+    def description(self, model, code):
+        """Descrição de um código (None se não existir)."""
+        return self.descriptions.get(model.__tablename__, {}).get(code)
+
+    def describe(self, table_name, frame):
+        """
+        Descrição de cada código das colunas de domínio presentes no DataFrame.
+
+        :param table_name: Tabela de origem das colunas (ex.: 'Establishments').
+        :param frame: DataFrame com as colunas da tabela.
+        :return: DataFrame com uma coluna '<coluna>_description' para cada coluna de domínio.
+        """
+        descriptions = {}
+        for column, model in LOOKUP_COLUMNS.get(table_name, {}).items():
+            if column in frame.columns:
+                descriptions[f'{column}_description'] = frame[column].map(self.table(model)).astype(object)
+        return pd.DataFrame(descriptions, index=frame.index)
+
+    def unknown_codes(self, table_name, frame):
+        """
+        Quantidade de códigos que não existem na tabela de domínio, por coluna. Valores vazios e
+        tabelas de domínio ainda não carregadas são ignorados.
+
+        :return: Dicionário coluna -> quantidade (só colunas com códigos desconhecidos).
+        """
+        unknown = {}
+        for column, model in LOOKUP_COLUMNS.get(table_name, {}).items():
+            lookup = self.table(model)
+            if column not in frame.columns or lookup.empty:
+                continue
+            values = frame[column]
+            count = int((values.notna() & (values != '') & ~values.isin(lookup.index)).sum())
+            if count:
+                unknown[column] = count
+        return unknown
+
+
+lookups = LookupCache()
+
+
+def domain_version(month):
+    """
+    Versão das tabelas de domínio na carga do mês: muda sempre que uma partição de domínio termina de ser
+    carregada. Assim, um processo que leu as tabelas no meio da carga dos domínios as lê de novo depois.
+
+    :param month: Mês em carga (ex.: '2025-03').
+    :return: Texto com o mês, a quantidade de partições de domínio concluídas e o horário da última.
+    """
+    with session_scope() as session:
+        count, updated_at = session.execute(files_version_statement(month, LOOKUP_FILES)).one()
+    return f"{month}@{count}@{updated_at.isoformat() if updated_at else ''}"
+
+
+def check_codes(table_name, frame):
+    """
+    Conta os códigos do lote que não existem nas tabelas de domínio (métrica 'unknown_codes').
+    Os registros são gravados mesmo assim; só é feito algo se o cache já foi carregado (refresh).
+    """
+    if lookups.version is None:
+        return
+    unknown = lookups.unknown_codes(table_name, frame)
+    if unknown:
+        metrics.increment('unknown_codes', sum(unknown.values()))
+        log_event('unknown_codes', logging.DEBUG, table=table_name, **unknown)
@@ -1,58 +1,32 @@
-import shutil
-import requests
+import asyncio
+import logging
 from datetime import datetime
 import os
 import pandas as pd
 import time
+from contextlib import nullcontext
 from decimal import Decimal
 from sqlalchemy.orm.exc import NoResultFound
-from psycopg2 import OperationalError
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import select
-from schemas import Company, Establishment, Simples, Partner, LegalNature, City, Country, Cnae, PartnerQualification
-from bd import getSession
-
-def getSessionWithRetry(file_name, corrected_csv_file):
-    retries = 5
-    while retries > 0:
-        try:
-            # Tenta criar a sessão
-              print('tentando se reconectar...')
-              session = getSession()
-              upsertCSVIntoBD(file_name, corrected_csv_file)
-        except OperationalError as e:
-            print(f"Erro na conexão com o banco de dados: {e}")
-            retries -= 1
-            time.sleep(5)  # Espera 5 segundos antes de tentar novamente
-    print("Falha ao conectar após várias tentativas.")
-    return None
-
-def download_with_retries(url, zip_file_path, max_retries=10, backoff_factor=2):
-    attempt = 0
-    while attempt < max_retries:
-        try:
-            print(f"Baixando arquivo (tentativa {attempt + 1}/{max_retries})...")  # Mostra a tentativa
-            r = requests.get(url, stream=True)
-            r.raise_for_status()
-
-            with open(zip_file_path, 'wb') as fd:
-                for chunk in r.iter_content(chunk_size=128):
-                    fd.write(chunk)
-
-            print(f"Download concluído com sucesso: {zip_file_path}")
-            return
-
-        except requests.exceptions.RequestException as e:
-            print(f"Erro ao baixar o arquivo: {e}")
-            attempt += 1
-            if attempt < max_retries:
-                wait_time = backoff_factor * attempt
-                print(f"Tentando novamente em {wait_time} segundos...")
-                time.sleep(wait_time)
-            else:
-                print("Número máximo de tentativas atingido. Falha no download.")
-                raise
-
+from functools import partial
+from async_loader import AsyncMonthLoader
+from bd import DB_CREATE_SCHEMA, create_schema, dispose_inherited_connections, session_scope
+from bulkload import REFRESH_SUFFIX, TableRefresh, swap_tables
+from checkpoints import MAX_LOAD_ATTEMPTS, completed_files, get_checkpoint, save_checkpoint
+from discovery import fetch_manifest, partitions_for
+from downloader import DownloadError, download_file
+from fingerprints import FingerprintIndex
+from layouts import LAYOUTS, get_layout_name
+from loader import append_frame_into_table, copy_frame_into_table, delete_frame_from_table, replace_child_rows
+from lookups import LOOKUP_COLUMNS, LOOKUP_MODELS, check_codes, domain_version, lookups
+from metrics import configure_logging, log_event, metrics, start_metrics_server
+from normalizer import to_child_frames, to_table_frame
+from pipeline import zip_pipeline
+from rejects import load_with_bisect, save_rejects, split_invalid_rows
+from scheduler import run_schedule, topological_order
+from search import refresh_search_indexes
+from snapshot import open_snapshot, read_snapshot
 
 def parse_date(date_str):
         """Função para converter uma string no formato YYYYMMDD em um objeto datetime"""
@@ -61,389 +35,389 @@ def parse_date(date_str):
         except (ValueError, TypeError):
             return None
 
-def upsertCSVIntoBD(file_name, corrected_csv_file):
+def load_frame(session, model, frame, children=None, target_tables=None):
+    """
+    Grava um lote na tabela e os registros derivados dele (ex.: CNAEs secundários dos estabelecimentos).
+
+    :param session: Sessão do banco de dados, com a transação do lote aberta.
+    :param model: Classe mapeada da tabela.
+    :param frame: DataFrame com as colunas da tabela.
+    :param children: DataFrames das tabelas derivadas (ver to_child_frames), indexados como o lote;
+        só os registros derivados das linhas de 'frame' são gravados (opcional).
+    :param target_tables: Tabelas novas da carga completa (nome da tabela -> tabela nova); os registros
+        são acrescentados a elas com COPY, sem merge (opcional).
+    :return: Quantidade de registros gravados na tabela.
+    """
+    if target_tables:
+        count = append_frame_into_table(session, target_tables[model.__tablename__], frame)
+    else:
+        count = copy_frame_into_table(session, model, frame)
+    if frame.empty:
+        return count
+    for child_model, child_frame in (children or {}).items():
+        child_frame = child_frame[child_frame.index.isin(frame.index)]
+        if target_tables:
+            append_frame_into_table(session, target_tables[child_model.__tablename__], child_frame)
+        else:
+            replace_child_rows(session, child_model, model, child_frame)
+    return count
+
+
+def upsertCSVIntoBD(file_name, batches, load_slots=None, fingerprint_index=None, checkpoint=None, snapshot=None,
+                    target_tables=None):
     """
-    Lê o arquivo CSV corrigido e insere os dados no banco de dados.
+    Insere no banco de dados os lotes já normalizados de um arquivo da Receita.
 
     :param file_name: Nome do arquivo (para identificar o tipo de dados).
-    :param corrected_csv_file: Caminho para o arquivo CSV corrigido.
+    :param batches: Iterável de DataFrames normalizados, com os cabeçalhos da Receita.
+    :param load_slots: Semáforo que limita quantos lotes são gravados no banco ao mesmo tempo (opcional).
+    :param fingerprint_index: Índice da carga incremental; só registros novos ou alterados são enviados (opcional).
+    :param checkpoint: Progresso já gravado ({'month', 'file_name', 'rows_committed', 'batches_committed'}).
+        Quando informado, o progresso é gravado na mesma transação de cada lote e a carga para no
+        primeiro lote com erro, para ser retomada a partir dele (opcional).
+    :param snapshot: SnapshotWriter que grava cada lote normalizado também em Parquet (opcional).
+    :param target_tables: Tabelas novas da carga completa (nome da tabela -> tabela nova, ver bulkload.py);
+        os lotes são acrescentados a elas com COPY, sem merge (opcional).
+    :return: Quantidade de lotes que falharam (0 quando tudo foi gravado).
     """
-    # Conectar ao banco de dados
     date = datetime.now()
-    session = getSession()
     inserted_count = 0  # Contador de registros inseridos
-    bulk_data = []  # Lista que vai armazenar os dados a serem inseridos em lote
-    row = None
-    # Verifica se o campo existe e não é nulo, caso contrário, atribui um valor padrão
-    def safe_get(row, column, default_value=""):
-      value = row.get(column, default_value)
-      if pd.isna(value) or value in ["nan", "NaN", "None", ""]:
-          return default_value
-      if column == 'PAIS' and value not in ["nan", "NaN", "None", ""]:
-        value = int(value)  # Converte apenas o 'value', que é o código do país
-        return str(value).strip()
-
-      return str(value).strip()
-
+    failed_batches = 0
 
     try:
-        dtype = {
-            'DDD 1': 'str',
-            'DDD 2': 'str',
-            'PAIS': 'str',
-            'TELEFONE 1': 'str',
-            'TELEFONE 2': 'str',
-            'FAX': 'str',
-        }
-
-        df = pd.read_csv(corrected_csv_file, encoding='ISO-8859-1', low_memory=False, dtype=dtype)
-        print(f"Total de linhas no CSV: {len(df)}")
-
-
-
-        # if 'DDD 1' in df.columns:
-        #     df['DDD 1'] = df['DDD 1'].fillna(pd.NA).astype('Int64')  # Usar pd.NA para valores nulos
-        # if 'DDD 2' in df.columns:
-        #     df['DDD 2'] = df['DDD 2'].fillna(pd.NA).astype('Int64')
-        if 'TELEFONE 1' in df.columns:
-            df['TELEFONE 1'] = df['TELEFONE 1'].fillna('0').astype(str).str.replace(r'\D', '', regex=True)  # Remover não numéricos
-        if 'TELEFONE 2' in df.columns:
-            df['TELEFONE 2'] = df['TELEFONE 2'].fillna('0').astype(str).str.replace(r'\D', '', regex=True)
-        if 'FAX' in df.columns:
-            df['FAX'] = df['FAX'].fillna('0').astype(str).str.replace(r'\D', '', regex=True)
-
-        # Tratamento para CEP: Remove espaços e traços
-        if 'CEP' in df.columns:
-            df['CEP'] = df['CEP'].fillna('0').astype(str).str.replace(r'\D', '', regex=True)
-
-        if 'CORREIO ELETRONICO' in df.columns:
-            df['CORREIO ELETRONICO'] = df['CORREIO ELETRONICO'].fillna('')  # Substitui NaN por uma string vazia
-
-        if 'CAPITAL SOCIAL DA EMPRESA' in df.columns:
-            df['CAPITAL SOCIAL DA EMPRESA'] = df['CAPITAL SOCIAL DA EMPRESA'].apply(lambda x: str(x).replace(" ", "") if isinstance(x, (str, float, int)) else '0')
-
-        if 'TELEFONE 1' in df.columns:
-            df['TELEFONE 1'] = df['TELEFONE 1'].fillna('0').astype(str).str.replace(r'\D', '', regex=True)  # Remover não numéricos
-        if 'TELEFONE 2' in df.columns:
-            df['TELEFONE 2'] = df['TELEFONE 2'].fillna('0').astype(str).str.replace(r'\D', '', regex=True)
-              # Tratamento para FAX e DDD, removendo qualquer caractere não numérico
-        if 'FAX' in df.columns:
-            df['FAX'] = df['FAX'].fillna('0').astype(str).str.replace(r'\D', '')  # Remove não numéricos
-
-        if 'DDD 1' in df.columns:
-            df['DDD 1'] = df['DDD 1'].fillna('0').astype(str).str.replace(r'\D', '')  # Remove não numéricos
-        if 'DDD 2' in df.columns:
-            df['DDD 2'] = df['DDD 2'].fillna('0').astype(str).str.replace(r'\D', '')  # Remove não numéricos
-
-
-        # Tratamento para CEP: Remove espaços e traços
-        if 'CEP' in df.columns:
-            df['CEP'] = df['CEP'].fillna('0').astype(str).str.replace(r'\D', '', regex=True)
-
-        if 'CORREIO ELETRONICO' in df.columns:
-            df['CORREIO ELETRONICO'] = df['CORREIO ELETRONICO'].fillna('')  # Substitui NaN por uma string vazia
-
-        if 'CAPITAL SOCIAL DA EMPRESA' in df.columns:
-            df['CAPITAL SOCIAL DA EMPRESA'] = df['CAPITAL SOCIAL DA EMPRESA'].apply(lambda x: str(x).replace(" ", "") if isinstance(x, (str, float, int)) else '0')
-
-        # Processar colunas de data com tratamento adequado para NaN
-        for col in ['DATA DE INICIO DE ATIVIDADE', 'DATA DA SITUACAO ESPECIAL']:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], format='%Y%m%d', errors='coerce')
-
-        if 'PAIS' in df.columns:
-            # Preenche valores nulos com '105' e remove qualquer valor não numérico
-            df['PAIS'] = df['PAIS'].fillna('105').astype(str).str.replace(r'\D', '')  # Remove qualquer caractere não numérico
-            df['PAIS'] = df['PAIS'].apply(lambda x: x if x.isdigit() else '105')  # Garante que só números permaneçam
-
-
-
-
-        if 'DDD 1' in df.columns:
-            #df['DDD 1'] = df['DDD 1'].replace('0', pd.NA).fillna(pd.NA).astype('Int64')
-            df['DDD 1'] = df['DDD 1'].fillna('0').astype(str).str.replace(r'\D', '')  # Remove qualquer caractere não numérico
-        if 'DDD 2' in df.columns:
-            #df['DDD 2'] = df['DDD 2'].replace('0', pd.NA).fillna(pd.NA).astype('Int64')
-            df['DDD 2'] = df['DDD 2'].fillna('0').astype(str).str.replace(r'\D', '')  # Remove qualquer caractere não numérico
-        if 'TELEFONE 1' in df.columns:
-            df['TELEFONE 1'] = df['TELEFONE 1'].fillna('0').astype(str).str.replace(r'\D', '')  # Remove qualquer caractere não numérico
-            df['TELEFONE 1'] = df['TELEFONE 1'].fillna('0').astype(str).str.replace(" ", '')
-            df['TELEFONE 1'] = df['TELEFONE 1'].fillna('0').astype(str).str.replace("-", '')
-            df['TELEFONE 1'] = df['TELEFONE 1'].apply(lambda x: str(int(float(x))) if x != '0' else '0')  # Converte para número
-        if 'TELEFONE 2' in df.columns:
-            df['TELEFONE 2'] = df['TELEFONE 2'].fillna('0').astype(str).str.replace(r'\D', '')  # Remove qualquer caractere não numérico
-            df['TELEFONE 2'] = df['TELEFONE 2'].fillna('0').astype(str).str.replace(" ", '')
-            df['TELEFONE 2'] = df['TELEFONE 2'].fillna('0').astype(str).str.replace("-", '')
-            df['TELEFONE 2'] = df['TELEFONE 2'].apply(lambda x: str(int(float(x))) if x != '0' else '0')  # Converte para número
-        if 'FAX' in df.columns:
-            df['FAX'] = df['FAX'].fillna(0).astype(str).str.replace(" ", "").apply(lambda x: str(int(float(x))) if x != '0' else '0')
-        if 'CEP' in df.columns:
-            df['CEP'] = df['CEP'].fillna(0).astype(float).astype(int).astype(str).str.replace(' ', '').replace("-", "")
-
-
-        if 'CORREIO ELETRONICO' in df.columns:
-            df['CORREIO ELETRONICO'] = df['CORREIO ELETRONICO'].fillna('')  # Substitui NaN por uma string vazia
-
-        if 'CAPITAL SOCIAL DA EMPRESA' in df.columns:
-            df['CAPITAL SOCIAL DA EMPRESA'] = df['CAPITAL SOCIAL DA EMPRESA'].apply(lambda x: str(x).replace(" ", "") if isinstance(x, (str, float, int)) else x)
-
-        # Processar dados de data, tratando valores NaN com None
-        for col in ['DATA DE INICIO DE ATIVIDADE', 'DATA DA SITUACAO ESPECIAL']:
-              if col in df.columns:
-                  df[col] = pd.to_datetime(df[col], format='%Y%m%d', errors='coerce')
-
-        if 'CNPN BASICO' in df.columns:
-            df['CNPJ BASICO'] = df['CNPJ BASICO'].astype(str).str.replace(' ', '')
-
-        chunk_size = 100000  # Tamanho do chunk
-        for chunk in pd.read_csv(corrected_csv_file, encoding='utf-8', low_memory=False, chunksize=chunk_size):
-            print(f"Processando chunk com {len(chunk)} registros...")
-            record_counter = 0
-            for index, row in chunk.iterrows():
-                row = row.to_dict()
-                print(f'total de registros até o momento inseridos {inserted_count}')
-                if 'Empresas' in file_name:
-                    company = Company(
-                        base_cnpj=str(row['CNPJ BASICO']),
-                        social_reason_business_name=row['RAZAO SOCIAL/NOME EMPRESARIAL'],
-                        legal_nature=row['NATUREZA JURIDICA'],
-                        responsible_qualification=str(row['QUALIFICACAO DO RESPONSAVEL']),
-                        social_capital_company=row['CAPITAL SOCIAL DA EMPRESA'].replace(',', '.'),
-                        company_size=row['PORTE DA EMPRESA'],
-                        responsible_federative_entity=row['ENTE FEDERATIVO RESPONSÁVEL'],
-                        updated_at=date
-                    )
-                    print(f'passou por empresa: \n{company}')
-                    try:
-                        bulk_data.append(company)  # 'merge' faz o upsert
-                    except Exception as e:
-                        print(f'erro: {e}')
-                        session.rollback()  # Reverte a transação se houver um erro
-                        getSessionWithRetry(file_name, corrected_csv_file)
-                    print('passou pelo merge')
-                    inserted_count += 1  # Incrementa o contador
-
-                elif 'Estabelecimento' in file_name:
-                    # Verifica se a empresa existe no banco de dados
-                    # company_cnpj = str(row['CNPJ BASICO']).strip()
-                    # base_cnpj = None
-                    # try:
-                    #     company = session.query(Company).filter_by(base_cnpj=company_cnpj).one()
-                    #     base_cnpj = company.base_cnpj  # Atribui o base_cnpj se a empresa existir
-                    # except NoResultFound:
-                    #     base_cnpj = None  # Se a empresa não for encontrada, base_cnpj será None
-
-                    establishment = Establishment(
-                        base_cnpj=safe_get(row, 'CNPJ BASICO', None),
-                        cnpj_dv=safe_get(row, 'CNPJ DV'),
-                        cnpj_order=safe_get(row, 'CNPJ ORDEM'),
-                        fantasy_name=safe_get(row, 'NOME FANTASIA'),
-                        identifier_branch_matriz=safe_get(row, 'IDENTIFICADOR MATRIZ/FILIAL', ''),
-                        cadastral_situation=safe_get(row, 'SITUACAO CADASTRAL', ''),
-                        cadastral_situation_reason=safe_get(row, 'MOTIVO SITUACAO CADASTRAL', ''),
-                        city_name_exterior=safe_get(row, 'NOME DA CIDADE NO EXTERIOR', ''),
-                        country=safe_get(row, 'PAIS', '105'),
-                        activity_start_date=parse_date(safe_get(row, 'DATA DE INICIO DE ATIVIDADE', '1900-01-01')),
-                        special_situation_date=parse_date(safe_get(row, 'DATA DA SITUACAO ESPECIAL', '1900-01-01')),
-                        cnae_main=safe_get(row, 'CNAE FISCAL PRINCIPAL', ''),
-                        street_type=safe_get(row, 'TIPO DE LOGRADOURO', ''),
-                        street=safe_get(row, 'LOGRADOURO', ''),
-                        number=safe_get(row, 'NUMERO', ''),
-                        complement=safe_get(row, 'COMPLEMENTO', ''),
-                        neighborhood=safe_get(row, 'BAIRRO', ''),
-                        cep=safe_get(row, 'CEP', ''),
-                        cnpj=f"{safe_get(row, 'CNPJ BASICO')}000{safe_get(row, 'CNPJ ORDEM')}{safe_get(row, 'CNPJ DV')}",
-                        city=safe_get(row, 'MUNICIPIO', ''),
-                        ddd_1=safe_get(row, 'DDD 1', ''),
-                        phone_1=safe_get(row, 'TELEFONE 1', '').replace(" ", ""),
-                        ddd_2=safe_get(row, 'DDD 2', ''),
-                        phone_2=safe_get(row, 'TELEFONE 2', '').replace(" ",""),
-                        fax_ddd=safe_get(row, 'DDD DO FAX', ''),
-                        fax=safe_get(row, 'FAX', '').replace(" ", ""),
-                        electronic_mail=safe_get(row, 'CORREIO ELETRONICO', ''),
-                        special_situation=safe_get(row, 'SITUACAO ESPECIAL', ''),
-                        uf=safe_get(row, 'UF', ''),
-                        #cnae_secondary=safe_get(row, 'CNAE FISCAL SECUNDARIA', None),
-                        updated_at=datetime.now()  # Data e hora atuais
-                    )
-                    bulk_data.append(establishment)
-                    inserted_count += 1
-                elif 'Socios' in file_name:
-                    try:
-                        date_entry = datetime.strptime(str(row['DATA DE ENTRADA SOCIEDADE']), '%Y%m%d') if pd.notna(row['DATA DE ENTRADA SOCIEDADE']) else None
-                    except ValueError:
-                        date_entry = None
-
-                    partner = Partner(
-                        base_cnpj=row['CNPJ BASICO'],
-                        partner_identifier=row['IDENTIFICADOR DE SOCIO'],
-                        partner_name_social_reason=row['NOME DO SOCIO/RAZAO SOCIAL'],
-                        partner_cpf_cnpj=row['CNPJ/CPF DO SOCIO'],
-                        partner_qualification=row['QUALIFICACAO DO SOCIO'],
-                        date_entry_society=date_entry,
-                        country=row['PAIS'],
-                        cpf_legal_representative=row['REPRESENTANTE LEGAL'],
-                        representative_name=row['NOME DO REPRESENTANTE'],
-                        legal_representative_qualification=row['QUALIFICACAO DO REPRESENTANTE LEGAL'],
-                        age_group=row['FAIXA ETARIA'],
-                        updated_at=date
-                    )
-                    bulk_data.append(partner)
-                    inserted_count += 1
-
-                elif 'simples' in file_name.lower():
-                    simples = Simples(
-                        base_cnpj=str(row['CNPJ BASICO']),
-                        simples_option=row['OPCAO PELO SIMPLES'],
-                        simples_option_date=parse_date(safe_get(row,'DATA DE OPCAO PELO SIMPLES','1900-01-01')),
-                        simples_option_exclusion_date=parse_date(safe_get(row,'DATA DE EXCLUSAO DO SIMPLES', '1900-01-01')),
-                        mei_option=row['OPCAO PELO MEI'],
-                        mei_option_date=parse_date(safe_get(row,'DATA DE OPCAO PELO MEI', '1900-01-01')),
-                        mei_exclusion_date=parse_date(safe_get(row,'DATA DE EXCLUSAO DO MEI', '1900-01-01')),
-                        updated_at=date
-                    )
-                    bulk_data.append(simples)
-                    inserted_count += 1
-
-                elif 'Cnaes' in file_name:
-                    cnae = Cnae(
-                        code=str(row['CODIGO']),
-                        description=row['DESCRICAO'],
-                        updated_at=date
-                    )
-                    bulk_data.append(cnae)
-                    inserted_count += 1
-
-                elif 'Naturezas' in file_name:
-                    nature = LegalNature(
-                        code=str(row['CODIGO']),
-                        description=row['DESCRICAO'],
-                        updated_at=date
-                    )
-                    bulk_data.append(nature)
-                    inserted_count += 1
-
-                elif 'Qualificacoes' in file_name:
-                    partnerQuali = PartnerQualification(
-                        code=str(row['CODIGO']),
-                        description=row['DESCRICAO'],
-                        updated_at=date
-                    )
-                    bulk_data.append(partnerQuali)
-                    inserted_count += 1
-
-                elif 'Municipios' in file_name:
-                    city = City(
-                        code=str(row['CODIGO']),
-                        description=row['DESCRICAO'],
-                        updated_at=date
-                    )
-                    bulk_data.append(city)
-                    inserted_count += 1
-
-                elif 'Paises' in file_name:
-                    country = Country(
-                        code=str(row['CODIGO']),
-                        description=row['DESCRICAO'],
-                        updated_at=date
+        layout_name = get_layout_name(file_name)
+        if layout_name is None:
+            print(f"Layout não encontrado para o arquivo {file_name}")
+            return 1
+
+        model = LAYOUTS[layout_name]['model']
+        table_name = model.__tablename__
+        for batch in batches:
+            # Os registros já foram contados na normalização (normalize_batches); aqui só o tempo
+            with metrics.timer('normalize', table=table_name):
+                table_frame = to_table_frame(layout_name, batch, date)
+                # Registros que o banco recusaria (chave vazia, valor maior que a coluna) vão para IngestionRejects
+                table_frame, rejected, reasons = split_invalid_rows(model, table_frame)
+                check_codes(table_name, table_frame)
+            if snapshot is not None:
+                # A cópia recebe o lote inteiro, antes de a carga incremental filtrar os registros alterados
+                snapshot.write(table_frame)
+            if fingerprint_index is not None:
+                changed = fingerprint_index.diff(table_frame)
+                table_frame = table_frame[changed]
+            children = to_child_frames(layout_name, table_frame)
+            try:
+                # Cada lote é uma unidade de trabalho: commit ao final do bloco, rollback se houver erro
+                with load_slots or nullcontext(), session_scope() as session:
+                    load = partial(load_frame, session, model, children=children, target_tables=target_tables)
+                    # Um registro recusado pelo banco não descarta o lote: ele é isolado e vai para IngestionRejects
+                    written, refused, errors = load_with_bisect(session, table_frame, load)
+                    inserted_count += written
+                    save_rejects(
+                        session, table_name, pd.concat([rejected, refused]), reasons + errors,
+                        month=checkpoint['month'] if checkpoint is not None else None, file_name=file_name
                     )
-                    bulk_data.append(country)
-                    inserted_count += 1
-
-                # Dentro do loop principal, onde processa os chunks:
-                if len(bulk_data) >= 100000:
-                    try:
-                        session.bulk_save_objects(bulk_data)
-                        session.commit()
-                        print(f'{len(bulk_data)} registros inseridos com sucesso.')
-                    except IntegrityError as e:
-                        session.rollback()
-                        print(f"Erro de integridade: {e}")
-                    except Exception as e:
-                        session.rollback()
-                        print(f"Erro ao inserir dados: {e}")
-                    finally:
-                        bulk_data = []
-
-
-            # Comitar quaisquer registros restantes que não atingiram o tamanho do lote
-            # Após o loop de chunks, para o último lote não processado:
-            if bulk_data:
-                try:
-                    session.bulk_save_objects(bulk_data)
-                    session.commit()
-                    #print(f'{len(bulk_data)} registros inseridos com sucesso.')
-                except IntegrityError as e:
-                    session.rollback()
-                    print(f"Erro de integridade: {e}")
-                    return
-                except Exception as e:
-                    session.rollback()
-                    print(f"Erro ao inserir dados restantes: {e}")
-                    return
-                finally:
-                    bulk_data = []  # Garante que o bulk_data seja esvaziado
-
-
-
-        print(f"Dados do arquivo {file_name} inseridos/atualizados com sucesso no banco de dados.")
+                    if checkpoint is not None:
+                        save_checkpoint(
+                            session, checkpoint['month'], checkpoint['file_name'],
+                            checkpoint['rows_committed'] + len(batch), checkpoint['batches_committed'] + 1
+                        )
+                    if fingerprint_index is not None:
+                        # Antes do commit: um lote gravado no banco sempre está no índice, senão a remoção
+                        # dos registros que saíram da base (remove_stale_rows) apagaria registros atuais
+                        fingerprint_index.exclude(refused)
+                        fingerprint_index.record()
+                    commit_start = time.perf_counter()
+                metrics.observe('commit_seconds', time.perf_counter() - commit_start)
+                if fingerprint_index is not None:
+                    fingerprint_index.confirm()
+                if checkpoint is not None:
+                    checkpoint['rows_committed'] += len(batch)
+                    checkpoint['batches_committed'] += 1
+                log_event('batch_loaded', logging.DEBUG, table=table_name, rows_read=len(batch), rows_written=len(table_frame))
+            except IntegrityError as e:
+                failed_batches += 1
+                metrics.increment('batch_failures')
+                print(f"Erro de integridade: {e}")
+            except Exception as e:
+                failed_batches += 1
+                metrics.increment('batch_failures')
+                print(f"Erro ao inserir dados: {e}")
+
+            if failed_batches and checkpoint is not None:
+                # Para no lote com erro; a próxima tentativa retoma a partir do último lote gravado
+                break
+
+        if checkpoint is not None and not failed_batches:
+            with session_scope() as session:
+                save_checkpoint(
+                    session, checkpoint['month'], checkpoint['file_name'],
+                    checkpoint['rows_committed'], checkpoint['batches_committed'], completed=True
+                )
+
+        log_event('file_loaded', file_name=file_name, table=table_name, rows_written=inserted_count, failed_batches=failed_batches)
     except Exception as e:
-        print(f'Erro ao processar o arquivo {file_name}: {row} : {e}')
-        session.rollback()
-        return
+        print(f'Erro ao processar o arquivo {file_name}: {e}')
+        failed_batches += 1
+
+    return failed_batches
+
 
+MAIN_DIRECTORY = '/content'
+ARQUIVOS_FOLDER_PATH = os.path.join(MAIN_DIRECTORY, 'arquivos')
+FINGERPRINTS_FOLDER_PATH = os.path.join(ARQUIVOS_FOLDER_PATH, 'fingerprints')
 
+# Arquivos da Receita na ordem de carga (tabelas de domínio antes das que dependem delas)
+ORDER_OF_FILES = [
+    'Naturezas',
+    'Qualificacoes',
+    'Paises',
+    'Municipios',
+    'Cnaes',
+    'Motivos',
+    'Empresas',
+    'Estabelecimentos',
+    'Simples',
+    'Socios'
+]
 
-def getFiles(fileName, month, year):
+# Tabelas recarregadas por completo em fullRefreshBd
+FULL_REFRESH_FILES = ['Empresas', 'Estabelecimentos', 'Socios']
+
+
+def list_partitions(fileName, manifest, month_label=None):
+    """
+    Nomes das partições de um arquivo publicadas no mês (ex.: 'Empresas' -> ['Empresas0', ..., 'Empresas9']).
+    Com month_label, as partições já carregadas por completo no mês ficam de fora.
+    """
+    partitions = partitions_for(manifest, fileName)
+    if month_label is None:
+        return partitions
+
+    with session_scope() as session:
+        completed = completed_files(session, month_label)
+    skipped = [partition for partition in partitions if partition in completed]
+    if skipped:
+        print(f"Partições já carregadas em {month_label}, ignorando: {skipped}")
+    return [partition for partition in partitions if partition not in completed]
+
+
+def download_partition(partition, manifest, month_label=None):
+    """
+    Baixa o ZIP de uma partição, caso ainda não esteja em disco.
+
+    :param partition: Nome da partição (ex.: 'Estabelecimentos7').
+    :param manifest: Manifesto do mês (URL, tamanho e ETag de cada arquivo).
+    :param month_label: Mês do manifesto (ex.: '2025-03'). Quando informado e o arquivo no servidor não
+        confere com o manifesto (ex.: republicado pela Receita), o manifesto é consultado de novo uma vez
+        e atualizado, e o download é refeito com os dados novos (opcional).
+    :return: Caminho do ZIP baixado.
+    :raises DownloadError: Se o download falhar mesmo com o manifesto atualizado.
+    """
+    os.makedirs(ARQUIVOS_FOLDER_PATH, exist_ok=True)
+    zip_file_path = os.path.join(ARQUIVOS_FOLDER_PATH, f"{partition}.zip")
+
+    if os.path.exists(zip_file_path):
+        print(f"O arquivo {partition}.zip já foi baixado. Pulando download.")
+        return zip_file_path
+
+    entry = manifest[partition]
+    print(f"Baixando arquivo {partition}.zip de {entry['url']}")
+    try:
+        # Baixa em partes paralelas, retomando downloads interrompidos
+        download_file(entry['url'], zip_file_path, expected_size=entry['size'], expected_etag=entry['etag'])
+    except DownloadError:
+        if month_label is None:
+            raise
+        year, month = month_label.split('-')
+        current = fetch_manifest(year, month, cache_dir=ARQUIVOS_FOLDER_PATH, refresh=True)
+        changed = current.get(partition)
+        if changed is None or (changed['size'], changed['etag']) == (entry['size'], entry['etag']):
+            raise
+        print(f"O arquivo {partition}.zip mudou no servidor; baixando a versão atual.")
+        log_event('manifest_refreshed', month=month_label, file_name=partition)
+        manifest.update(current)
+        download_file(changed['url'], zip_file_path, expected_size=changed['size'], expected_etag=changed['etag'])
+    return zip_file_path
+
+
+def get_month_label(month, year):
+    """Identificação do mês carregado (ex.: '2025-03')."""
+    return f'{int(year)}-{int(month):02d}'
+
+
+def get_manifest(month, year, refresh=False):
+    """
+    Manifesto do mês (ver discovery.fetch_manifest).
+
+    :param refresh: Ignora o manifesto salvo e consulta o servidor novamente.
+    :return: Manifesto, ou None se a Receita ainda não publicou o mês.
+    """
+    try:
+        return fetch_manifest(year, month, cache_dir=ARQUIVOS_FOLDER_PATH, refresh=refresh)
+    except FileNotFoundError:
+        print(f"Mês {int(month):02d}/{year} ainda não publicado pela Receita, nada a carregar.")
+        log_event('month_not_published', month=get_month_label(month, year))
+        return None
+
+
+def fingerprint_index_path(fileName, refresh=False):
+    """
+    Caminho do índice de impressões digitais da tabela do arquivo; com 'refresh', o do índice recriado
+    durante a carga completa, que substitui o atual depois da troca das tabelas (ver fullRefreshBd).
+    """
+    table_name = LAYOUTS[get_layout_name(fileName)]['model'].__tablename__
+    suffix = REFRESH_SUFFIX if refresh else ''
+    return os.path.join(FINGERPRINTS_FOLDER_PATH, f'{table_name}{suffix}.sqlite')
+
+
+def open_fingerprint_index(fileName, month_label, refresh=False):
+    """Abre o índice de impressões digitais da tabela do arquivo (carga incremental)."""
+    model = LAYOUTS[get_layout_name(fileName)]['model']
+    key_columns = [column.name for column in model.__table__.primary_key.columns]
+    return FingerprintIndex(fingerprint_index_path(fileName, refresh), month_label, key_columns)
+
+
+def remove_fingerprint_index(index_path):
+    """Apaga o arquivo SQLite do índice, com o WAL e a memória compartilhada, se existirem."""
+    for path in (index_path, f'{index_path}-wal', f'{index_path}-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def replace_fingerprint_index(fileName):
+    """
+    Carga completa: o índice recriado com os registros da tabela nova substitui o da tabela antiga,
+    para que a próxima carga incremental compare com o que está no banco (e remova o que sair da base).
+    """
+    index_path = fingerprint_index_path(fileName)
+    refresh_path = fingerprint_index_path(fileName, refresh=True)
+    remove_fingerprint_index(index_path)
+    if os.path.exists(refresh_path):
+        os.replace(refresh_path, index_path)
+    remove_fingerprint_index(refresh_path)
+
+
+def process_partition(fileName, zip_file_path, load_slots=None, month_label=None, incremental=False, target_tables=None):
+    """
+    Lê os registros direto do ZIP, normaliza, grava no banco e remove o ZIP.
+
+    Com month_label, o progresso de cada lote fica gravado em IngestionCheckpoints e, se a carga
+    falhar (ex.: queda da conexão), ela é retomada a partir do último lote gravado. Com SNAPSHOT_FOLDER
+    configurada, os lotes também são gravados em Parquet (ver snapshot.py).
+
+    :param fileName: Nome do arquivo (para identificar o tipo de dados).
+    :param zip_file_path: Caminho do ZIP baixado.
+    :param load_slots: Semáforo que limita quantos lotes são gravados no banco ao mesmo tempo (opcional).
+    :param month_label: Mês em carga (ex.: '2025-03'), usado nos checkpoints e na carga incremental (opcional).
+    :param incremental: Envia ao banco só registros novos ou alterados (exige month_label).
+    :param target_tables: Tabelas novas da carga completa (nome da tabela -> tabela nova), que recebem
+        os registros sem merge (opcional). Nesse caso os checkpoints não são gravados (a troca das tabelas
+        os grava) e, com month_label, o índice de impressões digitais é recriado com os registros gravados.
+    :return: Snapshot das métricas do processo (ver Metrics.snapshot).
+    :raises RuntimeError: Se o arquivo não foi gravado após MAX_LOAD_ATTEMPTS tentativas (o ZIP é mantido).
+    """
+    layout_name = get_layout_name(fileName)
+    partition = os.path.splitext(os.path.basename(zip_file_path))[0]
+    model = LAYOUTS[layout_name]['model']
+    if month_label is not None and model.__tablename__ in LOOKUP_COLUMNS:
+        # Tabelas de domínio em memória, para conferir os códigos do arquivo (lidas de novo só quando
+        # uma partição de domínio termina de ser carregada, ver domain_version)
+        lookups.refresh(domain_version(month_label))
+
+    for attempt in range(1, MAX_LOAD_ATTEMPTS + 1):
+        checkpoint = None
+        if month_label is not None and target_tables is None:
+            with session_scope() as session:
+                saved = get_checkpoint(session, month_label, partition)
+                checkpoint = {
+                    'month': month_label,
+                    'file_name': partition,
+                    'rows_committed': saved.rows_committed if saved else 0,
+                    'batches_committed': saved.batches_committed if saved else 0,
+                }
+                completed = bool(saved and saved.completed)
+            if completed:
+                print(f"Arquivo {partition} já carregado em {month_label}.")
+                break
+            if checkpoint['rows_committed']:
+                print(f"Retomando {partition} a partir do registro {checkpoint['rows_committed']}.")
+
+        fingerprint_index = None
+        if month_label is not None and target_tables is not None:
+            # O índice novo começa vazio: todos os registros são gravados e registrados nele
+            fingerprint_index = open_fingerprint_index(fileName, month_label, refresh=True)
+        elif incremental:
+            fingerprint_index = open_fingerprint_index(fileName, month_label)
+        skip_rows = checkpoint['rows_committed'] if checkpoint else 0
+        snapshot = None
+        if checkpoint is not None:
+            snapshot = open_snapshot(month_label, LAYOUTS[layout_name]['model'], partition, checkpoint['batches_committed'])
+        try:
+            failed_batches = upsertCSVIntoBD(
+                fileName, zip_pipeline(zip_file_path, layout_name, skip_rows=skip_rows),
+                load_slots, fingerprint_index, checkpoint, snapshot, target_tables
+            )
+        finally:
+            if fingerprint_index is not None:
+                fingerprint_index.close()
+
+        if not failed_batches:
+            break
+
+        wait_time = 5 * attempt
+        metrics.increment('load_retries')
+        print(f"Falha ao gravar {partition} (tentativa {attempt}/{MAX_LOAD_ATTEMPTS}). Tentando novamente em {wait_time} segundos...")
+        time.sleep(wait_time)
+    else:
+        raise RuntimeError(f"{zip_file_path} não foi gravado após {MAX_LOAD_ATTEMPTS} tentativas")
+
+    os.remove(zip_file_path)
+    print(f"Arquivo {zip_file_path} excluído.")
+    if model in LOOKUP_MODELS:
+        lookups.invalidate()
+    # Métricas do processo desde a última partição, somadas pelo processo principal
+    return metrics.snapshot(reset=True)
+
+
+def remove_stale_rows(fileName, month_label):
+    """
+    Carga incremental: apaga do banco os registros que não foram publicados no mês.
+    Só deve ser chamada depois que todas as partições do arquivo foram carregadas sem erro.
+    """
+    layout = LAYOUTS[get_layout_name(fileName)]
+    model = layout['model']
+    fingerprint_index = open_fingerprint_index(fileName, month_label)
+    deleted_count = 0
+    try:
+        for keys in fingerprint_index.stale_batches():
+            with session_scope() as session:
+                deleted_count += delete_frame_from_table(session, model, keys)
+                for child in layout.get('children', []):
+                    delete_frame_from_table(session, child, keys, key_columns=list(keys.columns))
+            fingerprint_index.forget(keys)
+    except Exception as e:
+        print(f"Erro ao remover registros de {fileName} que saíram da base: {e}")
+    finally:
+        fingerprint_index.close()
+    print(f"{deleted_count} registros de {fileName} removidos por não constarem mais na base de {month_label}.")
+
+
+def getFiles(fileName, month, year, incremental=False, refresh_manifest=False):
     """
     Baixa e processa os arquivos para inserção no banco de dados, realizando um upsert para cada um.
 
     :param fileName: Nome do arquivo (para identificar o tipo de dados).
     :param month: Mês do arquivo a ser processado.
     :param year: Ano do arquivo a ser processado.
+    :param incremental: Envia ao banco só registros novos ou alterados e remove os que saíram da base.
+    :param refresh_manifest: Consulta o manifesto do mês no servidor, mesmo que haja um salvo.
     """
-    csvHeader = []
     now = datetime.now()
-    counter = 4
-    csv_counter = 1
-
-    main_directory = '/content'
-
-    print(f"Definindo cabeçalhos para o arquivo {fileName}...")
-
-    # Definir os cabeçalhos conforme o tipo de arquivo
-    if fileName in ['Cnaes', 'Naturezas', 'Qualificacoes', 'Municipios', 'Paises']:
-        csvHeader = ['CODIGO', 'DESCRICAO']
-    elif fileName in ['Socios']:
-        csvHeader = [
-            'CNPJ BASICO', 'IDENTIFICADOR DE SOCIO', 'NOME DO SOCIO/RAZAO SOCIAL', 'CNPJ/CPF DO SOCIO', 'QUALIFICACAO DO SOCIO',
-            'DATA DE ENTRADA SOCIEDADE', 'PAIS', 'REPRESENTANTE LEGAL', 'NOME DO REPRESENTANTE', 'QUALIFICACAO DO REPRESENTANTE LEGAL',
-            'FAIXA ETARIA'
-        ]
-    elif fileName in ['Simples']:
-        csvHeader = [
-            'CNPJ BASICO', 'OPCAO PELO SIMPLES', 'DATA DE OPCAO PELO SIMPLES', 'DATA DE EXCLUSAO DO SIMPLES',
-            'OPCAO PELO MEI', 'DATA DE OPCAO PELO MEI', 'DATA DE EXCLUSAO DO MEIO'
-        ]
-    elif fileName in ['Estabelecimento', 'ESTABELE', 'Estabelecimentos']:
-        csvHeader = [
-            'CNPJ BASICO', 'CNPJ ORDEM', 'CNPJ DV', 'IDENTIFICADOR MATRIZ/FILIAL', 'NOME FANTASIA', 'SITUACAO CADASTRAL',
-            'DATA SITUACAO CADASTRAL', 'MOTIVO SITUACAO CADASTRAL', 'NOME DA CIDADE NO EXTERIOR', 'PAIS', 'DATA DE INICIO DE ATIVIDADE',
-            'CNAE FISCAL PRINCIPAL', 'CNAE FISCAL SECUNDARIA', 'TIPO DE LOGRADOURO', 'LOGRADOURO', 'NUMERO', 'COMPLEMENTO', 'BAIRRO',
-            'CEP', 'UF', 'MUNICIPIO', 'DDD 1', 'TELEFONE 1', 'DDD 2', 'TELEFONE 2', 'DDD DO FAX', 'FAX', 'CORREIO ELETRONICO',
-            'SITUACAO ESPECIAL', 'DATA DA SITUACAO ESPECIAL'
-        ]
-    elif fileName in ['Empresas']:
-      csvHeader = [
-        'CNPJ BASICO', 'RAZAO SOCIAL/NOME EMPRESARIAL', 'NATUREZA JURIDICA',
-        'QUALIFICACAO DO RESPONSAVEL', 'CAPITAL SOCIAL DA EMPRESA', 'PORTE DA EMPRESA',
-        'ENTE FEDERATIVO RESPONSÁVEL'
-      ]
-
-    elif fileName in ['Motivos']:
-        csvHeader = ['Test', 'Test']
-
-    print(f"Cabeçalhos definidos: {csvHeader}")
+
+    if get_layout_name(fileName) is None:
+        print(f"Layout não encontrado para o arquivo {fileName}")
+        return
 
     if month is None:
         month = now.month
@@ -451,175 +425,191 @@ def getFiles(fileName, month, year):
         year = now.year
 
     print(f"Data configurada: {month}/{year}")
+    configure_logging()
 
-    arquivos_folder_path = os.path.join(main_directory, 'arquivos')
-
-    if not os.path.exists(arquivos_folder_path):
-        os.makedirs(arquivos_folder_path)
-        print(f"Pasta 'arquivos' criada em: {arquivos_folder_path}")
-
-    extracted_folder_path = os.path.join(arquivos_folder_path, 'extracted')
+    if DB_CREATE_SCHEMA:
+        create_schema()
 
-    if fileName in ['Empresas', 'Estabelecimentos', 'Socios']:
-        while True:
-            # Definir o nome do arquivo e o URL para cada iteração com base no counter
-            zip_file_path = os.path.join(arquivos_folder_path, f"{fileName}_{counter}.zip")
+    month_label = get_month_label(month, year)
+    manifest = get_manifest(month, year, refresh_manifest)
+    if manifest is None:
+        return
+    partitions = list_partitions(fileName, manifest, month_label)
+    if not partitions:
+        print(f"Nenhum arquivo {fileName} pendente em {month}/{year}.")
+        return
 
-            print(f"Verificando se o arquivo {fileName}_{counter}.zip já existe...")
+    for partition in partitions:
+        try:
+            zip_file_path = download_partition(partition, manifest, month_label)
+        except Exception as e:
+            print(f"Erro ao baixar o arquivo {partition}.zip: {str(e)}")
+            return
 
-            # Verifica se o arquivo já foi baixado
-            if os.path.exists(zip_file_path):
-                print(f"O arquivo {fileName}_{counter}.zip já foi baixado. Pulando download.")
-            else:
-                print(f"Baixando arquivo {fileName}_{counter}.zip...")
+        try:
+            metrics.merge(process_partition(fileName, zip_file_path, month_label=month_label, incremental=incremental))
+        except Exception as e:
+            print(f"Erro ao carregar o arquivo {partition}.zip: {e}")
+            return
 
-                url = f'https://arquivos.receitafederal.gov.br/dados/cnpj/dados_abertos_cnpj/{year}-0{month}/{fileName}{counter}.zip'
-                print(f"URL: {url}")
+    if incremental:
+        remove_stale_rows(fileName, month_label)
+    if 'search' in LAYOUTS[get_layout_name(fileName)]:
+        refresh_search_indexes()
+    metrics.report()
 
-                try:
-                    download_with_retries(url, zip_file_path)  # Tenta baixar o arquivo
-                except FileNotFoundError:
-                    print(f"Arquivo {fileName}_{counter}.zip não encontrado, finalizando.")
-                    break  # Sai do loop quando o arquivo não é encontrado (erro 404)
-                except Exception as e:
-                    print(f"Erro ao baixar o arquivo {fileName}_{counter}.zip: {str(e)}")
-                    break
 
-            # Extração e processamento do arquivo baixado
-            try:
-                if not os.path.exists(extracted_folder_path):
-                    os.makedirs(extracted_folder_path)
-                    print(f"Pasta de extração criada em: {extracted_folder_path}")
+def init_worker():
+    """Executado em cada processo do pool: descarta as conexões herdadas do processo pai."""
+    dispose_inherited_connections()
+    configure_logging()
 
-                shutil.unpack_archive(zip_file_path, extracted_folder_path)
-                print(f"Arquivo {zip_file_path} extraído com sucesso.")
 
-            except Exception as e:
-                print(f"Erro ao extrair o arquivo: {e}")
-                return
-
-            extracted_files = os.listdir(extracted_folder_path)
-            print(f"Arquivos extraídos: {extracted_files}")
-            csv_file = None
-            for file in extracted_files:
-                file_path = os.path.join(extracted_folder_path, file)
-                if os.path.isfile(file_path) and file.endswith("CSV") or file.endswith('ESTABELE'):
-                    csv_file = file_path
-                    print(f'CSV encontrado: {csv_file}')
-                    break
-
-            if csv_file is None:
-                print(f"Arquivo CSV não encontrado em {extracted_folder_path}")
-                return
-
-            chunk_size = 100000  # Tamanho da chunk
-
-            # Carregar o CSV original inteiro
-            # Ler o arquivo em chunks e processar cada um
-            for chunk in pd.read_csv(csv_file, encoding="ISO-8859-1", sep=";", chunksize=chunk_size, low_memory=False):
-                chunk.columns = csvHeader
-                corrected_csv_file = os.path.join(arquivos_folder_path, f"{fileName}_chunk_{csv_counter}.csv")
-                chunk.to_csv(corrected_csv_file, index=False, encoding="utf-8", mode='w')
-                print(f"Arquivo corrigido gerado em: {corrected_csv_file}")
-                print(chunk.head())
-                upsertCSVIntoBD(fileName, corrected_csv_file)
-                csv_counter += 1
-                os.remove(corrected_csv_file)
-
-            os.remove(zip_file_path)
-            os.remove(csv_file)
-            print(f"Arquivos {zip_file_path} e {csv_file} excluídos.")
-
-            counter += 1  # Incrementa o counter corretamente para o próximo arquivo
+def upsertFilesBd(month=3, year=2025, incremental=False, refresh_manifest=False):
+    """
+    Processa os arquivos respeitando as dependências entre as tabelas, com download, leitura e carga em paralelo.
 
-    else:
-      zip_file_path = os.path.join(arquivos_folder_path, f"{fileName}.zip")
-      print(f"Verificando se o arquivo {fileName}.zip já existe...")
-
-      if os.path.exists(zip_file_path):
-          print(f"O arquivo {fileName}.zip já foi baixado. Pulando download.")
-      else:
-          print(f"Baixando arquivo {fileName}.zip...")
-          url = f'https://arquivos.receitafederal.gov.br/dados/cnpj/dados_abertos_cnpj/{year}-0{month}/{fileName}.zip'
-          print(f"URL: {url}")
-
-          try:
-              download_with_retries(url, zip_file_path)
-          except Exception as e:
-              print(f"Erro ao baixar o arquivo {fileName}.zip após várias tentativas. {e}")
-              return
-
-      try:
-          if not os.path.exists(extracted_folder_path):
-              os.makedirs(extracted_folder_path)
-              print(f"Pasta de extração criada em: {extracted_folder_path}")
-
-          shutil.unpack_archive(zip_file_path, extracted_folder_path)
-          print(f"Arquivo {zip_file_path} extraído com sucesso.")
-
-      except Exception as e:
-          print(f"Erro ao extrair o arquivo: {e}")
-          return
-
-      extracted_files = os.listdir(extracted_folder_path)
-      print(f"Arquivos extraídos: {extracted_files}")
-      csv_file = None
-      for file in extracted_files:
-          file_path = os.path.join(extracted_folder_path, file)
-          if os.path.isfile(file_path):
-              csv_file = file_path
-              break
-
-      if csv_file is None:
-          print(f"Arquivo CSV não encontrado em {extracted_folder_path}")
-          return
-
-      print(f"Arquivo CSV encontrado: {csv_file}")
-      chunk_size = 100000
-      csv_counter = 1
-      for chunk in pd.read_csv(csv_file, encoding="ISO-8859-1", sep=";", chunksize=chunk_size, low_memory=False):
-          chunk.columns = csvHeader
-          #print(f"Processando chunk com {len(chunk)} linhas")
-          #psertCSVIntoBD(fileName, df=chunk)
-          corrected_csv_file = os.path.join(arquivos_folder_path, f"{fileName}_chunk_{csv_counter}.csv")
-          chunk.to_csv(corrected_csv_file, index=False, encoding="utf-8", mode='w')
-          print(f"Arquivo corrigido gerado em: {corrected_csv_file}")
-          print(chunk.head())
-          upsertCSVIntoBD(fileName, corrected_csv_file)
-          csv_counter += 1
-          os.remove(corrected_csv_file)
-
-      os.remove(zip_file_path)
-      os.remove(csv_file)
-      print(f"Arquivos {zip_file_path} e {csv_file} excluídos.")
-
-
-def file_exists(url):
-    """Verifica se o arquivo existe na URL."""
-    try:
-        response = requests.head(url)
-        return response.status_code == 200
-    except requests.exceptions.RequestException:
-        return False
+    :param refresh_manifest: Consulta o manifesto do mês no servidor, mesmo que haja um salvo.
+    """
+    configure_logging()
+    start_metrics_server()
+    if DB_CREATE_SCHEMA:
+        create_schema()
+
+    month_label = get_month_label(month, year)
+    manifest = get_manifest(month, year, refresh_manifest)
+    if manifest is None:
+        return
+    errors = run_schedule(
+        ORDER_OF_FILES,
+        partial(list_partitions, manifest=manifest, month_label=month_label),
+        partial(download_partition, manifest=manifest, month_label=month_label),
+        partial(process_partition, month_label=month_label, incremental=incremental),
+        initializer=init_worker
+    )
+    for file_name, file_errors in errors.items():
+        for error in file_errors:
+            print(f"Falha ao carregar {file_name}: {error}")
+        if incremental and not file_errors:
+            remove_stale_rows(file_name, month_label)
+    refresh_search_indexes()
+    metrics.report()
+
+
+def fullRefreshBd(month=3, year=2025, file_names=FULL_REFRESH_FILES, refresh_manifest=False):
+    """
+    Carga completa das tabelas grandes: cada tabela é carregada em uma tabela nova, sem índices, que recebe
+    os índices e restrições ao final e, junto com as tabelas derivadas e os checkpoints do arquivo no mês,
+    substitui a atual em uma única transação (ver bulkload.swap_tables). Até a troca, as consultas continuam
+    vendo os dados do mês anterior. O índice de impressões digitais da carga incremental é recriado com os
+    registros carregados. Uma carga interrompida recomeça do início da tabela.
+
+    :param file_names: Arquivos a recarregar (padrão: FULL_REFRESH_FILES).
+    :param refresh_manifest: Consulta o manifesto do mês no servidor, mesmo que haja um salvo.
+    """
+    configure_logging()
+    if DB_CREATE_SCHEMA:
+        create_schema()
 
+    month_label = get_month_label(month, year)
+    manifest = get_manifest(month, year, refresh_manifest)
+    if manifest is None:
+        return
+    lookups.refresh(domain_version(month_label))
+    for fileName in topological_order(file_names):
+        refresh = TableRefresh(LAYOUTS[fileName]['model'])
+        # As tabelas derivadas (ex.: CNAEs secundários) são recarregadas junto com a tabela principal
+        refreshes = [refresh, *(TableRefresh(child) for child in LAYOUTS[fileName].get('children', []))]
+        partitions = partitions_for(manifest, fileName)
+        try:
+            remove_fingerprint_index(fingerprint_index_path(fileName, refresh=True))
+            for table_refresh in refreshes:
+                table_refresh.prepare()
+            target_tables = {table_refresh.table: table_refresh.refresh_table for table_refresh in refreshes}
+            for partition in partitions:
+                zip_file_path = download_partition(partition, manifest, month_label)
+                metrics.merge(process_partition(fileName, zip_file_path, month_label=month_label, target_tables=target_tables))
+            for table_refresh in refreshes:
+                table_refresh.finish()
+            # Tabela principal, derivadas e checkpoints do arquivo no mês mudam juntos, em uma transação
+            swap_tables(refreshes, month_label, fileName, partitions)
+        except Exception as e:
+            print(f"Erro na carga completa de {fileName}: {e}")
+            for table_refresh in refreshes:
+                table_refresh.discard()
+            remove_fingerprint_index(fingerprint_index_path(fileName, refresh=True))
+            return
+        replace_fingerprint_index(fileName)
+    metrics.report()
 
 
+def reloadSnapshotBd(month=3, year=2025):
+    """
+    Recarrega o banco a partir da cópia em Parquet do mês (SNAPSHOT_FOLDER), sem baixar os arquivos
+    da Receita. As tabelas são gravadas respeitando as dependências entre elas. Como na carga dos arquivos,
+    os registros recusados vão para IngestionRejects; uma tabela com erro não impede a carga das seguintes.
 
-def upsertFilesBd():
-    "Processa os arquivos na ordem definida"
-    order_of_files = [
-        #'Naturezas',
-        #'Qualificacoes',
-        #'Paises',
-        #'Municipios',
-        #'Cnaes',
-        #'Empresas',
-        #'Estabelecimentos',
-        'Simples',
-        #'Socios'
-    ]
+    :return: Erros de cada arquivo (nome do arquivo -> lista de mensagens; vazia quando tudo foi gravado).
+    """
+    configure_logging()
+    if DB_CREATE_SCHEMA:
+        create_schema()
+
+    month_label = get_month_label(month, year)
+    order = topological_order(ORDER_OF_FILES)
+    errors = {fileName: [] for fileName in order}
+    for fileName in order:
+        model = LAYOUTS[fileName]['model']
+        table_name = model.__tablename__
+        inserted_count = 0
+        try:
+            for frame in read_snapshot(month_label, model):
+                frame, rejected, reasons = split_invalid_rows(model, frame)
+                children = to_child_frames(fileName, frame)
+                with session_scope() as session:
+                    load = partial(load_frame, session, model, children=children)
+                    written, refused, load_errors = load_with_bisect(session, frame, load)
+                    inserted_count += written
+                    save_rejects(
+                        session, table_name, pd.concat([rejected, refused]), reasons + load_errors,
+                        month=month_label, file_name=fileName
+                    )
+        except Exception as e:
+            errors[fileName].append(str(e))
+            log_event(
+                'file_failed', logging.ERROR, file_name=fileName, table=table_name, rows_written=inserted_count,
+                error=str(e), source='snapshot'
+            )
+            continue
+        log_event('file_loaded', file_name=fileName, table=table_name, rows_written=inserted_count, source='snapshot')
+    refresh_search_indexes()
+    metrics.report()
+    return errors
+
+
+def upsertFilesBdAsync(month=3, year=2025, refresh_manifest=False):
+    """
+    Alternativa a upsertFilesBd em um único processo com asyncio: os downloads, a leitura/normalização
+    (em threads) e vários COPY simultâneos (asyncpg) acontecem ao mesmo tempo.
+    Usa os mesmos checkpoints, então uma carga interrompida pode ser retomada por qualquer um dos dois.
 
-    for file_name in order_of_files:
-        getFiles(file_name, 3, 2025)
+    :param refresh_manifest: Consulta o manifesto do mês no servidor, mesmo que haja um salvo.
+    """
+    configure_logging()
+    start_metrics_server()
+    if DB_CREATE_SCHEMA:
+        create_schema()
 
-upsertFilesBd()
+    manifest = get_manifest(month, year, refresh_manifest)
+    if manifest is None:
+        return
+    loader = AsyncMonthLoader(manifest, get_month_label(month, year), ARQUIVOS_FOLDER_PATH)
+    errors = asyncio.run(loader.run(ORDER_OF_FILES))
+    for file_name, file_errors in errors.items():
+        for error in file_errors:
+            print(f"Falha ao carregar {file_name}: {error}")
+    refresh_search_indexes()
+    metrics.report()
+
+if __name__ == '__main__':
+    upsertFilesBd()
@@ -0,0 +1,280 @@
+import io
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG mostra um evento por lote
+METRICS_PORT = os.getenv('METRICS_PORT')  # Porta do endpoint Prometheus (desligado se não definida)
+
+# Limites (em segundos) dos buckets dos histogramas de latência (commit da carga e respostas da API)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Etapas medidas: download, extract (descompressão do ZIP), parse (leitura do CSV),
+# normalize (normalização e conversão para as colunas da tabela), load (COPY + merge no banco)
+# e snapshot (cópia opcional em Parquet)
+STAGES = ('download', 'extract', 'parse', 'normalize', 'load', 'snapshot')
+
+logger = logging.getLogger('cnpj.pipeline')
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por evento, com os campos passados em log_event."""
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'event': record.getMessage(),
+            'pid': record.process,
+        }
+        payload.update(getattr(record, 'fields', {}))
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=LOG_LEVEL):
+    """Envia os eventos do pipeline para a saída padrão, em JSON (chamada uma vez por processo)."""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Registra um evento estruturado (ex.: log_event('batch_loaded', table='Companies', rows=100000)).
+
+    :param event: Nome do evento.
+    :param level: Nível do log (logging.INFO, logging.DEBUG, ...).
+    :param fields: Campos do evento.
+    """
+    logger.log(level, event, extra={'fields': fields})
+
+
+def current_rss():
+    """Memória residente atual do processo, em bytes (pico do processo se /proc não estiver disponível)."""
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Metrics:
+    """
+    Métricas do pipeline por etapa: registros, bytes e tempo gasto (para registros/s e bytes/s),
+    pico de memória residente observado, contadores (ex.: tentativas repetidas) e histogramas
+    (ex.: latência de commit). Seguro para uso por várias threads; cada processo tem a sua instância
+    e os workers devolvem snapshot() para serem somados no processo principal com merge().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}  # (etapa, tabela) -> {'rows', 'bytes', 'seconds', 'peak_rss'}
+            self.counters = {}  # nome -> valor
+            self.histograms = {}  # nome -> {'buckets': [...], 'count', 'sum'}
+
+    def add(self, stage, seconds, rows=0, nbytes=0, table=''):
+        """
+        Soma o tempo gasto, os registros e os bytes processados em uma etapa.
+
+        :param stage: Etapa (ver STAGES).
+        :param seconds: Tempo gasto.
+        :param rows: Registros processados.
+        :param nbytes: Bytes processados.
+        :param table: Tabela de destino (opcional).
+        """
+        rss = current_rss()
+        with self.lock:
+            totals = self.stages.setdefault((stage, table), {'rows': 0, 'bytes': 0, 'seconds': 0.0, 'peak_rss': 0})
+            totals['rows'] += rows
+            totals['bytes'] += nbytes
+            totals['seconds'] += seconds
+            totals['peak_rss'] = max(totals['peak_rss'], rss)
+
+    @contextmanager
+    def timer(self, stage, rows=0, nbytes=0, table=''):
+        """Mede o bloco como tempo gasto na etapa (ex.: with metrics.timer('load', rows=len(frame)): ...)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, rows, nbytes, table)
+
+    def increment(self, name, value=1):
+        """Soma 'value' ao contador (ex.: 'batch_retries')."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Registra um valor no histograma (ex.: latência de commit em segundos)."""
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                name, {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0}
+            )
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    def snapshot(self, reset=False):
+        """Cópia das métricas em tipos simples (serializável entre processos), opcionalmente zerando-as."""
+        with self.lock:
+            data = {
+                'stages': [
+                    {'stage': stage, 'table': table, **totals} for (stage, table), totals in self.stages.items()
+                ],
+                'counters': dict(self.counters),
+                'histograms': {
+                    name: {'buckets': list(h['buckets']), 'count': h['count'], 'sum': h['sum']}
+                    for name, h in self.histograms.items()
+                },
+            }
+        if reset:
+            self.reset()
+        return data
+
+    def merge(self, data):
+        """Soma um snapshot (ex.: de um processo worker) às métricas deste processo."""
+        with self.lock:
+            for entry in data['stages']:
+                totals = self.stages.setdefault(
+                    (entry['stage'], entry['table']), {'rows': 0, 'bytes': 0, 'seconds': 0.0, 'peak_rss': 0}
+                )
+                totals['rows'] += entry['rows']
+                totals['bytes'] += entry['bytes']
+                totals['seconds'] += entry['seconds']
+                totals['peak_rss'] = max(totals['peak_rss'], entry['peak_rss'])
+            for name, value in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, h in data['histograms'].items():
+                histogram = self.histograms.setdefault(
+                    name, {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0}
+                )
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], h['buckets'])]
+                histogram['count'] += h['count']
+                histogram['sum'] += h['sum']
+
+    def report(self, event='pipeline_metrics'):
+        """Registra um evento com o resumo de cada etapa (registros/s, MB/s, pico de memória) e os contadores."""
+        data = self.snapshot()
+        for entry in sorted(data['stages'], key=lambda e: (STAGES.index(e['stage']) if e['stage'] in STAGES else 99, e['table'])):
+            seconds = entry['seconds']
+            log_event(
+                event,
+                stage=entry['stage'],
+                table=entry['table'] or None,
+                rows=entry['rows'],
+                seconds=round(seconds, 3),
+                rows_per_second=round(entry['rows'] / seconds) if seconds > 0 else 0,
+                mb_per_second=round(entry['bytes'] / 1024 ** 2 / seconds, 2) if seconds > 0 else 0,
+                peak_rss_mb=round(entry['peak_rss'] / 1024 ** 2, 1),
+            )
+        for name, h in data['histograms'].items():
+            log_event(event, histogram=name, count=h['count'],
+                      mean_seconds=round(h['sum'] / h['count'], 4) if h['count'] else 0)
+        if data['counters']:
+            log_event(event, **data['counters'])
+
+    def render_prometheus(self):
+        """Métricas no formato texto do Prometheus."""
+        data = self.snapshot()
+        out = io.StringIO()
+
+        def labels(entry):
+            text = f'stage="{entry["stage"]}"'
+            return text + (f',table="{entry["table"]}"' if entry['table'] else '')
+
+        for metric, field, help_text in (
+            ('cnpj_stage_rows_total', 'rows', 'Registros processados por etapa'),
+            ('cnpj_stage_bytes_total', 'bytes', 'Bytes processados por etapa'),
+            ('cnpj_stage_seconds_total', 'seconds', 'Tempo gasto por etapa'),
+            ('cnpj_stage_peak_rss_bytes', 'peak_rss', 'Pico de memória residente observado na etapa'),
+        ):
+            kind = 'gauge' if field == 'peak_rss' else 'counter'
+            out.write(f'# HELP {metric} {help_text}\n# TYPE {metric} {kind}\n')
+            for entry in data['stages']:
+                out.write(f'{metric}{{{labels(entry)}}} {entry[field]}\n')
+
+        for name, value in sorted(data['counters'].items()):
+            out.write(f'# TYPE cnpj_{name}_total counter\ncnpj_{name}_total {value}\n')
+
+        for name, h in sorted(data['histograms'].items()):
+            out.write(f'# TYPE cnpj_{name} histogram\n')
+            for bound, count in zip(LATENCY_BUCKETS, h['buckets']):
+                out.write(f'cnpj_{name}_bucket{{le="{bound}"}} {count}\n')
+            out.write(f'cnpj_{name}_bucket{{le="+Inf"}} {h["count"]}\n')
+            out.write(f'cnpj_{name}_sum {h["sum"]}\ncnpj_{name}_count {h["count"]}\n')
+        return out.getvalue()
+
+
+metrics = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Evita uma linha de log a cada coleta do Prometheus
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """
+    Sobe o endpoint /metrics (formato Prometheus) em uma thread, se uma porta foi configurada.
+
+    :param port: Porta HTTP (METRICS_PORT); None desliga o endpoint.
+    :return: Servidor HTTP ou None.
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('0.0.0.0', int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log_event('metrics_server_started', port=int(port))
+    return server
+
+
+class TimedReader(io.RawIOBase):
+    """
+    Envolve um arquivo binário (ex.: membro de um ZIP) e acumula o tempo gasto e os bytes lidos dele,
+    para separar a descompressão (etapa 'extract') do tempo de leitura do CSV (etapa 'parse').
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.seconds = 0.0
+        self.bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        start = time.perf_counter()
+        data = self.raw.read(len(buffer))
+        self.seconds += time.perf_counter() - start
+        self.bytes += len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.raw.close()
+        super().close()
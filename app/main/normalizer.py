@@ -0,0 +1,277 @@
+import numpy as np
+import pandas as pd
+from documents import compose_cnpj, zero_pad
+from layouts import LAYOUTS
+
+# Valores tratados como nulos (mesma regra do antigo safe_get)
+MISSING_VALUES = ["nan", "NaN", "None", ""]
+
+# Especificação de normalização de cada layout: cabeçalho da Receita -> tipo de tratamento.
+# Colunas não listadas são repassadas como vieram do arquivo ('raw').
+#   text    -> texto sem espaços nas pontas, nulos viram 'default'
+#   digits  -> somente dígitos; 'strip_zeros' remove zeros à esquerda (antigo int(float(x)))
+#   decimal -> número com vírgula decimal (e pontos de milhar) convertido para o formato aceito pelo Numeric;
+#              valores que não são números viram nulo
+#   date    -> YYYYMMDD convertido para datetime, valores inválidos viram nulo
+#   country -> código do país sem zeros à esquerda, padrão 105 (Brasil)
+NORMALIZATION_SPECS = {
+    'Empresas': {
+        'CNPJ BASICO': {'kind': 'text', 'default': None},
+        'QUALIFICACAO DO RESPONSAVEL': {'kind': 'text', 'default': '00'},
+        'CAPITAL SOCIAL DA EMPRESA': {'kind': 'decimal', 'default': '0'},
+    },
+    'Estabelecimentos': {
+        'CNPJ BASICO': {'kind': 'text', 'default': None},
+        'CNPJ ORDEM': {'kind': 'text'},
+        'CNPJ DV': {'kind': 'text'},
+        'IDENTIFICADOR MATRIZ/FILIAL': {'kind': 'text'},
+        'NOME FANTASIA': {'kind': 'text'},
+        'SITUACAO CADASTRAL': {'kind': 'text'},
+        'DATA SITUACAO CADASTRAL': {'kind': 'date'},
+        'MOTIVO SITUACAO CADASTRAL': {'kind': 'text'},
+        'NOME DA CIDADE NO EXTERIOR': {'kind': 'text'},
+        'PAIS': {'kind': 'country', 'default': '105'},
+        'DATA DE INICIO DE ATIVIDADE': {'kind': 'date'},
+        'CNAE FISCAL PRINCIPAL': {'kind': 'text'},
+        'CNAE FISCAL SECUNDARIA': {'kind': 'text', 'default': None},
+        'TIPO DE LOGRADOURO': {'kind': 'text'},
+        'LOGRADOURO': {'kind': 'text'},
+        'NUMERO': {'kind': 'text'},
+        'COMPLEMENTO': {'kind': 'text'},
+        'BAIRRO': {'kind': 'text'},
+        'CEP': {'kind': 'digits', 'default': '0', 'strip_zeros': True},
+        'UF': {'kind': 'text'},
+        'MUNICIPIO': {'kind': 'text'},
+        'DDD 1': {'kind': 'digits', 'default': '0'},
+        'TELEFONE 1': {'kind': 'digits', 'default': '0', 'strip_zeros': True},
+        'DDD 2': {'kind': 'digits', 'default': '0'},
+        'TELEFONE 2': {'kind': 'digits', 'default': '0', 'strip_zeros': True},
+        'DDD DO FAX': {'kind': 'text'},
+        'FAX': {'kind': 'digits', 'default': '0', 'strip_zeros': True},
+        'CORREIO ELETRONICO': {'kind': 'text'},
+        'SITUACAO ESPECIAL': {'kind': 'text'},
+        'DATA DA SITUACAO ESPECIAL': {'kind': 'date'},
+    },
+    'Socios': {
+        # Colunas da chave primária (CNPJ básico + documento + qualificação do sócio)
+        'CNPJ BASICO': {'kind': 'text', 'default': None},
+        'CNPJ/CPF DO SOCIO': {'kind': 'text'},
+        'QUALIFICACAO DO SOCIO': {'kind': 'text', 'default': '00'},
+        'DATA DE ENTRADA SOCIEDADE': {'kind': 'date'},
+    },
+    'Simples': {
+        'CNPJ BASICO': {'kind': 'text', 'default': None},
+        'DATA DE OPCAO PELO SIMPLES': {'kind': 'date'},
+        'DATA DE EXCLUSAO DO SIMPLES': {'kind': 'date'},
+        'DATA DE OPCAO PELO MEI': {'kind': 'date'},
+        'DATA DE EXCLUSAO DO MEI': {'kind': 'date'},
+    },
+}
+
+# Nome já no formato da busca (ver normalize_search_text)
+SEARCH_TEXT_PATTERN = r'[0-9A-Z]+(?: [0-9A-Z]+)*'
+
+# Tabelas de domínio (Cnaes, Naturezas, Qualificacoes, Municipios, Paises, Motivos)
+LOOKUP_SPEC = {
+    'CODIGO': {'kind': 'text', 'default': None},
+}
+
+
+def as_text(values):
+    """
+    Coluna como texto. Colunas já em um tipo de texto do pandas (ex.: lidas pelo PyArrow) são mantidas,
+    para que as operações de texto rodem no formato colunar, sem criar um objeto Python por registro.
+    """
+    if isinstance(values.dtype, pd.StringDtype):
+        return values
+    return values.astype(str)
+
+
+def normalize_text(values, default=''):
+    """Texto sem espaços nas pontas; "nan", "None", vazio e nulos viram o valor padrão."""
+    text = as_text(values)
+    missing = values.isna() | text.isin(MISSING_VALUES)
+    return text.str.strip().where(~missing, default)
+
+
+def normalize_digits(values, default='0', strip_zeros=False):
+    """Remove tudo que não for dígito; valores que ficarem vazios viram o valor padrão."""
+    digits = as_text(values).where(values.notna(), '').str.replace(r'\D', '', regex=True)
+    if strip_zeros:
+        digits = digits.str.lstrip('0')
+    return digits.where(digits != '', default)
+
+
+def normalize_decimal(values, default='0'):
+    """
+    Converte '1.234,56' no formato do Numeric ('1234.56'): os pontos de milhar são removidos e a vírgula
+    decimal vira ponto. Valores vazios viram o valor padrão; valores que não são números viram nulo
+    (e o registro é recusado antes do COPY se a coluna for NOT NULL, ver rejects.invalid_rows).
+    """
+    text = as_text(values).str.replace(' ', '', regex=False)
+    missing = values.isna() | text.isin(MISSING_VALUES)
+    numbers = text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    valid = numbers.str.fullmatch(r'-?\d+(\.\d+)?').fillna(False).astype(bool)
+    return numbers.astype(object).where(valid, None).where(~missing, default)
+
+
+def normalize_date(values):
+    """Converte YYYYMMDD em datetime com um único to_datetime; inválidos e '00000000' viram NaT."""
+    text = as_text(values)
+    # O formato %Y%m%d aceita meses e dias com um dígito ('2025031' -> 1º de março): só 8 caracteres valem
+    valid = values.notna() & (text.str.len() == 8)
+    return pd.to_datetime(text.where(valid), format='%Y%m%d', errors='coerce')
+
+
+def normalize_country(values, default='105'):
+    """Código do país somente com dígitos e sem zeros à esquerda; valores inválidos viram o padrão (105)."""
+    text = as_text(values).str.strip()
+    valid = values.notna() & text.str.fullmatch(r'\d+')
+    codes = text.str.lstrip('0').replace('', '0')
+    return codes.where(valid, default)
+
+
+def normalize_search_text(values):
+    """
+    Nome no formato usado pela busca: sem acentos, em maiúsculas e só com letras e dígitos separados
+    por um espaço ('Padaria São José Ltda.' -> 'PADARIA SAO JOSE LTDA'). Nomes vazios viram nulo.
+    O termo buscado passa pela mesma função (ver search.py).
+
+    A maior parte dos nomes da Receita já está nesse formato depois do upper; só os demais passam pela
+    decomposição Unicode (NFKD) e pelas substituições, que são as etapas mais lentas.
+    """
+    text = as_text(values)
+    missing = values.isna() | text.isin(MISSING_VALUES)
+    text = text.where(~missing, '').str.upper()
+    pending = ~text.str.fullmatch(SEARCH_TEXT_PATTERN).astype(bool)
+    cleaned = (
+        text[pending].str.normalize('NFKD')
+        .str.replace(r'[\u0300-\u036f]', '', regex=True)  # Acentos separados da letra pelo NFKD
+        .str.replace(r'[^0-9A-Z]+', ' ', regex=True)
+        .str.strip()
+    )
+    text = text.astype(object).mask(pending, cleaned.astype(object))
+    return text.where(text != '', None)
+
+
+def normalize_categorical(values, spec):
+    """
+    Normaliza uma coluna categórica tratando só as categorias (poucos valores distintos)
+    e remontando a coluna pelos códigos, sem converter cada registro para texto.
+    """
+    categories = normalize_column(pd.Series(values.cat.categories, dtype=object), spec).to_numpy(dtype=object)
+    missing = normalize_column(pd.Series([None], dtype=object), spec).iloc[0]
+    codes = values.cat.codes.to_numpy()
+    result = np.full(len(values), missing, dtype=object)
+    present = codes >= 0
+    result[present] = categories[codes[present]]
+    return pd.Series(pd.Categorical(result), index=values.index)
+
+
+def normalize_column(values, spec):
+    """Aplica o tratamento descrito em 'spec' a uma coluna inteira."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return normalize_categorical(values, spec)
+    kind = spec['kind']
+    if kind == 'text':
+        return normalize_text(values, spec.get('default', ''))
+    if kind == 'digits':
+        return normalize_digits(values, spec.get('default', '0'), spec.get('strip_zeros', False))
+    if kind == 'decimal':
+        return normalize_decimal(values, spec.get('default', '0'))
+    if kind == 'date':
+        return normalize_date(values)
+    if kind == 'country':
+        return normalize_country(values, spec.get('default', '105'))
+    raise ValueError(f"Tipo de normalização desconhecido: {kind}")
+
+
+def get_normalization_spec(layout_name):
+    """Especificação de normalização do layout (tabelas de domínio compartilham a mesma)."""
+    return NORMALIZATION_SPECS.get(layout_name, LOOKUP_SPEC)
+
+
+def normalize_frame(layout_name, frame):
+    """
+    Normaliza um DataFrame com os cabeçalhos da Receita, uma passada vetorizada por coluna.
+
+    As colunas são substituídas no próprio DataFrame recebido, que também é retornado.
+
+    :param layout_name: Chave do layout em LAYOUTS.
+    :param frame: DataFrame lido do arquivo da Receita.
+    """
+    for column, spec in get_normalization_spec(layout_name).items():
+        if column in frame.columns:
+            frame[column] = normalize_column(frame[column], spec)
+    return frame
+
+
+def to_table_frame(layout_name, frame, date):
+    """
+    Converte um DataFrame normalizado no DataFrame com as colunas da tabela de destino.
+
+    :param layout_name: Chave do layout em LAYOUTS.
+    :param frame: DataFrame normalizado, com os cabeçalhos da Receita.
+    :param date: Data usada em updated_at.
+    """
+    columns = LAYOUTS[layout_name]['columns']
+    table_frame = pd.DataFrame(
+        {
+            table_column: frame[csv_column] if csv_column in frame.columns else None
+            for table_column, csv_column in columns.items()
+        },
+        index=frame.index
+    )
+
+    if 'base_cnpj' in table_frame.columns:
+        # Mesmo formato (8 caracteres) em todas as tabelas, para que as junções pelo CNPJ básico funcionem
+        table_frame['base_cnpj'] = zero_pad(table_frame['base_cnpj'], 8)
+    if layout_name == 'Estabelecimentos':
+        # Chave de 14 caracteres; os DVs são conferidos antes do COPY (ver rejects.invalid_rows)
+        table_frame['cnpj'] = compose_cnpj(frame['CNPJ BASICO'], frame['CNPJ ORDEM'], frame['CNPJ DV'])
+
+    for search_column, table_column in LAYOUTS[layout_name].get('search', {}).items():
+        table_frame[search_column] = normalize_search_text(table_frame[table_column])
+
+    table_frame['updated_at'] = date
+    return table_frame
+
+
+def secondary_cnae_frame(table_frame):
+    """
+    Um registro por CNAE secundário de cada estabelecimento: a lista separada por vírgulas de
+    cnae_secondary é dividida de uma vez para o lote inteiro (str.split + explode).
+    O índice de cada registro é o do estabelecimento no lote.
+
+    :param table_frame: DataFrame de Establishments (ver to_table_frame).
+    """
+    cnaes = as_text(table_frame['cnae_secondary'].dropna()).str.split(',').explode().str.strip()
+    cnaes = cnaes[cnaes.notna() & ~cnaes.isin(MISSING_VALUES)]
+    return pd.DataFrame(
+        {
+            'cnpj': table_frame['cnpj'].reindex(cnaes.index),
+            'cnae': cnaes.astype(object),
+            'uf': table_frame['uf'].reindex(cnaes.index).astype(object),
+        },
+        index=cnaes.index
+    )
+
+
+# Montagem de cada tabela derivada (LAYOUTS[...]['children']) a partir da tabela principal
+CHILD_FRAMES = {
+    'EstablishmentSecondaryCnaes': secondary_cnae_frame,
+}
+
+
+def to_child_frames(layout_name, table_frame):
+    """
+    DataFrames das tabelas derivadas do layout (ex.: CNAEs secundários dos estabelecimentos).
+
+    :param layout_name: Chave do layout em LAYOUTS.
+    :param table_frame: DataFrame da tabela principal (ver to_table_frame).
+    :return: Dicionário classe mapeada -> DataFrame (vazio se o layout não tiver tabelas derivadas).
+    """
+    return {
+        child: CHILD_FRAMES[child.__tablename__](table_frame)
+        for child in LAYOUTS[layout_name].get('children', [])
+    }
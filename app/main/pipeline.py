@@ -0,0 +1,312 @@
+import io
+import os
+import time
+import zipfile
+import pandas as pd
+from layouts import LAYOUTS
+from metrics import TimedReader, current_rss, metrics
+from normalizer import normalize_frame
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:  # PyArrow é opcional; sem ele os arquivos são lidos pelo pandas
+    pa = None
+
+BATCH_SIZE = 100000  # Quantidade de registros por lote
+MIN_BATCH_SIZE = 5000  # Menor lote usado quando a memória está no limite
+READ_BUFFER_SIZE = 1024 * 1024  # Bytes descompactados do ZIP por leitura
+
+# Leitor dos CSVs: 'pandas' (padrão) ou 'pyarrow' (leitura multithread; as colunas de texto ficam no
+# formato colunar do Arrow até o COPY). Sem o PyArrow instalado, o pandas é usado.
+PARSE_BACKEND = os.getenv('PARSE_BACKEND', 'pandas')
+PARSE_BACKENDS = ('pandas', 'pyarrow')
+ARROW_BLOCK_SIZE = 4 * 1024 * 1024  # Bytes lidos por bloco pelo PyArrow (cada bloco é lido por uma thread)
+# Valores lidos como nulos pelo PyArrow: os mesmos do pandas (read_csv)
+ARROW_NULL_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+    'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+]
+
+# Limite de memória residente de cada processo de leitura, em MB (0 = lotes de tamanho fixo).
+# Ex.: worker de 8 GB com PARSE_WORKERS=2 -> MEMORY_LIMIT_MB=3000
+MEMORY_LIMIT_MB = int(os.getenv('MEMORY_LIMIT_MB', '0'))
+# Memória ocupada por registro durante a carga em relação ao lote lido
+# (lote lido + colunas normalizadas + DataFrame da tabela + CSV do COPY)
+BATCH_MEMORY_FACTOR = 4
+BATCH_SIZE_REVIEW_INTERVAL = 10  # Lotes entre as reavaliações do tamanho de cada registro
+
+# Colunas de códigos com poucos valores distintos, lidas como categorias (o texto de cada código
+# fica guardado uma única vez). As demais colunas são lidas como texto, para não perder zeros à esquerda.
+CATEGORY_COLUMNS = {
+    'Empresas': ['NATUREZA JURIDICA', 'QUALIFICACAO DO RESPONSAVEL', 'PORTE DA EMPRESA', 'ENTE FEDERATIVO RESPONSÁVEL'],
+    'Estabelecimentos': [
+        'IDENTIFICADOR MATRIZ/FILIAL', 'SITUACAO CADASTRAL', 'MOTIVO SITUACAO CADASTRAL', 'PAIS',
+        'CNAE FISCAL PRINCIPAL', 'TIPO DE LOGRADOURO', 'UF', 'MUNICIPIO', 'DDD 1', 'DDD 2', 'DDD DO FAX',
+        'SITUACAO ESPECIAL'
+    ],
+    'Socios': [
+        'IDENTIFICADOR DE SOCIO', 'QUALIFICACAO DO SOCIO', 'PAIS', 'QUALIFICACAO DO REPRESENTANTE LEGAL', 'FAIXA ETARIA'
+    ],
+    'Simples': ['OPCAO PELO SIMPLES', 'OPCAO PELO MEI'],
+}
+
+
+def layout_dtypes(layout_name):
+    """
+    Tipos de leitura de cada coluna do layout, pela posição no arquivo (os arquivos não têm cabeçalho).
+    Códigos viram categorias; identificadores, textos e datas são lidos como texto (as datas viram
+    datetime na normalização).
+    """
+    categories = set(CATEGORY_COLUMNS.get(layout_name, []))
+    return {
+        position: 'category' if column in categories else str
+        for position, column in enumerate(LAYOUTS[layout_name]['header'])
+    }
+
+
+def resolve_backend(backend=None):
+    """
+    Leitor a ser usado: o informado, PARSE_BACKEND ou o pandas quando o PyArrow não está instalado.
+
+    :param backend: 'pandas' ou 'pyarrow' (opcional).
+    """
+    backend = (backend or PARSE_BACKEND).lower()
+    if backend not in PARSE_BACKENDS:
+        raise ValueError(f"Leitor desconhecido: {backend} (use {' ou '.join(PARSE_BACKENDS)})")
+    if backend == 'pyarrow' and pa is None:
+        print("PyArrow não instalado; os arquivos serão lidos pelo pandas")
+        return 'pandas'
+    return backend
+
+
+class ArrowBatchReader:
+    """
+    Lê o CSV da Receita com o leitor multithread do PyArrow, entregando lotes como o get_chunk do pandas.
+
+    Os tipos seguem layout_dtypes: categorias viram colunas de dicionário (Categorical no pandas) e o texto
+    fica em colunas string[pyarrow], sem criar um objeto Python por registro.
+    """
+
+    def __init__(self, binary_file, dtype, skip_rows=0):
+        """
+        :param binary_file: Caminho ou arquivo aberto em modo binário.
+        :param dtype: Tipos de cada coluna pela posição (ver layout_dtypes).
+        :param skip_rows: Registros iniciais a ignorar.
+        """
+        names = [str(position) for position in dtype]
+        self.columns = list(dtype)
+        self.reader = pa_csv.open_csv(
+            binary_file,
+            read_options=pa_csv.ReadOptions(
+                column_names=names, encoding='ISO-8859-1', skip_rows=skip_rows, block_size=ARROW_BLOCK_SIZE
+            ),
+            parse_options=pa_csv.ParseOptions(delimiter=';'),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={
+                    name: pa.dictionary(pa.int32(), pa.string()) if kind == 'category' else pa.string()
+                    for name, kind in zip(names, dtype.values())
+                },
+                strings_can_be_null=True,
+                null_values=ARROW_NULL_VALUES,
+            ),
+        )
+        self.pending = []  # Blocos lidos e ainda não entregues
+        self.pending_rows = 0
+        self.rows_read = 0
+
+    def get_chunk(self, size):
+        """Próximo lote com até 'size' registros; StopIteration ao fim do arquivo."""
+        while self.pending_rows < size:
+            try:
+                record_batch = self.reader.read_next_batch()
+            except StopIteration:
+                break
+            self.pending.append(record_batch)
+            self.pending_rows += record_batch.num_rows
+        if not self.pending_rows:
+            raise StopIteration
+
+        table = pa.Table.from_batches(self.pending)
+        remainder = table.slice(size)
+        self.pending = remainder.to_batches()
+        self.pending_rows = remainder.num_rows
+
+        frame = table.slice(0, size).to_pandas(types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get)
+        frame.columns = self.columns
+        frame.index = pd.RangeIndex(self.rows_read, self.rows_read + len(frame))
+        self.rows_read += len(frame)
+        return frame
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BatchSizer:
+    """
+    Ajusta o tamanho dos lotes para que a carga de um lote caiba no limite de memória do processo.
+
+    O tamanho de cada registro é medido nos lotes lidos e o próximo lote é dimensionado para a
+    memória que ainda resta abaixo do limite, entre MIN_BATCH_SIZE e o tamanho configurado.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, memory_limit_mb=MEMORY_LIMIT_MB):
+        self.max_size = batch_size
+        self.size = batch_size
+        self.memory_limit = memory_limit_mb * 1024 ** 2
+        self.baseline = current_rss()
+        self.row_bytes = None
+        self.batches = 0
+
+    def next_size(self, batch):
+        """Tamanho do próximo lote, a partir do lote que acabou de ser lido."""
+        if not self.memory_limit or batch.empty:
+            return self.size
+
+        if self.row_bytes is None or self.batches % BATCH_SIZE_REVIEW_INTERVAL == 0:
+            self.row_bytes = batch.memory_usage(deep=True).sum() / len(batch)
+        self.batches += 1
+
+        budget = self.memory_limit - self.baseline
+        size = int(budget / (self.row_bytes * BATCH_MEMORY_FACTOR))
+        if current_rss() > self.memory_limit:
+            # Acima do limite (ex.: memória ainda não devolvida ao sistema): reduz pela metade
+            size = min(size, self.size // 2)
+        self.size = max(MIN_BATCH_SIZE, min(self.max_size, size))
+        return self.size
+
+
+def read_batches(csv_file, batch_size=BATCH_SIZE, skip_rows=0, source=None, dtype=str,
+                 memory_limit_mb=MEMORY_LIMIT_MB, backend='pandas'):
+    """
+    Lê o arquivo da Receita (ISO-8859-1, separado por ';', sem cabeçalho) em lotes de DataFrames.
+
+    :param csv_file: Caminho ou arquivo aberto com os dados.
+    :param batch_size: Quantidade de registros por lote (máximo, quando há limite de memória).
+    :param skip_rows: Registros iniciais a ignorar (já gravados em uma execução anterior).
+    :param source: TimedReader do arquivo compactado; o tempo de descompressão é medido à parte
+        da leitura do CSV (opcional).
+    :param dtype: Tipos de leitura das colunas (ver layout_dtypes); padrão: tudo texto.
+    :param memory_limit_mb: Limite de memória do processo; o tamanho dos lotes é ajustado para
+        respeitá-lo (0 = lotes de tamanho fixo).
+    :param backend: Leitor ('pandas' ou 'pyarrow'). O PyArrow exige um arquivo binário (ou caminho)
+        e os tipos de todas as colunas em 'dtype'.
+    """
+    sizer = BatchSizer(batch_size, memory_limit_mb)
+    # O tempo de cada lote inclui a criação do leitor, que já lê o início do arquivo
+    start = time.perf_counter()
+    extract_seconds, extract_bytes = (source.seconds, source.bytes) if source else (0.0, 0)
+    if backend == 'pyarrow':
+        reader = ArrowBatchReader(csv_file, dtype, skip_rows)
+    else:
+        reader = pd.read_csv(
+            csv_file, encoding='ISO-8859-1', sep=';', header=None, dtype=dtype, chunksize=batch_size,
+            skiprows=skip_rows
+        )
+    with reader:
+        next_size = batch_size
+        while True:
+            try:
+                batch = reader.get_chunk(next_size)
+            except StopIteration:
+                batch = None
+            elapsed = time.perf_counter() - start
+            if source is not None:
+                extract_seconds = source.seconds - extract_seconds
+                metrics.add('extract', extract_seconds, nbytes=source.bytes - extract_bytes)
+                # O PyArrow lê à frente em outra thread: a descompressão pode se sobrepor à leitura
+                elapsed = max(0.0, elapsed - extract_seconds)
+            if batch is None:
+                break
+            metrics.add('parse', elapsed, rows=len(batch))
+            next_size = sizer.next_size(batch)
+            yield batch
+
+            start = time.perf_counter()
+            extract_seconds, extract_bytes = (source.seconds, source.bytes) if source else (0.0, 0)
+
+
+def rename_headers(batches, layout_name):
+    """Aplica os cabeçalhos do layout da Receita em cada lote."""
+    header = LAYOUTS[layout_name]['header']
+    for batch in batches:
+        batch.columns = header
+        yield batch
+
+
+def normalize_batches(batches, layout_name):
+    """Normaliza cada lote conforme a especificação do layout."""
+    table = LAYOUTS[layout_name]['model'].__tablename__
+    for batch in batches:
+        with metrics.timer('normalize', rows=len(batch), table=table):
+            batch = normalize_frame(layout_name, batch)
+        yield batch
+
+
+def csv_pipeline(csv_file, layout_name, batch_size=BATCH_SIZE, skip_rows=0, source=None, backend=None):
+    """
+    Pipeline completo em memória: leitura -> cabeçalhos -> normalização.
+    Nenhum dado é gravado de volta em disco.
+
+    :param csv_file: Caminho ou arquivo aberto com os dados (em modo binário para o PyArrow).
+    :param layout_name: Chave do layout em LAYOUTS.
+    :param batch_size: Quantidade de registros por lote.
+    :param skip_rows: Registros iniciais a ignorar (já gravados em uma execução anterior).
+    :param source: TimedReader do arquivo compactado, para medir a descompressão (opcional).
+    :param backend: Leitor ('pandas' ou 'pyarrow'); padrão: PARSE_BACKEND.
+    """
+    batches = read_batches(
+        csv_file, batch_size, skip_rows, source, layout_dtypes(layout_name), backend=resolve_backend(backend)
+    )
+    batches = rename_headers(batches, layout_name)
+    return normalize_batches(batches, layout_name)
+
+
+def find_data_member(zip_file):
+    """
+    Escolhe, dentro do ZIP da Receita, o arquivo com os dados (ex.: K3241.K03200Y0.D50308.EMPRECSV).
+
+    :param zip_file: ZipFile aberto.
+    :return: ZipInfo do arquivo de dados ou None se o ZIP estiver vazio.
+    """
+    members = [info for info in zip_file.infolist() if not info.is_dir()]
+    for info in members:
+        name = info.filename.upper()
+        if name.endswith('CSV') or name.endswith('ESTABELE'):
+            return info
+    return members[0] if members else None
+
+
+def zip_pipeline(zip_file_path, layout_name, batch_size=BATCH_SIZE, skip_rows=0, backend=None):
+    """
+    Lê os registros direto do arquivo dentro do ZIP, sem extraí-lo para o disco.
+    A decodificação ISO-8859-1 é feita de forma incremental enquanto o ZIP é descompactado.
+
+    :param zip_file_path: Caminho do ZIP baixado da Receita.
+    :param layout_name: Chave do layout em LAYOUTS.
+    :param batch_size: Quantidade de registros por lote.
+    :param skip_rows: Registros iniciais a ignorar (já gravados em uma execução anterior).
+    :param backend: Leitor ('pandas' ou 'pyarrow'); padrão: PARSE_BACKEND.
+    """
+    backend = resolve_backend(backend)
+    with zipfile.ZipFile(zip_file_path) as zip_file:
+        member = find_data_member(zip_file)
+        if member is None:
+            raise FileNotFoundError(f"Nenhum arquivo de dados encontrado em {zip_file_path}")
+
+        print(f"Lendo {member.filename} direto do arquivo {zip_file_path}")
+        source = TimedReader(zip_file.open(member))
+        buffered = io.BufferedReader(source, READ_BUFFER_SIZE)
+        if backend == 'pyarrow':
+            # O PyArrow decodifica o ISO-8859-1 por conta própria, direto dos bytes descompactados
+            with buffered:
+                yield from csv_pipeline(buffered, layout_name, batch_size, skip_rows, source, backend)
+            return
+        with io.TextIOWrapper(buffered, encoding='ISO-8859-1', newline='') as stream:
+            yield from csv_pipeline(stream, layout_name, batch_size, skip_rows, source, backend)
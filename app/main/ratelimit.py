@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """
+    Limite de requisições por cliente (token bucket em memória): cada cliente tem um balde com até
+    'burst' fichas, repostas à taxa de 'rate' fichas por segundo, e cada requisição gasta fichas
+    conforme o seu custo. Um cliente que esgota o balde recebe 429 sem chegar ao banco, enquanto os
+    demais continuam sendo atendidos. Os limites valem por processo (cada worker do uvicorn tem os seus).
+    Seguro para uso por várias threads.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        """
+        :param rate: Fichas repostas por segundo (requisições por segundo sustentadas).
+        :param burst: Capacidade do balde (requisições seguidas permitidas após um período sem uso).
+        :param max_clients: Clientes acompanhados; os que estão há mais tempo sem requisições saem primeiro
+            (e voltam com o balde cheio).
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()  # cliente -> (fichas, horário da última reposição)
+
+    def acquire(self, key, cost=1):
+        """
+        Gasta as fichas de uma requisição do cliente, se houver.
+
+        :param key: Identificador do cliente (client_id).
+        :param cost: Fichas da requisição (ex.: proporcional aos CNPJs de uma consulta em lote);
+            custos maiores que o balde são limitados à capacidade dele.
+        :return: 0 se a requisição foi aceita, senão os segundos até haver fichas suficientes.
+        """
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return wait
@@ -0,0 +1,128 @@
+import json
+import pandas as pd
+import psycopg2
+from sqlalchemy import Numeric, String, insert
+from sqlalchemy.exc import DataError, IntegrityError
+from documents import cnpj_errors
+from metrics import metrics
+from schemas import IngestionReject
+
+# Erros causados pelos valores de um registro (e não pela conexão): o lote é dividido para isolá-los.
+# O COPY usa o cursor do psycopg2 diretamente, então os erros dele não passam pelo SQLAlchemy.
+RECORD_ERRORS = (IntegrityError, DataError, psycopg2.IntegrityError, psycopg2.DataError)
+
+MAX_ERROR_LENGTH = 1000  # Tamanho da coluna IngestionRejects.error
+
+# Colunas com documentos conferidos antes do COPY (tabela -> coluna -> função com o motivo de cada registro)
+DOCUMENT_CHECKS = {
+    'Establishments': {'cnpj': cnpj_errors},
+}
+
+
+def invalid_rows(model, frame):
+    """
+    Confere antes do COPY as regras da tabela que fariam o lote inteiro ser recusado pelo banco:
+    chave primária ou coluna NOT NULL vazia, texto maior que a coluna e número maior que a precisão.
+    Os documentos de DOCUMENT_CHECKS (ex.: dígitos verificadores do CNPJ) também são conferidos.
+
+    :param model: Classe mapeada da tabela.
+    :param frame: DataFrame com as colunas da tabela.
+    :return: Series com o motivo de cada registro inválido (nulo nos registros válidos).
+    """
+    reasons = pd.Series(None, index=frame.index, dtype=object)
+    for column, errors in DOCUMENT_CHECKS.get(model.__tablename__, {}).items():
+        if column in frame.columns:
+            reasons = reasons.where(reasons.notna(), errors(frame[column]))
+    for column in model.__table__.columns:
+        if column.name not in frame.columns:
+            continue
+        values = frame[column.name]
+        if not column.nullable:
+            reasons = reasons.where(reasons.notna() | values.notna(), f'{column.name} vazio')
+        if isinstance(column.type, String) and column.type.length and not values.isna().all():
+            lengths = values.astype(object).where(values.notna(), '').astype(str).str.len()
+            reasons = reasons.where(
+                reasons.notna() | (lengths <= column.type.length),
+                f'{column.name} maior que {column.type.length} caracteres'
+            )
+        elif isinstance(column.type, Numeric) and column.type.precision and not values.isna().all():
+            integer_digits = values.astype(str).str.split('.').str[0].str.lstrip('-').str.len()
+            max_digits = column.type.precision - (column.type.scale or 0)
+            reasons = reasons.where(
+                reasons.notna() | values.isna() | (integer_digits <= max_digits),
+                f'{column.name} maior que a precisão da coluna ({column.type.precision}, {column.type.scale})'
+            )
+    return reasons
+
+
+def split_invalid_rows(model, frame):
+    """
+    Separa os registros que o banco recusaria (ver invalid_rows).
+
+    :return: (registros válidos, registros inválidos, motivo de cada inválido)
+    """
+    reasons = invalid_rows(model, frame)
+    invalid = reasons.notna()
+    if not invalid.any():
+        return frame, frame.iloc[:0], []
+    return frame[~invalid], frame[invalid], list(reasons[invalid])
+
+
+def load_with_bisect(session, frame, load):
+    """
+    Grava o lote com load(frame) em um SAVEPOINT. Se o banco recusar algum registro, divide o lote ao meio
+    e tenta cada metade, até isolar os registros recusados; o restante do lote é gravado normalmente.
+    Erros de conexão são repassados (a carga é retomada pelo checkpoint).
+
+    :param session: Sessão do banco de dados, com a transação do lote aberta.
+    :param frame: DataFrame com as colunas da tabela.
+    :param load: Função que grava um DataFrame (ex.: partial(copy_frame_into_table, session, model)).
+    :return: (quantidade gravada, registros recusados, erro de cada recusado)
+    """
+    try:
+        with session.begin_nested():
+            return load(frame), frame.iloc[:0], []
+    except RECORD_ERRORS as e:
+        if len(frame) == 1:
+            return 0, frame, [str(getattr(e, 'orig', None) or e).strip()]
+        middle = len(frame) // 2
+        left_count, left_rejected, left_errors = load_with_bisect(session, frame.iloc[:middle], load)
+        right_count, right_rejected, right_errors = load_with_bisect(session, frame.iloc[middle:], load)
+        return left_count + right_count, pd.concat([left_rejected, right_rejected]), left_errors + right_errors
+
+
+def reject_rows(table_name, rejected, errors, month=None, file_name=None):
+    """
+    Linhas de IngestionRejects para os registros recusados (o registro é guardado em JSON).
+
+    :param table_name: Tabela de destino.
+    :param rejected: DataFrame com os registros recusados.
+    :param errors: Motivo de cada registro, na mesma ordem.
+    :param month: Mês em carga (opcional).
+    :param file_name: Partição de origem (opcional).
+    """
+    records = rejected.astype(object).where(rejected.notna(), None).to_dict('records')
+    return [
+        {
+            'table_name': table_name,
+            'error': error[:MAX_ERROR_LENGTH],
+            'record': json.dumps(record, ensure_ascii=False, default=str),
+            'month': month,
+            'file_name': file_name,
+        }
+        for record, error in zip(records, errors)
+    ]
+
+
+def save_rejects(session, table_name, rejected, errors, month=None, file_name=None):
+    """
+    Grava os registros recusados em IngestionRejects, na transação do lote (o commit fica a cargo de quem chamou).
+
+    :return: Quantidade de registros gravados.
+    """
+    if rejected.empty:
+        return 0
+    session.execute(insert(IngestionReject), reject_rows(table_name, rejected, errors, month, file_name))
+    metrics.increment('rejected_rows', len(rejected))
+    print(f"{len(rejected)} registros recusados em {table_name} (ver IngestionRejects): {errors[0]}")
+    return len(rejected)
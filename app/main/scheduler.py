@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from metrics import metrics
+
+# Limites de concorrência de cada etapa (configuráveis por variável de ambiente)
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '2'))  # Downloads simultâneos
+PREFETCH_PARTITIONS = int(os.getenv('PREFETCH_PARTITIONS', '3'))  # ZIPs em disco (baixando ou aguardando carga)
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '2'))  # Processos de leitura/normalização
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', '2'))  # Lotes gravados no banco ao mesmo tempo
+
+# Dependências entre as tabelas: as tabelas de domínio são carregadas antes das tabelas grandes.
+# Tabelas grandes não dependem umas das outras (não há chave estrangeira entre elas).
+TABLE_DEPENDENCIES = {
+    'Naturezas': [],
+    'Qualificacoes': [],
+    'Paises': [],
+    'Municipios': [],
+    'Cnaes': [],
+    'Motivos': [],
+    'Empresas': ['Naturezas', 'Qualificacoes'],
+    'Estabelecimentos': ['Paises', 'Municipios', 'Cnaes', 'Motivos'],
+    'Socios': ['Qualificacoes', 'Paises'],
+    'Simples': [],
+}
+
+
+def topological_order(file_names):
+    """
+    Ordena os arquivos respeitando TABLE_DEPENDENCIES (dependências fora da lista são ignoradas).
+
+    :raises ValueError: Se houver dependência circular.
+    """
+    requested = set(file_names)
+    ordered = []
+    visiting = set()
+
+    def visit(file_name):
+        if file_name in ordered:
+            return
+        if file_name in visiting:
+            raise ValueError(f"Dependência circular envolvendo {file_name}")
+        visiting.add(file_name)
+        for dependency in TABLE_DEPENDENCIES.get(file_name, []):
+            if dependency in requested:
+                visit(dependency)
+        visiting.discard(file_name)
+        ordered.append(file_name)
+
+    for file_name in file_names:
+        visit(file_name)
+    return ordered
+
+
+def run_schedule(file_names, list_partitions, download_partition, process_partition, initializer=None,
+                 download_workers=DOWNLOAD_WORKERS, prefetch=PREFETCH_PARTITIONS,
+                 parse_workers=PARSE_WORKERS, load_workers=LOAD_WORKERS):
+    """
+    Executa download, leitura/normalização e carga de várias tabelas em paralelo.
+
+    As partições seguintes são baixadas enquanto as anteriores estão sendo carregadas. Cada partição
+    baixada é lida e normalizada em um pool de processos, e a gravação no banco é limitada a
+    'load_workers' lotes simultâneos por um semáforo compartilhado entre os processos.
+    Uma tabela só começa depois que todas as suas dependências terminaram.
+
+    :param file_names: Arquivos a carregar (ex.: ['Cnaes', 'Empresas', 'Estabelecimentos']).
+    :param list_partitions: Função (file_name) -> nomes das partições (ex.: ['Empresas0', ...]).
+    :param download_partition: Função (partition) -> caminho do ZIP baixado.
+    :param process_partition: Função (file_name, zip_path, load_slots) executada no pool de processos;
+        se devolver um snapshot de métricas (Metrics.snapshot), ele é somado às métricas deste processo.
+    :param initializer: Função executada ao iniciar cada processo do pool (ex.: recriar conexões).
+    :param download_workers: Downloads simultâneos.
+    :param prefetch: Máximo de ZIPs em disco ao mesmo tempo (baixando, aguardando ou carregando).
+    :param parse_workers: Processos de leitura/normalização.
+    :param load_workers: Lotes gravados no banco ao mesmo tempo.
+    :return: Dicionário file_name -> lista de erros (vazia quando a tabela foi carregada por completo).
+    """
+    order = topological_order(file_names)
+    requested = set(order)
+    dependencies = {
+        file_name: {dep for dep in TABLE_DEPENDENCIES.get(file_name, []) if dep in requested}
+        for file_name in order
+    }
+    pending_partitions = {}
+    errors = {file_name: [] for file_name in order}
+    finished = set()
+    started = set()
+    download_queue = deque()
+    on_disk = 0
+
+    def start_ready_tables():
+        for file_name in order:
+            if file_name not in started and dependencies[file_name] <= finished:
+                started.add(file_name)
+                partitions = list_partitions(file_name)
+                pending_partitions[file_name] = len(partitions)
+                print(f"Iniciando {file_name} ({len(partitions)} partições)")
+                download_queue.extend((file_name, partition) for partition in partitions)
+                if not partitions:
+                    finish_partition(file_name)
+
+    def finish_partition(file_name):
+        pending_partitions[file_name] -= 1
+        if pending_partitions[file_name] <= 0:
+            finished.add(file_name)
+            status = 'com erros' if errors[file_name] else 'com sucesso'
+            print(f"Tabela {file_name} finalizada {status}.")
+            start_ready_tables()
+
+    with multiprocessing.Manager() as manager, \
+            ThreadPoolExecutor(max_workers=download_workers) as download_pool, \
+            ProcessPoolExecutor(max_workers=parse_workers, initializer=initializer) as process_pool:
+        load_slots = manager.BoundedSemaphore(load_workers)
+        running = {}
+
+        start_ready_tables()
+        while download_queue or running:
+            # Mantém até 'prefetch' partições em disco, baixando as próximas enquanto as anteriores carregam
+            while download_queue and on_disk < prefetch:
+                file_name, partition = download_queue.popleft()
+                future = download_pool.submit(download_partition, partition)
+                running[future] = ('download', file_name, partition)
+                on_disk += 1
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, file_name, partition = running.pop(future)
+                try:
+                    result = future.result()
+                except FileNotFoundError:
+                    print(f"Partição {partition} não encontrada no servidor, ignorando.")
+                    on_disk -= 1
+                    finish_partition(file_name)
+                    continue
+                except Exception as e:
+                    print(f"Erro na etapa de {stage} da partição {partition}: {e}")
+                    errors[file_name].append(f'{partition}: {e}')
+                    on_disk -= 1
+                    finish_partition(file_name)
+                    continue
+
+                if stage == 'download':
+                    load_future = process_pool.submit(process_partition, file_name, result, load_slots)
+                    running[load_future] = ('carga', file_name, partition)
+                else:
+                    if result:
+                        metrics.merge(result)
+                    on_disk -= 1
+                    print(f"Partição {partition} carregada.")
+                    finish_partition(file_name)
+
+    return errors
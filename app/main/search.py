@@ -0,0 +1,180 @@
+import os
+import time
+import pandas as pd
+from sqlalchemy import func, literal_column, or_, select, text, union_all
+from bd import engine
+from loader import quote_identifier
+from lookups import lookups
+from metrics import log_event, metrics
+from normalizer import normalize_search_text
+from schemas import SEARCH_CONFIG, City, Cnae, Company, Establishment, EstablishmentSecondaryCnae, search_vector
+
+SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT', '20'))  # Resultados por busca, se não informado
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', '100'))  # Máximo de resultados por busca
+SEARCH_MIN_LENGTH = 3  # Letras e dígitos do nome buscado (prefixos menores encontram boa parte da base)
+
+# Tabelas com a coluna normalizada search_name e o índice do texto de busca (ver schemas.search_index)
+SEARCH_MODELS = [Company, Establishment]
+
+
+def search_term(name):
+    """Termo buscado no mesmo formato das colunas search_name (sem acentos, maiúsculas, ...)."""
+    return normalize_search_text(pd.Series([name], dtype=object)).iloc[0] or ''
+
+
+def search_query(term):
+    """Consulta com todas as palavras do termo, só a última como prefixo ('PADARIA SAO JO' -> 'PADARIA & SAO & JO:*')."""
+    *words, last = term.split()
+    return func.to_tsquery(literal_column(SEARCH_CONFIG), ' & '.join([*words, f'{last}:*']))
+
+
+def city_codes(city):
+    """
+    Códigos de município do filtro: o próprio código (ex.: '7107') ou os códigos dos municípios com o nome
+    informado, com ou sem acentos (ex.: 'São Paulo'; nomes repetidos em outras UFs trazem todos os códigos).
+    """
+    city = city.strip()
+    if city.isdigit():
+        return [city]
+    cities = lookups.table(City)
+    names = normalize_search_text(pd.Series(cities.to_numpy(), dtype=object))
+    return cities.index[(names == search_term(city)).to_numpy()].tolist()
+
+
+def establishment_filters(uf=None, cities=None, cnae=None):
+    """Condições dos filtros da busca sobre Establishments (UF, municípios e CNAE principal ou secundário)."""
+    filters = []
+    if uf:
+        filters.append(Establishment.uf == uf.strip().upper())
+    if cities is not None:
+        filters.append(Establishment.city.in_(cities))
+    if cnae:
+        filters.append(or_(
+            Establishment.cnae_main == cnae,
+            Establishment.cnpj.in_(
+                select(EstablishmentSecondaryCnae.cnpj).where(EstablishmentSecondaryCnae.cnae == cnae)
+            ),
+        ))
+    return filters
+
+
+def search_statement(term, uf=None, cities=None, cnae=None, limit=SEARCH_LIMIT):
+    """
+    SELECT da busca por nome: os estabelecimentos cujo nome fantasia contém as palavras do termo e os
+    estabelecimentos das empresas cuja razão social contém as palavras do termo são encontrados pelos
+    índices GIN do texto de busca (search_name), filtrados e ordenados pela relevância (ts_rank, que
+    favorece os nomes mais curtos) entre os dois nomes.
+
+    :param term: Termo já normalizado (ver search_term).
+    :param uf: Sigla da UF (opcional).
+    :param cities: Códigos de município (opcional).
+    :param cnae: Código do CNAE principal ou secundário (opcional).
+    :param limit: Quantidade máxima de estabelecimentos.
+    """
+    filters = establishment_filters(uf, cities, cnae)
+    query = search_query(term)
+    fantasy_name = search_vector(Establishment.search_name)
+    company_name = search_vector(Company.search_name)
+    by_fantasy_name = select(
+        Establishment.cnpj, func.ts_rank(fantasy_name, query, 1).label('score')
+    ).where(fantasy_name.op('@@')(query), *filters)
+    # MATERIALIZED: as empresas são lidas primeiro pelo índice e só então ligadas aos estabelecimentos
+    # (a estimativa de registros de uma busca por prefixo pode levar o PostgreSQL a percorrer Companies inteira)
+    company_matches = select(
+        Company.base_cnpj, func.ts_rank(company_name, query, 1).label('score')
+    ).where(company_name.op('@@')(query)).cte('company_matches').prefix_with('MATERIALIZED')
+    by_company_name = select(Establishment.cnpj, company_matches.c.score).join(
+        company_matches, company_matches.c.base_cnpj == Establishment.base_cnpj
+    ).where(*filters)
+
+    matches = union_all(by_fantasy_name, by_company_name).subquery('matches')
+    ranked = (
+        select(matches.c.cnpj, func.max(matches.c.score).label('score'))
+        .group_by(matches.c.cnpj)
+        .order_by(func.max(matches.c.score).desc(), matches.c.cnpj)
+        .limit(limit)
+        .subquery('ranked')
+    )
+    return (
+        select(
+            ranked.c.score,
+            Establishment.cnpj,
+            Establishment.base_cnpj,
+            Establishment.cnpj_order,
+            Establishment.cnpj_dv,
+            Establishment.fantasy_name,
+            Company.social_reason_business_name,
+            Establishment.identifier_branch_matriz,
+            Establishment.cadastral_situation,
+            Establishment.uf,
+            Establishment.city,
+            Establishment.cnae_main,
+        )
+        .join_from(ranked, Establishment, Establishment.cnpj == ranked.c.cnpj)
+        .outerjoin(Company, Company.base_cnpj == Establishment.base_cnpj)
+        .order_by(ranked.c.score.desc(), Establishment.cnpj)
+    )
+
+
+def search_establishments(session, name, uf=None, city=None, cnae=None, limit=SEARCH_LIMIT):
+    """
+    Busca de estabelecimentos pela razão social ou pelo nome fantasia, sem diferenciar acentos e maiúsculas
+    (a última palavra pode estar incompleta), com filtros opcionais.
+
+    Exemplo:
+        with session_scope() as session:
+            results = search_establishments(session, 'padaria sao jose', uf='SP', cnae='1091102')
+
+    :param session: Sessão do banco de dados (PostgreSQL).
+    :param name: Nome buscado.
+    :param uf: Sigla da UF (opcional).
+    :param city: Código ou nome do município (opcional).
+    :param cnae: Código do CNAE principal ou secundário (opcional).
+    :param limit: Quantidade máxima de resultados (até SEARCH_MAX_LIMIT).
+    :return: Lista de dicionários, do mais relevante para o menos relevante.
+    :raises ValueError: Se o nome tiver menos de SEARCH_MIN_LENGTH letras ou dígitos.
+    """
+    term = search_term(name)
+    if len(term.replace(' ', '')) < SEARCH_MIN_LENGTH:
+        raise ValueError(f'Informe ao menos {SEARCH_MIN_LENGTH} letras ou dígitos do nome')
+    cities = city_codes(city) if city else None
+    if cities == []:
+        return []
+
+    start = time.perf_counter()
+    rows = session.execute(
+        search_statement(term, uf, cities, cnae, min(limit, SEARCH_MAX_LIMIT))
+    ).mappings().all()
+    metrics.observe('search_seconds', time.perf_counter() - start)
+
+    results = []
+    for row in rows:
+        result = dict(row)
+        result['score'] = round(float(row['score']), 4)
+        result['city_description'] = lookups.description(City, row['city'])
+        result['cnae_main_description'] = lookups.description(Cnae, row['cnae_main'])
+        results.append(result)
+    return results
+
+
+def refresh_search_indexes():
+    """
+    Executada ao fim de uma carga: os registros gravados ficam na lista pendente de cada índice GIN
+    (fastupdate) e são incorporados ao índice de uma vez, em vez de a cada lote; depois as estatísticas
+    das tabelas (inclusive do texto de busca) são atualizadas. A carga completa não precisa dela,
+    pois os índices são criados depois da carga.
+    """
+    start = time.perf_counter()
+    try:
+        with engine.begin() as connection:
+            for model in SEARCH_MODELS:
+                table = quote_identifier(model.__tablename__)
+                connection.execute(
+                    text('SELECT gin_clean_pending_list(to_regclass(:index))'),
+                    {'index': quote_identifier(f'ix_{model.__tablename__}_search_name')}
+                )
+                connection.exec_driver_sql(f'ANALYZE {table}')
+    except Exception as e:
+        print(f"Erro ao atualizar os índices de busca por nome: {e}")
+        return
+    log_event('search_indexes_refreshed', seconds=round(time.perf_counter() - start, 3))
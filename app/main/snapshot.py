@@ -0,0 +1,156 @@
+import glob
+import os
+import re
+import time
+from sqlalchemy import BigInteger, Boolean, DateTime, Integer, Numeric
+from metrics import metrics
+from pipeline import BATCH_SIZE
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # PyArrow é opcional; sem ele não há cópia em Parquet
+    pa = None
+
+# Pasta da cópia em Parquet de cada carga mensal (desligada se não definida)
+SNAPSHOT_FOLDER = os.getenv('SNAPSHOT_FOLDER')
+SNAPSHOT_COMPRESSION = os.getenv('SNAPSHOT_COMPRESSION', 'zstd')
+
+# Colunas usadas como pastas (formato Hive, ex.: Establishments/uf=SP/), para que consultas
+# por UF leiam só os arquivos da UF
+SNAPSHOT_PARTITION_COLUMNS = {
+    'Establishments': ['uf'],
+}
+
+
+def snapshot_path(month, table_name, folder=SNAPSHOT_FOLDER):
+    """Pasta da cópia de uma tabela no mês (ex.: <SNAPSHOT_FOLDER>/2025-03/Establishments)."""
+    return os.path.join(folder, month, table_name)
+
+
+def arrow_type(column):
+    """Tipo do Arrow equivalente ao tipo da coluna no banco (texto quando não há equivalente)."""
+    if isinstance(column.type, Numeric):
+        return pa.decimal128(column.type.precision, column.type.scale)
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column.type, BigInteger):
+        return pa.int64()
+    if isinstance(column.type, Integer):
+        return pa.int32()
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    return pa.string()
+
+
+def snapshot_schema(model):
+    """Schema do Parquet com as colunas e os tipos da tabela, igual em todos os arquivos da tabela."""
+    return pa.schema([(column.name, arrow_type(column)) for column in model.__table__.columns])
+
+
+def partitioning(table_name):
+    """Particionamento Hive da tabela (ver SNAPSHOT_PARTITION_COLUMNS) ou None."""
+    columns = SNAPSHOT_PARTITION_COLUMNS.get(table_name)
+    if not columns:
+        return None
+    return ds.partitioning(pa.schema([(column, pa.string()) for column in columns]), flavor='hive')
+
+
+def discard_batches(root, partition, first_batch):
+    """
+    Apaga os arquivos da partição a partir do lote 'first_batch' (gravados antes de uma falha e que
+    serão gravados de novo ao retomar a carga).
+    """
+    pattern = re.compile(rf'^{re.escape(partition)}-(\d+)-\d+\.parquet$')
+    for path in glob.glob(os.path.join(root, '**', f'{partition}-*.parquet'), recursive=True):
+        match = pattern.match(os.path.basename(path))
+        if match and int(match.group(1)) >= first_batch:
+            os.remove(path)
+
+
+class SnapshotWriter:
+    """
+    Grava os lotes normalizados de uma partição em Parquet, como saída adicional da mesma leitura
+    usada na carga do banco. Cada lote vira um arquivo:
+
+        <SNAPSHOT_FOLDER>/<mês>/<tabela>/[uf=SP/]<partição>-<lote>-<n>.parquet
+
+    Os arquivos podem ser lidos pelo DuckDB, pandas ou PyArrow sem acessar o banco
+    (ex.: SELECT ... FROM read_parquet('.../2025-03/Establishments/**/*.parquet', hive_partitioning=true)).
+    """
+
+    def __init__(self, month, model, partition, first_batch=0, folder=SNAPSHOT_FOLDER):
+        """
+        :param month: Mês em carga (ex.: '2025-03').
+        :param model: Classe mapeada da tabela.
+        :param partition: Nome da partição (ex.: 'Estabelecimentos7').
+        :param first_batch: Número do primeiro lote a gravar (lotes já gravados ao retomar a carga).
+        :param folder: Pasta das cópias.
+        """
+        self.table_name = model.__tablename__
+        self.root = snapshot_path(month, self.table_name, folder)
+        self.schema = snapshot_schema(model)
+        self.partitioning = partitioning(self.table_name)
+        self.partition = partition
+        self.batch = first_batch
+        self.file_options = ds.ParquetFileFormat().make_write_options(compression=SNAPSHOT_COMPRESSION)
+        discard_batches(self.root, partition, first_batch)
+
+    def write(self, frame):
+        """
+        Grava um lote (DataFrame com as colunas da tabela, como em to_table_frame).
+
+        :param frame: Lote a gravar.
+        """
+        start = time.perf_counter()
+        schema = pa.schema([self.schema.field(column) for column in frame.columns])
+        table = pa.Table.from_pandas(frame, preserve_index=False).cast(schema)
+        written = []
+        ds.write_dataset(
+            table, self.root, format='parquet', partitioning=self.partitioning,
+            basename_template=f'{self.partition}-{self.batch:05d}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore', file_options=self.file_options,
+            file_visitor=lambda written_file: written.append(written_file.size),
+        )
+        self.batch += 1
+        metrics.add('snapshot', time.perf_counter() - start, rows=len(frame), nbytes=sum(written), table=self.table_name)
+
+
+def open_snapshot(month, model, partition, first_batch=0):
+    """
+    Abre a cópia em Parquet da partição, se SNAPSHOT_FOLDER estiver configurada.
+
+    :return: SnapshotWriter ou None quando a cópia está desligada.
+    :raises RuntimeError: Se SNAPSHOT_FOLDER estiver configurada e o PyArrow não estiver instalado.
+    """
+    if not SNAPSHOT_FOLDER:
+        return None
+    if pa is None:
+        raise RuntimeError("SNAPSHOT_FOLDER configurada, mas o PyArrow não está instalado (pip install pyarrow)")
+    return SnapshotWriter(month, model, partition, first_batch)
+
+
+def read_snapshot(month, model, batch_size=BATCH_SIZE, folder=SNAPSHOT_FOLDER):
+    """
+    Lê a cópia em Parquet de uma tabela em lotes de DataFrames com as colunas da tabela
+    (prontos para copy_frame_into_table).
+
+    :param month: Mês da cópia (ex.: '2025-03').
+    :param model: Classe mapeada da tabela.
+    :param batch_size: Quantidade máxima de registros por lote.
+    :param folder: Pasta das cópias.
+    :raises FileNotFoundError: Se não houver cópia da tabela no mês.
+    """
+    if not folder:
+        raise RuntimeError("SNAPSHOT_FOLDER não configurada (defina no .env)")
+    if pa is None:
+        raise RuntimeError("A leitura da cópia em Parquet exige o PyArrow (pip install pyarrow)")
+    table_name = model.__tablename__
+    root = snapshot_path(month, table_name, folder)
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"Cópia em Parquet de {table_name} não encontrada em {root}")
+
+    dataset = ds.dataset(root, format='parquet', partitioning=partitioning(table_name))
+    for batch in dataset.to_batches(batch_size=batch_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
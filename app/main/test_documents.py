@@ -0,0 +1,62 @@
+"""
+Testes da validação e composição vetorizadas dos CNPJs (documents.py).
+
+Executar na pasta app/main:
+    python -m unittest test_documents
+"""
+import unittest
+import pandas as pd
+from documents import clean_cnpj, cnpj_check_digits, cnpj_errors, compose_cnpj, valid_cnpj, zero_pad
+
+
+class CheckDigitsTest(unittest.TestCase):
+
+    def test_numeric_and_alphanumeric(self):
+        # '12ABC34501DE35' é o exemplo de CNPJ alfanumérico publicado pela Receita
+        values = pd.Series(['11222333000181', '12ABC34501DE35', '11222333000182', '12ABC34501DE36'])
+        self.assertEqual(valid_cnpj(values).tolist(), [True, True, False, False])
+
+    def test_check_digits_from_roots(self):
+        roots = pd.Series(['112223330001', '12ABC34501DE', '000000000001'], index=[10, 20, 30])
+        digits = cnpj_check_digits(roots)
+        self.assertEqual(digits.tolist(), ['81', '35', '91'])
+        self.assertEqual(digits.index.tolist(), [10, 20, 30])
+        self.assertTrue(valid_cnpj(roots + digits).all())
+
+    def test_empty_roots(self):
+        self.assertEqual(cnpj_check_digits(pd.Series([], dtype=object)).tolist(), [])
+
+    def test_errors(self):
+        values = pd.Series(['11222333000181', '11222333000182', '1122233300018', '11222333ab0181', None])
+        self.assertEqual(cnpj_errors(values).tolist(), [
+            None,
+            'cnpj com dígitos verificadores inválidos',
+            'cnpj fora do formato (14 caracteres)',
+            'cnpj fora do formato (14 caracteres)',
+            None,
+        ])
+
+
+class ComposeTest(unittest.TestCase):
+
+    def test_parts_are_zero_padded(self):
+        cnpjs = compose_cnpj(
+            pd.Series(['11222333', '1', '12ABC345', '11222333']),
+            pd.Series(['1', '0001', '01DE', None]),
+            pd.Series(['81', '5', '35', '81'])
+        )
+        self.assertEqual(cnpjs.tolist()[:3], ['11222333000181', '00000001000105', '12ABC34501DE35'])
+        self.assertTrue(pd.isna(cnpjs.iloc[3]))
+
+    def test_zero_pad(self):
+        padded = zero_pad(pd.Series(['1', '0001', '', None]), 4)
+        self.assertEqual(padded.tolist()[:2], ['0001', '0001'])
+        self.assertTrue(padded.iloc[2:].isna().all())
+
+    def test_clean_cnpj(self):
+        self.assertEqual(clean_cnpj('11.222.333/0001-81'), '11222333000181')
+        self.assertEqual(clean_cnpj('12.abc.345/01de-35'), '12ABC34501DE35')
+
+
+if __name__ == '__main__':
+    unittest.main()
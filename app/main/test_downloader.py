@@ -0,0 +1,149 @@
+"""
+Testes do download com retomada (downloader.py) contra um http.server local com suporte a Range.
+
+Executar na pasta app/main:
+    python -m unittest test_downloader
+"""
+import functools
+import http.server
+import os
+import re
+import tempfile
+import threading
+import unittest
+import downloader
+from downloader import DownloadError, DownloadState, download_file, split_ranges
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve server.content com ETag e Range (206), respeitando o If-Range: com um ETag diferente do atual,
+    a resposta é o arquivo inteiro (200). Com server.ignore_range, o Range é sempre ignorado.
+    Cada requisição fica em server.requests (método, Range, If-Range).
+    """
+
+    def send_content(self, body):
+        server = self.server
+        size = len(server.content)
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        server.requests.append((self.command, range_header, if_range))
+        partial = range_header and not server.ignore_range and (if_range is None or if_range == server.etag)
+        if partial:
+            start, end = re.match(r'bytes=(\d+)-(\d*)', range_header).groups()
+            start, end = int(start), int(end) if end else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            data = server.content[start:end + 1]
+        else:
+            self.send_response(200)
+            data = server.content
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.send_content(body=False)
+
+    def do_GET(self):
+        self.send_content(body=True)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+        self.server.content = os.urandom(300000)
+        self.server.etag = '"v1"'
+        self.server.ignore_range = False
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/Empresas0.zip'
+        self.folder = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.folder.name, 'Empresas0.zip')
+        self.download = functools.partial(download_file, self.url, self.dest, parts=3, max_retries=1, backoff_factor=0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.folder.cleanup()
+
+    def write_partial(self, content, etag, downloaded):
+        """Simula um download interrompido: os primeiros 'downloaded' bytes de cada parte já estão no .part."""
+        ranges = split_ranges(len(content), 3)
+        with open(f'{self.dest}.part', 'wb') as fd:
+            fd.truncate(len(content))
+            for rng in ranges:
+                fd.seek(rng['start'])
+                fd.write(content[rng['start']:rng['start'] + downloaded])
+                rng['offset'] = rng['start'] + downloaded
+        DownloadState(self.dest, self.url, len(content), etag, ranges).save()
+
+    def downloaded_content(self):
+        with open(self.dest, 'rb') as fd:
+            return fd.read()
+
+    def test_download_in_parts(self):
+        self.download()
+        self.assertEqual(self.downloaded_content(), self.server.content)
+        self.assertFalse(os.path.exists(f'{self.dest}.part.json'))
+        ranges = [request[1] for request in self.server.requests if request[0] == 'GET']
+        self.assertEqual(len(ranges), 3)
+
+    def test_resume_partial_download(self):
+        self.write_partial(self.server.content, self.server.etag, downloaded=40000)
+        self.download()
+        self.assertEqual(self.downloaded_content(), self.server.content)
+        # Só o que faltava de cada parte foi pedido, com o If-Range do ETag salvo
+        gets = [request for request in self.server.requests if request[0] == 'GET']
+        self.assertEqual(
+            sorted(request[1] for request in gets),
+            sorted(f"bytes={rng['start'] + 40000}-{rng['end']}" for rng in split_ranges(len(self.server.content), 3))
+        )
+        self.assertTrue(all(request[2] == '"v1"' for request in gets))
+
+    def test_changed_etag_restarts_from_zero(self):
+        old_content = os.urandom(len(self.server.content))
+        self.write_partial(old_content, '"v0"', downloaded=40000)
+        self.download()
+        self.assertEqual(self.downloaded_content(), self.server.content)
+        starts = sorted(request[1] for request in self.server.requests if request[0] == 'GET')
+        self.assertEqual(starts, sorted(f"bytes={rng['start']}-{rng['end']}" for rng in split_ranges(len(self.server.content), 3)))
+
+    def test_full_response_to_range_request(self):
+        self.server.ignore_range = True
+        with self.assertRaises(DownloadError):
+            self.download()
+        # Nada do download recusado fica para ser retomado
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertFalse(os.path.exists(f'{self.dest}.part'))
+        self.assertFalse(os.path.exists(f'{self.dest}.part.json'))
+
+    def test_file_changed_during_download(self):
+        # O ETag muda depois do HEAD: o If-Range faz o servidor responder 200 e o download é descartado
+        original_fetch = downloader.fetch_remote_info
+
+        def fetch_then_change(url, session=None):
+            info = original_fetch(url, session)
+            self.server.etag = '"v2"'
+            return info
+
+        downloader.fetch_remote_info = fetch_then_change
+        try:
+            with self.assertRaises(DownloadError):
+                self.download()
+        finally:
+            downloader.fetch_remote_info = original_fetch
+        self.assertFalse(os.path.exists(f'{self.dest}.part'))
+        self.download()
+        self.assertEqual(self.downloaded_content(), self.server.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Testes do índice de impressões digitais da carga incremental (fingerprints.py).
+
+Executar na pasta app/main:
+    python -m unittest test_fingerprints
+"""
+import os
+import tempfile
+import unittest
+import pandas as pd
+from fingerprints import FingerprintIndex
+
+
+def companies(rows):
+    """DataFrame com a chave 'base_cnpj' e uma coluna de conteúdo, a partir de pares (chave, nome)."""
+    return pd.DataFrame(rows, columns=['base_cnpj', 'name'])
+
+
+class FingerprintIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.path = os.path.join(self.folder.name, 'fingerprints', 'companies.sqlite')
+
+    def open(self, month, key_columns=('base_cnpj',)):
+        index = FingerprintIndex(self.path, month, key_columns)
+        self.addCleanup(index.close)
+        return index
+
+    def load(self, index, frame):
+        """Carga de um lote que chega ao commit: compara, grava e confirma."""
+        changed = index.diff(frame)
+        index.record()
+        index.confirm()
+        return changed.tolist()
+
+    def test_only_new_or_changed_rows(self):
+        index = self.open('2025-03')
+        self.assertEqual(self.load(index, companies([('1', 'A'), ('2', 'B')])), [True, True])
+        changed = index.diff(companies([('1', 'A'), ('2', 'B2'), ('3', 'C')]))
+        self.assertEqual(changed.tolist(), [False, True, True])
+
+    def test_unconfirmed_batch_is_sent_again(self):
+        # O processo caiu entre o record() e o commit no banco: o lote não pode ser considerado gravado
+        index = self.open('2025-03')
+        index.diff(companies([('1', 'A'), ('2', 'B')]))
+        index.record()
+        index.close()
+
+        index = self.open('2025-03')
+        self.assertEqual(self.load(index, companies([('1', 'A'), ('2', 'B')])), [True, True])
+        self.assertEqual(index.diff(companies([('1', 'A'), ('2', 'B')])).tolist(), [False, False])
+
+    def test_excluded_rows_are_sent_again(self):
+        index = self.open('2025-03')
+        frame = companies([('1', 'A'), ('2', 'B')])
+        index.diff(frame)
+        index.exclude(frame.iloc[[1]])
+        index.record()
+        index.confirm()
+        self.assertEqual(index.diff(frame).tolist(), [False, True])
+
+    def test_stale_batches(self):
+        key_columns = ('base_cnpj', 'partner_name')
+        index = self.open('2025-02', key_columns)
+        partners = pd.DataFrame(
+            [('1', 'ANA', 'x'), ('1', 'BIA', 'y'), ('2', 'ANA', 'z')], columns=['base_cnpj', 'partner_name', 'role']
+        )
+        self.load(index, partners)
+        index.close()
+
+        index = self.open('2025-03', key_columns)
+        self.load(index, partners.iloc[[0, 2]])
+        stale = pd.concat(index.stale_batches(batch_size=1), ignore_index=True)
+        self.assertEqual(stale.to_dict('records'), [{'base_cnpj': '1', 'partner_name': 'BIA'}])
+
+        index.forget(stale)
+        self.assertEqual(list(index.stale_batches()), [])
+        self.assertEqual(index.diff(partners).tolist(), [False, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Testes da carga com retomada (checkpoints) e da carga incremental (impressões digitais) contra um
+PostgreSQL de teste. Os registros usam CNPJs fictícios e meses de 1990, apagados ao fim de cada teste.
+
+Executar na pasta app/main (o banco informado em TEST_DATABASE_URL recebe as tabelas que faltarem):
+    TEST_DATABASE_URL=postgresql+psycopg2://... python -m unittest test_incremental
+"""
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from functools import partial
+from unittest import mock
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')  # Banco de teste; sem ele os testes são ignorados
+if TEST_DATABASE_URL:
+    # Antes de importar bd.py: os testes nunca usam o DATABASE_URL do .env
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    from sqlalchemy import delete, select
+    import main
+    from bd import create_schema, session_scope
+    from fingerprints import FingerprintIndex
+    from pipeline import zip_pipeline
+    from schemas import Company, IngestionCheckpoint
+
+MONTHS = ['1990-01', '1990-02']
+BASE_CNPJS = [f'990000{number:02d}' for number in range(1, 7)]
+
+
+def write_companies_zip(path, names):
+    """ZIP no formato da Receita com uma empresa por par (CNPJ básico, razão social)."""
+    lines = [f'"{base_cnpj}";"{name}";"2062";"49";"1000,00";"01";""' for base_cnpj, name in names]
+    with zipfile.ZipFile(path, 'w') as zip_file:
+        zip_file.writestr('K3241.K03200Y0.D90108.EMPRECSV', '\n'.join(lines).encode('ISO-8859-1'))
+    return path
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'TEST_DATABASE_URL não configurada')
+class IncrementalLoadTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        create_schema()
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.addCleanup(self.clean_database)
+        patches = [
+            mock.patch.object(main, 'FINGERPRINTS_FOLDER_PATH', os.path.join(self.folder.name, 'fingerprints')),
+            # Lotes de 2 registros, para que a falha aconteça no meio do arquivo
+            mock.patch.object(main, 'zip_pipeline', partial(zip_pipeline, batch_size=2)),
+            mock.patch.object(main.time, 'sleep'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def clean_database(self):
+        with session_scope() as session:
+            session.execute(delete(Company).where(Company.base_cnpj.in_(BASE_CNPJS)))
+            session.execute(delete(IngestionCheckpoint).where(IngestionCheckpoint.month.in_(MONTHS)))
+
+    def load(self, month_label, names):
+        zip_path = write_companies_zip(os.path.join(self.folder.name, 'Empresas.zip'), names)
+        main.process_partition('Empresas', zip_path, month_label=month_label, incremental=True)
+
+    def companies(self):
+        with session_scope() as session:
+            rows = session.execute(
+                select(Company.base_cnpj, Company.social_reason_business_name)
+                .where(Company.base_cnpj.in_(BASE_CNPJS)).order_by(Company.base_cnpj)
+            )
+            return [tuple(row) for row in rows]
+
+    def checkpoint(self, month_label):
+        with session_scope() as session:
+            saved = session.get(IngestionCheckpoint, (month_label, 'Empresas'))
+            return saved.rows_committed, saved.batches_committed, saved.completed
+
+    def test_resume_after_failed_batch(self):
+        names = [(base_cnpj, f'EMPRESA {base_cnpj}') for base_cnpj in BASE_CNPJS]
+        loaded = []
+        load_frame = main.load_frame
+
+        def failing_load_frame(session, model, frame, *args, **kwargs):
+            loaded.append(frame['base_cnpj'].tolist())
+            if len(loaded) == 2:
+                raise ConnectionError('conexão perdida')
+            return load_frame(session, model, frame, *args, **kwargs)
+
+        with mock.patch.object(main, 'load_frame', failing_load_frame):
+            self.load(MONTHS[0], names)
+
+        # O segundo lote falhou e foi enviado de novo; o primeiro não foi relido
+        self.assertEqual(loaded, [BASE_CNPJS[0:2], BASE_CNPJS[2:4], BASE_CNPJS[2:4], BASE_CNPJS[4:6]])
+        self.assertEqual(self.companies(), names)
+        self.assertEqual(self.checkpoint(MONTHS[0]), (6, 3, True))
+
+    def test_batch_recorded_without_commit_is_sent_again(self):
+        # O índice recebe o lote, mas o commit no banco não acontece (queda entre os dois)
+        names = [(base_cnpj, f'EMPRESA {base_cnpj}') for base_cnpj in BASE_CNPJS]
+        record = FingerprintIndex.record
+        calls = []
+
+        def record_then_fail(index):
+            record(index)
+            calls.append(index)
+            if len(calls) == 2:
+                raise ConnectionError('conexão perdida')
+
+        with mock.patch.object(FingerprintIndex, 'record', record_then_fail):
+            self.load(MONTHS[0], names)
+
+        self.assertEqual(self.companies(), names)
+        self.assertEqual(self.checkpoint(MONTHS[0]), (6, 3, True))
+
+    def test_next_month_updates_and_removes_rows(self):
+        names = [(base_cnpj, f'EMPRESA {base_cnpj}') for base_cnpj in BASE_CNPJS]
+        self.load(MONTHS[0], names)
+
+        next_month = [(BASE_CNPJS[1], 'EMPRESA ALTERADA')] + names[2:]
+        loaded = []
+        load_frame = main.load_frame
+
+        def tracking_load_frame(session, model, frame, *args, **kwargs):
+            loaded.extend(frame['base_cnpj'].tolist())
+            return load_frame(session, model, frame, *args, **kwargs)
+
+        with mock.patch.object(main, 'load_frame', tracking_load_frame):
+            self.load(MONTHS[1], next_month)
+        main.remove_stale_rows('Empresas', MONTHS[1])
+
+        # Só o registro alterado foi enviado; o que saiu da base foi apagado
+        self.assertEqual(loaded, [BASE_CNPJS[1]])
+        self.assertEqual(self.companies(), next_month)
+
+
+if __name__ == '__main__':
+    unittest.main()
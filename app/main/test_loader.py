@@ -0,0 +1,49 @@
+"""
+Testes do SQL da carga com COPY em staging e merge em conjunto (loader.py).
+
+Executar na pasta app/main:
+    python -m unittest test_loader
+"""
+import unittest
+import pandas as pd
+from sqlalchemy import Column, MetaData, String, Table
+from loader import build_merge_sql, frame_to_csv
+
+metadata = MetaData()
+partners = Table(
+    'Partners', metadata,
+    Column('base_cnpj', String, primary_key=True),
+    Column('partner_name', String, primary_key=True),
+    Column('role', String),
+    Column('created_at', String),
+)
+
+
+class BuildMergeSqlTest(unittest.TestCase):
+
+    def test_last_occurrence_of_a_key_wins(self):
+        sql = build_merge_sql(partners, 'stg_Partners', ['base_cnpj', 'partner_name', 'role'])
+        # Uma chave repetida no lote fica com o último registro (maior posição no COPY)
+        self.assertIn('SELECT DISTINCT ON ("base_cnpj", "partner_name")', sql)
+        self.assertIn('ORDER BY "base_cnpj", "partner_name", "load_seq" DESC', sql)
+        self.assertIn('ON CONFLICT ("base_cnpj", "partner_name") DO UPDATE SET "role" = EXCLUDED."role"', sql)
+
+    def test_created_at_is_not_updated(self):
+        sql = build_merge_sql(partners, 'stg_Partners', ['base_cnpj', 'partner_name', 'role', 'created_at'])
+        self.assertNotIn('"created_at" = EXCLUDED', sql)
+
+    def test_only_key_columns(self):
+        sql = build_merge_sql(partners, 'stg_Partners', ['base_cnpj', 'partner_name'])
+        self.assertTrue(sql.endswith('DO NOTHING'))
+
+
+class FrameToCsvTest(unittest.TestCase):
+
+    def test_nulls_and_empty_strings(self):
+        frame = pd.DataFrame({'base_cnpj': ['00000001', '00000002'], 'role': [None, '']})
+        # Com NULL '\N' no COPY, o campo vazio sem aspas continua sendo uma string vazia
+        self.assertEqual(frame_to_csv(frame).read(), '00000001,\\N\n00000002,\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
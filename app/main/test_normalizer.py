@@ -0,0 +1,52 @@
+"""
+Testes da normalização vetorizada das colunas (normalizer.py).
+
+Executar na pasta app/main:
+    python -m unittest test_normalizer
+"""
+import unittest
+import pandas as pd
+from normalizer import normalize_date, normalize_decimal, normalize_digits, normalize_text
+
+
+class NormalizeDecimalTest(unittest.TestCase):
+
+    def normalize(self, values, dtype=object):
+        return normalize_decimal(pd.Series(values, dtype=dtype)).tolist()
+
+    def test_thousands_separator(self):
+        self.assertEqual(
+            self.normalize(['1.234,56', '1.000.000,00', '1000,00', ' 12,5 ', '-3,1']),
+            ['1234.56', '1000000.00', '1000.00', '12.5', '-3.1']
+        )
+
+    def test_invalid_values_become_null(self):
+        # Um valor que não é número não pode virar um capital social inventado ('0')
+        self.assertEqual(self.normalize(['abc', '1,2,3', '12a']), [None, None, None])
+
+    def test_missing_values_use_default(self):
+        self.assertEqual(self.normalize([None, '', 'nan']), ['0', '0', '0'])
+
+    def test_pyarrow_strings(self):
+        self.assertEqual(self.normalize(['1.234,56', 'abc', None], dtype='string[pyarrow]'), ['1234.56', None, '0'])
+
+
+class NormalizeColumnsTest(unittest.TestCase):
+
+    def test_date(self):
+        dates = normalize_date(pd.Series(['20250315', '00000000', '2025031', None], dtype=object))
+        self.assertEqual(dates.iloc[0], pd.Timestamp('2025-03-15'))
+        self.assertTrue(dates.iloc[1:].isna().all())
+
+    def test_digits(self):
+        values = pd.Series(['00.123-4', '', None, '007'], dtype=object)
+        self.assertEqual(normalize_digits(values).tolist(), ['001234', '0', '0', '007'])
+        self.assertEqual(normalize_digits(values, strip_zeros=True).tolist(), ['1234', '0', '0', '7'])
+
+    def test_text(self):
+        values = pd.Series([' ABC ', 'nan', None, ''], dtype=object)
+        self.assertEqual(normalize_text(values, default='-').tolist(), ['ABC', '-', '-', '-'])
+
+
+if __name__ == '__main__':
+    unittest.main()
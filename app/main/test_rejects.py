@@ -0,0 +1,84 @@
+"""
+Testes do isolamento dos registros recusados pelo banco (rejects.py), sem banco de dados: a sessão
+só abre os SAVEPOINTs e a gravação recusa os lotes que contêm um registro inválido.
+
+Executar na pasta app/main:
+    python -m unittest test_rejects
+"""
+import json
+import unittest
+from contextlib import nullcontext
+import pandas as pd
+from sqlalchemy.exc import IntegrityError, OperationalError
+from rejects import load_with_bisect, reject_rows
+
+
+class FakeSession:
+    """Sessão que só conta os SAVEPOINTs abertos."""
+
+    def __init__(self):
+        self.savepoints = 0
+
+    def begin_nested(self):
+        self.savepoints += 1
+        return nullcontext()
+
+
+def load_refusing(keys, error=IntegrityError):
+    """Gravação que recusa o lote inteiro quando ele contém uma das chaves; devolve os lotes gravados."""
+    loaded = []
+
+    def load(frame):
+        bad = frame['base_cnpj'].isin(keys)
+        if bad.any():
+            raise error('COPY', None, Exception(f"chave duplicada {frame['base_cnpj'][bad].iloc[0]}"))
+        loaded.append(frame['base_cnpj'].tolist())
+        return len(frame)
+
+    return load, loaded
+
+
+class LoadWithBisectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = pd.DataFrame({'base_cnpj': [f'{number:08d}' for number in range(8)]})
+
+    def test_valid_batch_is_loaded_at_once(self):
+        session = FakeSession()
+        load, loaded = load_refusing([])
+        written, refused, errors = load_with_bisect(session, self.frame, load)
+        self.assertEqual((written, len(refused), errors), (8, 0, []))
+        self.assertEqual(session.savepoints, 1)
+        self.assertEqual(len(loaded), 1)
+
+    def test_refused_rows_are_isolated(self):
+        load, loaded = load_refusing(['00000002', '00000007'])
+        written, refused, errors = load_with_bisect(FakeSession(), self.frame, load)
+        self.assertEqual(written, 6)
+        self.assertEqual(refused['base_cnpj'].tolist(), ['00000002', '00000007'])
+        self.assertEqual(errors, ['chave duplicada 00000002', 'chave duplicada 00000007'])
+        # Os demais registros são gravados uma única vez
+        self.assertEqual(
+            sorted(key for keys in loaded for key in keys),
+            ['00000000', '00000001', '00000003', '00000004', '00000005', '00000006']
+        )
+
+    def test_connection_errors_are_raised(self):
+        load, loaded = load_refusing(['00000002'], error=OperationalError)
+        with self.assertRaises(OperationalError):
+            load_with_bisect(FakeSession(), self.frame, load)
+
+
+class RejectRowsTest(unittest.TestCase):
+
+    def test_records_as_json(self):
+        rejected = pd.DataFrame({'base_cnpj': ['00000001'], 'name': [None]})
+        rows = reject_rows('Companies', rejected, ['x' * 2000], month='2025-03', file_name='Empresas0')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(json.loads(rows[0]['record']), {'base_cnpj': '00000001', 'name': None})
+        self.assertEqual(len(rows[0]['error']), 1000)
+        self.assertEqual((rows[0]['month'], rows[0]['file_name']), ('2025-03', 'Empresas0'))
+
+
+if __name__ == '__main__':
+    unittest.main()